@@ -0,0 +1,107 @@
+"""
+Batch command for analyzing a directory of hospital PDFs.
+
+Usage:
+    python batch.py INPUT_DIR -o results.jsonl [--type auto|discharge|referral] [--workers N]
+
+Each PDF is analyzed on a process pool with the same engine the Streamlit
+UI uses, and one JSON object per document is appended to the output file
+as soon as that document finishes.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Iterator, List, Optional
+
+from engine import DEFAULT_FUZZY_THRESHOLD, analyze_document
+from tracing import trace
+
+DOC_TYPE_CHOICES = {
+    "auto": None,
+    "discharge": "Discharge Summary",
+    "referral": "Referral Form",
+}
+
+def find_pdfs(input_dir: str) -> List[str]:
+    """Return every PDF below input_dir, sorted for a stable processing order."""
+    pdf_paths = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(root, name))
+    return sorted(pdf_paths)
+
+def _analyze_one(job) -> dict:
+    pdf_path, doc_type, threshold, ocr_workers, full_scan, adaptive_dpi, with_trace = job
+    start = time.perf_counter()
+    with trace(pdf_path) as document_trace:
+        try:
+            result = analyze_document(pdf_path, doc_type, threshold, ocr_workers, full_scan, adaptive_dpi)
+        except Exception as e:
+            result = {"path": pdf_path, "doc_type": doc_type, "error": f"{type(e).__name__}: {e}"}
+    result["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+    if with_trace:
+        result["trace"] = document_trace.to_json()
+    return result
+
+def run_batch(pdf_paths: List[str], doc_type: Optional[str] = None, threshold: int = DEFAULT_FUZZY_THRESHOLD,
+              workers: Optional[int] = None, chunksize: int = 1, ocr_workers: int = 1,
+              full_scan: bool = False, adaptive_dpi: bool = False, with_trace: bool = False) -> Iterator[dict]:
+    """
+    Analyze pdf_paths on a process pool and yield results in completion order.
+    ocr_workers bounds the per-document OCR pool so workers x ocr_workers stays near the core count.
+    with_trace adds each document's stage timings (see tracing.Trace.to_json) as "trace".
+    """
+    jobs = [(path, doc_type, threshold, ocr_workers, full_scan, adaptive_dpi, with_trace) for path in pdf_paths]
+    # maxtasksperchild recycles workers so a leak in a native library cannot grow forever
+    with Pool(processes=workers, maxtasksperchild=200) as pool:
+        for result in pool.imap_unordered(_analyze_one, jobs, chunksize=chunksize):
+            yield result
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze a directory of hospital PDFs and write JSONL results.")
+    parser.add_argument("input_dir", help="Directory searched recursively for *.pdf files")
+    parser.add_argument("-o", "--output", required=True, help="JSONL output file")
+    parser.add_argument("--type", choices=sorted(DOC_TYPE_CHOICES), default="auto",
+                        help="Document type; 'auto' detects referral forms by keyword")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_FUZZY_THRESHOLD, help="Fuzzy match threshold (60-100)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=1, help="Documents handed to a worker at a time")
+    parser.add_argument("--ocr-workers", type=int, default=1, help="Parallel OCR pages per document (default: 1)")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Read every page instead of stopping once the result is decided, for complete page lists")
+    parser.add_argument("--adaptive-dpi", action="store_true",
+                        help="OCR scans in grayscale at low resolution first and re-read only unclear pages at higher DPI")
+    parser.add_argument("--trace", action="store_true", help="Add per-stage timings of each document to its result")
+    args = parser.parse_args(argv)
+
+    pdf_paths = find_pdfs(args.input_dir)
+    if not pdf_paths:
+        print(f"No PDF files found in {args.input_dir}", file=sys.stderr)
+        return 1
+
+    out = open(args.output, "w", encoding="utf-8")
+    failed = 0
+    start = time.perf_counter()
+    try:
+        for done, result in enumerate(run_batch(pdf_paths, DOC_TYPE_CHOICES[args.type], args.threshold,
+                                                args.workers, args.chunksize, args.ocr_workers, args.full_scan,
+                                                args.adaptive_dpi, args.trace),
+                                     start=1):
+            if "error" in result:
+                failed += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"[{done}/{len(pdf_paths)}] {result['path']}", file=sys.stderr)
+    finally:
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(pdf_paths)} documents in {elapsed:.1f}s ({failed} failed)", file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
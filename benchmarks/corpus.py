@@ -0,0 +1,182 @@
+"""
+Deterministic synthetic corpus of hospital PDFs for the benchmark suite.
+
+Every document is generated from a seed, so the same seed always gives
+the same text, layout and noise, and records its ground truth in
+manifest.json next to the PDFs:
+
+    digital   discharge summaries with a text layer
+    scanned   the same kind of summaries rasterized, skewed and speckled like fax scans
+    mixed     text-layer pages with scanned paragraphs embedded as images
+    referral  AcroForm referral forms with filled-in fields
+
+Usage:
+    python benchmarks/corpus.py OUTPUT_DIR [--seed 2024] [--quick]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fitz  # noqa: E402
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from engine import SECTION_HEADERS  # noqa: E402
+
+DEFAULT_SEED = 2024
+# Page counts per category; --quick keeps only the smallest of each
+PAGE_COUNTS = {
+    "digital": (2, 10, 40),
+    "scanned": (2, 6),
+    "mixed": (2, 6),
+    "referral": (1, 1, 1),
+}
+A4 = (595, 842)
+SCAN_DPI = 200
+
+FILLER = [
+    "Patient was admitted with complaints of fever and generalized weakness for three days.",
+    "Vitals were stable on admission and the patient was started on intravenous fluids.",
+    "Blood pressure remained within normal limits throughout the hospital stay.",
+    "Advised to continue the prescribed medication and review in the outpatient clinic.",
+    "No known drug allergies. Diet as tolerated, with plenty of oral fluids.",
+    "Serum electrolytes and renal function tests were repeated and found to be normal.",
+    "The patient tolerated the procedure well and there were no immediate complications.",
+    "Chest radiograph showed no active lesion; ECG showed normal sinus rhythm.",
+]
+NAMES = ["Asha Verma", "Rahul Mehta", "Priya Nair", "Imran Khan", "Sunita Rao", "Vikram Singh"]
+HOSPITALS = ["City General Hospital", "St. Mary's Medical Centre", "Lakeview Hospital"]
+DIAGNOSES = ["Community acquired pneumonia", "Acute gastroenteritis", "Dengue fever", "Type 2 diabetes mellitus"]
+
+def _pick_sections(rng: random.Random) -> List[str]:
+    """Section headings a summary contains: most of them, with one of the two history headings."""
+    history = rng.choice(["History of Present Illness", "HOPI"])
+    sections = [s for s in SECTION_HEADERS if s not in ("History of Present Illness", "HOPI")]
+    kept = [s for s in sections if rng.random() < 0.8]
+    return kept + ([history] if rng.random() < 0.8 else [])
+
+def _summary_pages(rng: random.Random, page_count: int, sections: List[str]) -> List[List[str]]:
+    """Lines of text per page, with each section heading placed on a random page."""
+    pages = [[rng.choice(FILLER) for _ in range(rng.randint(18, 28))] for _ in range(page_count)]
+    pages[0].insert(0, "CITY GENERAL HOSPITAL")
+    for section in sections:
+        page = pages[rng.randrange(page_count)]
+        page.insert(rng.randint(1, len(page)), section)
+    return pages
+
+def _write_lines(page: fitz.Page, lines: List[str], top: float = 60, bottom: float = A4[1] - 40):
+    y = top
+    for line in lines:
+        if y > bottom:
+            break
+        page.insert_text((60, y), line, fontsize=10)
+        y += 14
+
+def _scan(page: fitz.Page, rng: random.Random, clip=None) -> bytes:
+    """JPEG of a page (or part of it) rendered in grayscale, skewed and speckled like a fax."""
+    pix = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY, clip=clip)
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    image = image.rotate(rng.uniform(-1.5, 1.5), fillcolor=255)
+    noise = np.random.default_rng(rng.randrange(2 ** 32))
+    pixels = np.asarray(image, dtype=np.int16) + noise.normal(0, 12, (image.height, image.width)).astype(np.int16)
+    speckle = noise.random((image.height, image.width))
+    pixels[speckle < 0.002] = 0
+    pixels[speckle > 0.998] = 255
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=70)
+    return buffer.getvalue()
+
+def make_digital(path: str, rng: random.Random, page_count: int) -> Dict:
+    sections = _pick_sections(rng)
+    doc = fitz.open()
+    for lines in _summary_pages(rng, page_count, sections):
+        _write_lines(doc.new_page(width=A4[0], height=A4[1]), lines)
+    doc.save(path)
+    return {"sections": sections}
+
+def make_scanned(path: str, rng: random.Random, page_count: int) -> Dict:
+    sections = _pick_sections(rng)
+    source, doc = fitz.open(), fitz.open()
+    for lines in _summary_pages(rng, page_count, sections):
+        page = source.new_page(width=A4[0], height=A4[1])
+        _write_lines(page, lines)
+        doc.new_page(width=A4[0], height=A4[1]).insert_image(fitz.Rect(0, 0, *A4), stream=_scan(page, rng))
+    doc.save(path)
+    return {"sections": sections}
+
+def make_mixed(path: str, rng: random.Random, page_count: int) -> Dict:
+    """Typed upper half with a text layer, scanned lower half as an image, on every page."""
+    sections = _pick_sections(rng)
+    source, doc = fitz.open(), fitz.open()
+    half = A4[1] / 2
+    for lines in _summary_pages(rng, page_count, sections):
+        split = len(lines) // 2
+        page = doc.new_page(width=A4[0], height=A4[1])
+        _write_lines(page, lines[:split], bottom=half - 10)
+        scanned = source.new_page(width=A4[0], height=A4[1])
+        _write_lines(scanned, lines[split:], top=half + 20)
+        clip = fitz.Rect(0, half, A4[0], A4[1])
+        page.insert_image(clip, stream=_scan(scanned, rng, clip))
+    doc.save(path)
+    return {"sections": sections}
+
+def make_referral(path: str, rng: random.Random, page_count: int) -> Dict:
+    values = {
+        "patient_name": rng.choice(NAMES),
+        "patient_id": f"REG-{rng.randint(10000, 99999)}",
+        "hospital": rng.choice(HOSPITALS),
+        "referred_to": f"Dr. {rng.choice(NAMES)}",
+        "diagnosis": rng.choice(DIAGNOSES),
+        "contact": f"9{rng.randint(100000000, 999999999)}",
+    }
+    doc = fitz.open()
+    page = doc.new_page(width=A4[0], height=A4[1])
+    page.insert_text((60, 60), "REFERRAL FORM", fontsize=16)
+    for i, (name, value) in enumerate(values.items()):
+        y = 110 + i * 40
+        page.insert_text((60, y), name.replace("_", " ").title() + ":", fontsize=11)
+        widget = fitz.Widget()
+        widget.field_name = name
+        widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+        widget.field_value = value
+        widget.rect = fitz.Rect(200, y - 14, 500, y + 4)
+        page.add_widget(widget)
+    doc.save(path)
+    return {"fields": values}
+
+MAKERS = {"digital": make_digital, "scanned": make_scanned, "mixed": make_mixed, "referral": make_referral}
+
+def build_corpus(output_dir: str, seed: int = DEFAULT_SEED, quick: bool = False) -> Dict:
+    """Write the corpus and its manifest to output_dir and return the manifest."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {"seed": seed, "documents": []}
+    for category, page_counts in PAGE_COUNTS.items():
+        for index, page_count in enumerate(page_counts[:1] if quick else page_counts):
+            # One generator per document, so adding a category does not change the others
+            rng = random.Random(f"{seed}:{category}:{index}")
+            name = f"{category}-{index + 1}-{page_count}p.pdf"
+            truth = MAKERS[category](os.path.join(output_dir, name), rng, page_count)
+            manifest["documents"].append({"file": name, "category": category, "pages": page_count, **truth})
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate the synthetic benchmark corpus.")
+    parser.add_argument("output_dir", help="Directory for the PDFs and manifest.json")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Corpus seed")
+    parser.add_argument("--quick", action="store_true", help="Only the smallest document of each category")
+    args = parser.parse_args(argv)
+    manifest = build_corpus(args.output_dir, args.seed, args.quick)
+    print(f"Wrote {len(manifest['documents'])} documents to {args.output_dir}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+Preprocessing benchmark.
+
+Renders a synthetic skewed fax-like page (or the first page of a given PDF)
+and times each preprocessing step from preprocess.py on its own, then the
+full chain, so a step's cost can be weighed against the OCR time it saves.
+
+Usage:
+    python benchmarks/preprocessing.py [--pdf scan.pdf] [--dpi 300] [--skew 2.5] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fitz  # noqa: E402
+import numpy as np  # noqa: E402
+
+import preprocess  # noqa: E402
+
+def synthetic_page(dpi: int, skew: float) -> fitz.Pixmap:
+    """An A4 page of text lines, rendered and rotated by `skew` degrees like a crooked fax."""
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for i in range(45):
+        page.insert_text((72, 90 + i * 16), f"Line {i + 1}: Final Diagnosis - referral reason and plan", fontsize=10)
+    pix = page.get_pixmap(dpi=dpi)
+    image = preprocess.Image.frombytes("RGB", (pix.width, pix.height), pix.samples).rotate(skew, fillcolor="white")
+    return fitz.Pixmap(fitz.csRGB, image.width, image.height, image.tobytes(), False)
+
+def pdf_page(path: str, dpi: int) -> fitz.Pixmap:
+    with fitz.open(path) as doc:
+        return doc[0].get_pixmap(dpi=dpi)
+
+def time_step(function, repeat: int) -> float:
+    """Median milliseconds of `repeat` calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times) * 1000, 2)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Time each OCR preprocessing step on one page.")
+    parser.add_argument("--pdf", help="Benchmark the first page of this PDF instead of a synthetic page")
+    parser.add_argument("--dpi", type=int, default=300, help="Render resolution")
+    parser.add_argument("--skew", type=float, default=2.5, help="Rotation of the synthetic page in degrees")
+    parser.add_argument("--repeat", type=int, default=5, help="Samples per step")
+    args = parser.parse_args(argv)
+
+    pix = pdf_page(args.pdf, args.dpi) if args.pdf else synthetic_page(args.dpi, args.skew)
+    pixels = preprocess.pixmap_array(pix)
+    # Each step gets the output of the steps before it, as in the full chain
+    gray = preprocess.to_grayscale(pixels)
+    window = max(3, int(args.dpi * preprocess.THRESHOLD_WINDOW_INCHES))
+    binary = preprocess.adaptive_threshold(gray, window)
+    cropped, _ = preprocess.crop_margins(binary)
+    angle = preprocess.estimate_skew(cropped)
+
+    steps = {
+        "grayscale_ms": time_step(lambda: preprocess.to_grayscale(pixels), args.repeat),
+        "threshold_ms": time_step(lambda: preprocess.adaptive_threshold(gray, window), args.repeat),
+        "crop_ms": time_step(lambda: preprocess.crop_margins(binary), args.repeat),
+        "estimate_skew_ms": time_step(lambda: preprocess.estimate_skew(cropped), args.repeat),
+        "deskew_ms": time_step(lambda: preprocess.deskew(cropped, angle), args.repeat),
+        "all_steps_ms": time_step(
+            lambda: preprocess.preprocess(pixels, preprocess.PREPROCESS_STEPS, args.dpi), args.repeat),
+    }
+    prepared = preprocess.preprocess(pixels, preprocess.PREPROCESS_STEPS, args.dpi)
+    report = {
+        "page": args.pdf or f"synthetic, skewed {args.skew} degrees",
+        "dpi": args.dpi,
+        "input_shape": list(pixels.shape),
+        "output_shape": list(prepared.pixels.shape),
+        "input_mb": round(pixels.nbytes / (1024 * 1024), 1),
+        "output_mb": round(prepared.pixels.nbytes / (1024 * 1024), 1),
+        "estimated_skew_degrees": angle,
+        "remaining_skew_degrees": preprocess.estimate_skew(prepared.pixels),
+        **steps,
+    }
+    print(json.dumps(report, indent=2, default=lambda value: value.item() if isinstance(value, np.generic) else str(value)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
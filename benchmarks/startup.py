@@ -0,0 +1,74 @@
+"""
+Startup benchmark for the Streamlit UI.
+
+Runs ocr.py headlessly with Streamlit's AppTest harness in a fresh
+interpreter and reports the time to first render (cold imports plus the
+first script run) and the time per rerun after a widget change.
+
+Usage:
+    python benchmarks/startup.py [--reruns 20] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_once(reruns: int) -> dict:
+    """Run in the current (fresh) interpreter; returns timings in milliseconds."""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "ocr.py"), default_timeout=60)
+    app.run()
+    first_render = time.perf_counter() - start
+
+    rerun_times = []
+    for i in range(reruns):
+        rerun_start = time.perf_counter()
+        if app.sidebar.slider:
+            app.sidebar.slider[0].set_value(60 + i % 40)
+        app.run()
+        rerun_times.append(time.perf_counter() - rerun_start)
+
+    return {
+        "first_render_ms": round(first_render * 1000, 1),
+        "rerun_ms_median": round(statistics.median(rerun_times) * 1000, 2) if rerun_times else None,
+        "rerun_ms_max": round(max(rerun_times) * 1000, 2) if rerun_times else None,
+        "stopped_on_missing_dependencies": any("Dependencies Missing" in e.value for e in app.error),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure UI time to first render and time per rerun.")
+    parser.add_argument("--reruns", type=int, default=20, help="Widget-change reruns per sample")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh-interpreter samples")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure_once(args.reruns)))
+        return 0
+
+    # Each sample runs in a new interpreter so imports are cold, as on a fresh server start
+    samples = []
+    for _ in range(args.repeat):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--reruns", str(args.reruns)],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "first_render_ms_median": statistics.median(s["first_render_ms"] for s in samples),
+        "rerun_ms_median": statistics.median(s["rerun_ms_median"] for s in samples),
+        "samples": samples,
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+End-to-end benchmark suite over the synthetic corpus (see corpus.py).
+
+Each corpus category runs in a fresh interpreter with the result cache off,
+so every stage does its full work and the peak RSS belongs to that category
+alone. For every stage the suite reports the median latency over --repeat
+runs and pages per second, and for every category the accuracy against the
+corpus ground truth: the fraction of section verdicts (present / missing)
+that are right, or of referral form fields read back exactly. Discharge
+categories also report the recall of the section-matching prefilter, with
+and without the lossy heading-shape filter (matching.measure_prefilter_recall).
+
+Categories that need OCR are skipped when Tesseract is not installed.
+Compared against a stored baseline, the suite exits with status 1 when a
+stage is slower or a category uses more memory by more than --tolerance,
+or when accuracy or prefilter recall drops at all.
+
+Usage:
+    python benchmarks/suite.py [--quick] [--repeat 3] [--baseline benchmarks/baseline.json]
+                               [--save-baseline] [--tolerance 0.25] [--corpus DIR] [--seed 2024]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from corpus import DEFAULT_SEED, PAGE_COUNTS, build_corpus  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+OCR_CATEGORIES = {"scanned", "mixed"}
+# Accuracy may differ by float rounding only
+ACCURACY_EPSILON = 1e-6
+# Corpus form field names -> field names reported by ocr_referral_form
+REFERRAL_FIELDS = {
+    "patient_name": "Patient Name",
+    "patient_id": "Patient ID",
+    "hospital": "Hospital Name",
+    "referred_to": "Referred To",
+    "diagnosis": "Diagnosis",
+    "contact": "Contact",
+}
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def ocr_available() -> bool:
+    from engine import check_tesseract
+    from ocr_pool import tesserocr_available
+    return tesserocr_available() or not check_tesseract()
+
+def _section_accuracy(summary: List[Dict[str, str]], expected: List[str]) -> List[bool]:
+    return [(row["Status"] == "Present") == (row["Section"] in expected) for row in summary]
+
+def _median_seconds(function: Callable, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+def run_category(corpus_dir: str, category: str, repeat: int) -> Dict:
+    """Benchmark one category in this process; returns its stage timings, accuracy and peak RSS."""
+    import engine
+    from matching import measure_prefilter_recall
+
+    with open(os.path.join(corpus_dir, "manifest.json"), encoding="utf-8") as f:
+        documents = [doc for doc in json.load(f)["documents"] if doc["category"] == category]
+    stages: Dict[str, float] = {}
+    checks: List[bool] = []
+    pages = sum(doc["pages"] for doc in documents)
+    # Heading matches expected and kept, and lines x sections scored, per prefilter mode
+    prefilter = {mode: {"matches": 0, "kept": 0.0, "pairs": 0, "scored": 0} for mode in ("prefilter", "heading_shape")}
+
+    def timed(stage, function):
+        seconds, result = _median_seconds(function, repeat)
+        stages[stage] = stages.get(stage, 0.0) + seconds
+        return result
+
+    for doc in documents:
+        path = os.path.join(corpus_dir, doc["file"])
+        if category == "referral":
+            fields = timed("form_fields", lambda: engine.extract_pdf_form_fields(path))
+            if ocr_available():
+                # The full referral analysis OCRs the first page even when the form has fields
+                fields = timed("ocr_referral_form", lambda: engine.ocr_referral_form(path)[0])
+                checks.extend(fields.get(REFERRAL_FIELDS[name]) == value for name, value in doc["fields"].items())
+            else:
+                checks.extend(fields.get(name) == value for name, value in doc["fields"].items())
+            continue
+        text_per_page = timed("extract_text", lambda: engine.extract_text_from_pdf(path))
+        if isinstance(text_per_page, str):
+            raise RuntimeError(text_per_page)
+        summary = timed("analyze_sections", lambda: engine.analyze_sections(text_per_page))
+        timed("fuzzy_find_all_headings", lambda: [
+            engine.fuzzy_find_all_headings('\n'.join(text_per_page), section, engine.SECTION_HEADERS)
+            for section in engine.SECTION_HEADERS])
+        checks.extend(_section_accuracy(summary, doc["sections"]))
+        for mode, totals in prefilter.items():
+            measured = measure_prefilter_recall(text_per_page, engine.SECTION_HEADERS, engine.DEFAULT_FUZZY_THRESHOLD,
+                                                heading_shape=mode == "heading_shape")
+            totals["matches"] += measured["matches"]
+            totals["kept"] += measured["recall"] * measured["matches"]
+            totals["pairs"] += measured["pairs"]
+            totals["scored"] += measured["scored_filtered"]
+
+    report = {
+        "documents": len(documents),
+        "pages": pages,
+        "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()},
+        "pages_per_second": {stage: round(pages / seconds, 1) if seconds else None for stage, seconds in stages.items()},
+        "accuracy": round(sum(checks) / len(checks), 4) if checks else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if category != "referral":
+        report["prefilter"] = {
+            f"{mode}_recall": round(totals["kept"] / totals["matches"], 4) if totals["matches"] else 1.0
+            for mode, totals in prefilter.items()
+        }
+        report["prefilter"].update({
+            f"{mode}_scored_fraction": round(totals["scored"] / totals["pairs"], 4) if totals["pairs"] else None
+            for mode, totals in prefilter.items()
+        })
+    return report
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of report against baseline, as human-readable lines."""
+    regressions = []
+    for category, current in report["categories"].items():
+        previous = baseline.get("categories", {}).get(category)
+        if not previous or "skipped" in current or "skipped" in previous:
+            continue
+        for stage, ms in current["stages_ms"].items():
+            before = previous["stages_ms"].get(stage)
+            if before and ms > before * (1 + tolerance):
+                regressions.append(f"{category}/{stage}: {ms} ms vs baseline {before} ms")
+        if previous.get("accuracy") is not None and current["accuracy"] < previous["accuracy"] - ACCURACY_EPSILON:
+            regressions.append(f"{category}: accuracy {current['accuracy']} vs baseline {previous['accuracy']}")
+        for name, recall in current.get("prefilter", {}).items():
+            before = previous.get("prefilter", {}).get(name)
+            if name.endswith("_recall") and before is not None and recall < before - ACCURACY_EPSILON:
+                regressions.append(f"{category}: {name} {recall} vs baseline {before}")
+        if current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{category}: peak RSS {current['peak_rss_mb']} MB vs baseline {previous['peak_rss_mb']} MB")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark extraction and matching on a synthetic corpus.")
+    parser.add_argument("--corpus", help="Corpus directory (default: generate into a temporary directory)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Corpus seed")
+    parser.add_argument("--quick", action="store_true", help="Only the smallest document of each category")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown or memory growth as a fraction of the baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_category(args.corpus, args.child, args.repeat)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as scratch:
+        corpus_dir = args.corpus or os.path.join(scratch, "corpus")
+        if not os.path.exists(os.path.join(corpus_dir, "manifest.json")):
+            build_corpus(corpus_dir, args.seed, args.quick)
+        has_ocr = ocr_available()
+        report = {"seed": args.seed, "quick": args.quick, "repeat": args.repeat, "categories": {}}
+        for category in PAGE_COUNTS:
+            if category in OCR_CATEGORIES and not has_ocr:
+                report["categories"][category] = {"skipped": "Tesseract is not installed"}
+                continue
+            # A fresh interpreter per category keeps peak RSS and warm caches separate
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", category, "--corpus", corpus_dir,
+                 "--repeat", str(args.repeat)],
+                cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+                env={**os.environ, "HOSPITAL_PDF_CACHE": "off"},
+            )
+            report["categories"][category] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline.get("seed"), baseline.get("quick")) != (args.seed, args.quick):
+            print("Baseline was recorded with a different corpus; not comparing", file=sys.stderr)
+        else:
+            regressions = compare(report, baseline, args.tolerance)
+    report["regressions"] = regressions
+    print(json.dumps(report, indent=2))
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
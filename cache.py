@@ -0,0 +1,194 @@
+"""
+Content-addressed persistent cache for extraction and OCR results.
+
+Entries are keyed by a SHA-256 of the PDF bytes plus the parameters that
+affect the result (page, DPI, Tesseract config, ...), so the same document
+costs no OCR the second time no matter which user, rerun or batch worker
+sees it. Values are stored as JSON in a SQLite file that several processes
+can share; once the file grows past its size cap the least recently used
+entries are evicted. Recency is only recorded to the minute, so almost every
+cache hit is a pure read.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_CACHE         path of the SQLite file, or "off" to disable caching
+    HOSPITAL_PDF_CACHE_MAX_MB  size cap in megabytes (default 512)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Bump when the meaning of cached values changes so stale entries are never read
+CACHE_SCHEMA_VERSION = 1
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "hospital_pdf_checker", "cache.sqlite3")
+DEFAULT_CACHE_MAX_MB = 512
+
+# Evict down to this fraction of the cap so eviction does not run on every insert
+_EVICTION_TARGET = 0.9
+# A hit only rewrites an entry's last_access when it is older than this, so most reads write nothing;
+# the LRU order is exact to within this many seconds
+LAST_ACCESS_RESOLUTION = 60
+# The running size total is re-read from the store at least this often, to count other processes' writes
+SIZE_RESYNC_SECONDS = 60
+
+class ResultCache:
+    """
+    SQLite-backed LRU cache of JSON-serializable values.
+    A cache created with path=None is disabled: every lookup misses and nothing is stored.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        # Bytes stored, kept up to date on insert and eviction instead of summing the table on every set()
+        self._total = 0
+        self._total_read = 0.0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._conn.commit()
+            self._read_total()
+
+    def _read_total(self):
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._total_read = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value, last_access FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[1] > LAST_ACCESS_RESOLUTION:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        """Store value under key and evict least recently used entries if over the size cap."""
+        if not self.enabled:
+            return
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time()),
+            )
+            self._total += size - (replaced[0] if replaced else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self._total > self.max_bytes or time.monotonic() - self._total_read > SIZE_RESYNC_SECONDS:
+            # Other processes share the store: count exactly before deciding to evict
+            self._read_total()
+        if self._total <= self.max_bytes:
+            return
+        target = self.max_bytes * _EVICTION_TARGET
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if self._total <= target:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._total -= size
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._total = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process plus the current size of the shared store."""
+        entries, size = 0, 0
+        if self.enabled:
+            with self._lock:
+                entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+_cache: Optional[ResultCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ResultCache:
+    """Return the process-wide cache configured from the environment."""
+    global _cache, _cache_pid
+    with _cache_lock:
+        # SQLite connections must not be shared with forked workers, so each process opens its own
+        if _cache is None or _cache_pid != os.getpid():
+            _cache_pid = os.getpid()
+            path = os.environ.get("HOSPITAL_PDF_CACHE", DEFAULT_CACHE_PATH)
+            max_mb = int(os.environ.get("HOSPITAL_PDF_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB))
+            if path.lower() in ("", "off", "0", "none"):
+                path = None
+            try:
+                _cache = ResultCache(path, max_mb * 1024 * 1024)
+            except sqlite3.Error as e:
+                print(f"Result cache disabled: {e}")
+                _cache = ResultCache(None)
+        return _cache
+
+_digests: Dict[Tuple[str, int, int], str] = {}
+
+def pdf_digest(pdf_path: str) -> str:
+    """
+    SHA-256 of the file contents, memoized per (path, mtime, size) so repeated
+    extractors working on the same upload only read it once.
+    """
+    st = os.stat(pdf_path)
+    memo_key = (os.path.realpath(pdf_path), st.st_mtime_ns, st.st_size)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        if len(_digests) >= 1024:
+            _digests.clear()
+        _digests[memo_key] = digest
+    return digest
+
+def bytes_digest(data: bytes) -> str:
+    """SHA-256 of a PDF held in memory, matching pdf_digest for the same file."""
+    return hashlib.sha256(data).hexdigest()
+
+def make_key(namespace: str, digest: str, **params) -> str:
+    """Build a cache key from a result namespace, a content digest and the parameters that shape the result."""
+    param_str = json.dumps(params, sort_keys=True, default=str)
+    return f"v{CACHE_SCHEMA_VERSION}:{namespace}:{digest}:{param_str}"
@@ -0,0 +1,158 @@
+"""
+Duplicate-page detection for OCR.
+
+Hospital bundles repeat pages: the same consent or cover page in every
+document, a report attached twice, the same scan forwarded in several
+referrals. Before a page is OCR'd it is fingerprinted from a grayscale
+render at FINGERPRINT_DPI: a hash of its text layer, a digest of the render,
+a GRID x GRID thumbnail of cell means and a 1-bit ink map. A page whose
+text layer and render are identical to a page OCR'd earlier gets that
+page's OCR result instead of being OCR'd again.
+
+Near duplicates (the same scan re-compressed, or re-scanned with different
+noise) can be matched as well: same text layer, no thumbnail cell more than
+MAX_CELL_DIFFERENCE gray levels apart and no BLOCK x BLOCK block of the ink
+maps differing in more than MAX_BLOCK_DIFFERENCE pixels. A different name or
+number changes whole blocks, but a single changed character can stay
+within the tolerance, so near matching is opt-in.
+
+Fingerprints of OCR'd pages are kept in a bounded index per process, so a
+duplicate is found within a document and across the documents a batch
+worker or the service handles; identical pages are also found through the
+result cache across processes and runs.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_DEDUPE  "exact" (default), "near" to also reuse near duplicates, or "off"
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from deps import lazy_import
+
+np = lazy_import("numpy")
+
+DEDUPE_MODES = ("exact", "near", "off")
+# Resolution of the fingerprint render; about 830 x 1170 pixels for A4
+FINGERPRINT_DPI = 100
+# Pixels darker than this are ink
+INK_LEVEL = 160
+# Thumbnail cells per side, and the largest gray-level difference of a cell in a near duplicate
+GRID = 32
+MAX_CELL_DIFFERENCE = 16
+# Side of the ink map blocks compared in near matching, and the most pixels one may differ in
+BLOCK = 8
+MAX_BLOCK_DIFFERENCE = 12
+# Fingerprints (with their OCR results) kept per process; an ink map is about 120 KB
+MAX_INDEXED_PAGES = 200
+
+def dedupe_mode() -> str:
+    mode = os.environ.get("HOSPITAL_PDF_DEDUPE", "").strip().lower() or "exact"
+    if mode in ("0", "false", "no"):
+        return "off"
+    return mode if mode in DEDUPE_MODES else "exact"
+
+def _cell_means(pixels: np.ndarray, cells: int, axis: int) -> np.ndarray:
+    """Mean of `cells` equal bands of pixels along an axis."""
+    edges = np.linspace(0, pixels.shape[axis], cells + 1).astype(np.intp)
+    sums = np.add.reduceat(pixels, edges[:-1], axis=axis)
+    shape = [1, 1]
+    shape[axis] = cells
+    return sums / np.maximum(np.diff(edges), 1).reshape(shape)
+
+def _block_sums(mask: np.ndarray) -> np.ndarray:
+    """Set pixels per BLOCK x BLOCK block of a 2-D boolean array (partial edge blocks dropped)."""
+    height, width = mask.shape[0] // BLOCK * BLOCK, mask.shape[1] // BLOCK * BLOCK
+    return mask[:height, :width].reshape(height // BLOCK, BLOCK, width // BLOCK, BLOCK).sum(axis=(1, 3))
+
+class PageFingerprint:
+    """Text-layer hash, render digest, thumbnail and ink map of one page render."""
+
+    __slots__ = ("text_hash", "digest", "shape", "thumbnail", "ink")
+
+    def __init__(self, text_hash: str, digest: str, shape: Tuple[int, int], thumbnail: np.ndarray, ink: np.ndarray):
+        self.text_hash = text_hash
+        self.digest = digest
+        self.shape = shape
+        self.thumbnail = thumbnail
+        # Packed bits, one row after another
+        self.ink = ink
+
+    def matches(self, other: PageFingerprint, near: bool = False) -> bool:
+        if self.digest == other.digest:
+            return True
+        if not near or self.text_hash != other.text_hash or self.shape != other.shape:
+            return False
+        difference = np.abs(self.thumbnail.astype(np.int16) - other.thumbnail.astype(np.int16))
+        if int(difference.max()) > MAX_CELL_DIFFERENCE:
+            return False
+        changed = np.unpackbits(self.ink ^ other.ink, count=self.shape[0] * self.shape[1]).reshape(self.shape)
+        return int(_block_sums(changed.astype(bool)).max(initial=0)) <= MAX_BLOCK_DIFFERENCE
+
+def fingerprint(pixels: np.ndarray, text: str) -> PageFingerprint:
+    """Fingerprint of a grayscale page render (2-D uint8 array) and the page's text layer."""
+    pixels = np.ascontiguousarray(pixels)
+    text_hash = hashlib.sha256(text.strip().encode("utf-8", "replace")).hexdigest()
+    digest = hashlib.sha256(f"{text_hash}:{pixels.shape}:".encode() + pixels.tobytes()).hexdigest()
+    grid = min(GRID, *pixels.shape)
+    thumbnail = _cell_means(_cell_means(pixels.astype(np.float32), grid, 0), grid, 1)
+    ink = np.packbits(pixels < INK_LEVEL, axis=None)
+    return PageFingerprint(text_hash, digest, pixels.shape, np.round(thumbnail).astype(np.uint8), ink)
+
+class PageIndex:
+    """
+    Recently OCR'd pages by fingerprint, each with a value (its OCR result) and
+    a label saying where it came from. Lookups are limited to entries made under
+    the same settings key (DPI, Tesseract config, preprocessing); thread-safe.
+    """
+
+    def __init__(self, max_pages: int = MAX_INDEXED_PAGES):
+        self.max_pages = max_pages
+        self._entries: OrderedDict[int, Tuple[Hashable, PageFingerprint, Any, Dict]] = OrderedDict()
+        self._exact: Dict[Tuple[Hashable, str], int] = {}
+        # (settings key, text hash) -> entry ids, so near matching only compares pages with the same text layer
+        self._buckets: Dict[Tuple[Hashable, str], List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def find(self, key: Hashable, page: PageFingerprint, near: bool = False) -> Optional[Tuple[Any, Dict]]:
+        """(value, label) of an identical page, else (with near) of the most recent near duplicate, or None."""
+        with self._lock:
+            entry_id = self._exact.get((key, page.digest))
+            if entry_id is None and near:
+                entry_id = next((candidate for candidate in reversed(self._buckets.get((key, page.text_hash), []))
+                                 if page.matches(self._entries[candidate][1], near=True)), None)
+            if entry_id is None:
+                return None
+            self._entries.move_to_end(entry_id)
+            _, _, value, label = self._entries[entry_id]
+            return value, label
+
+    def add(self, key: Hashable, page: PageFingerprint, value: Any, label: Dict):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (key, page, value, label)
+            self._exact[(key, page.digest)] = entry_id
+            self._buckets.setdefault((key, page.text_hash), []).append(entry_id)
+            while len(self._entries) > self.max_pages:
+                old_id, (old_key, old_page, _, _) = self._entries.popitem(last=False)
+                if self._exact.get((old_key, old_page.digest)) == old_id:
+                    del self._exact[(old_key, old_page.digest)]
+                bucket = self._buckets[(old_key, old_page.text_hash)]
+                bucket.remove(old_id)
+                if not bucket:
+                    del self._buckets[(old_key, old_page.text_hash)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+            self._buckets.clear()
+
+# Shared by every document processed in this process
+page_index = PageIndex()
@@ -0,0 +1,145 @@
+"""
+Dependency probing and lazy imports.
+
+The external tools are located once per process with a PATH lookup instead
+of spawning them, and heavy Python modules (PyMuPDF, pytesseract, which
+pulls in pandas, pdf2image, NumPy, ...) are only imported when a function
+first needs them. Streamlit reruns the UI script on every widget change,
+so neither cost is paid again after the first run.
+"""
+import importlib
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+from functools import lru_cache
+from typing import Optional
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+def tesseract_cmd() -> str:
+    """The Tesseract executable pytesseract will run, without importing pytesseract just to ask."""
+    pytesseract_module = sys.modules.get("pytesseract.pytesseract")
+    if pytesseract_module is not None:
+        return pytesseract_module.tesseract_cmd
+    return "tesseract"  # pytesseract's default
+
+def _find_executable(cmd: str) -> Optional[str]:
+    if os.path.isfile(cmd) and os.access(cmd, os.X_OK):
+        return cmd
+    return shutil.which(cmd)
+
+@lru_cache(maxsize=None)
+def tesseract_version() -> Optional[str]:
+    """First line of `tesseract --version`, looked up once per process; None if Tesseract is missing."""
+    executable = _find_executable(tesseract_cmd())
+    if executable is None:
+        return None
+    try:
+        output = subprocess.run([executable, "--version"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    lines = (output.stdout or output.stderr).strip().splitlines()
+    return lines[0] if lines else ""
+
+@lru_cache(maxsize=None)
+def check_tesseract() -> Optional[str]:
+    """
+    Check if Tesseract is installed and provide installation instructions if not.
+    Returns None if Tesseract is installed, or installation instructions if not.
+    """
+    if _find_executable(tesseract_cmd()) is not None:
+        return None
+    system = platform.system().lower()
+    if system == "darwin":
+        return (
+            "Tesseract is not installed. To install on macOS:\n"
+            "1. Install Homebrew if not already installed:\n"
+            "   /bin/bash -c \"$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)\"\n"
+            "2. Install Tesseract:\n"
+            "   brew install tesseract"
+        )
+    elif system == "linux":
+        return (
+            "Tesseract is not installed. To install on Linux:\n"
+            "Ubuntu/Debian:\n"
+            "   sudo apt-get update && sudo apt-get install tesseract-ocr\n"
+            "Fedora:\n"
+            "   sudo dnf install tesseract"
+        )
+    elif system == "windows":
+        return (
+            "Tesseract is not installed. To install on Windows:\n"
+            "1. Download the installer from: https://github.com/UB-Mannheim/tesseract/wiki\n"
+            "2. Run the installer and note the installation directory\n"
+            "3. Add the Tesseract installation directory to your PATH environment variable\n"
+            "4. Restart your computer"
+        )
+    return "Tesseract OCR is not installed. Please install it for your operating system."
+
+@lru_cache(maxsize=None)
+def check_pdf2image_dependencies() -> Optional[str]:
+    """
+    Check if pdf2image dependencies (poppler) are installed.
+    Returns None if dependencies are installed, or installation instructions if not.
+    """
+    # pdf2image shells out to both of these
+    if shutil.which("pdftoppm") and shutil.which("pdfinfo"):
+        return None
+    system = platform.system().lower()
+
+    if system == "darwin":
+        return (
+            "Poppler is not installed. To install on macOS:\n"
+            "1. Install using Homebrew:\n"
+            "   brew install poppler\n"
+            "2. Restart your terminal"
+        )
+    elif system == "linux":
+        return (
+            "Poppler is not installed. To install on Linux:\n"
+            "Ubuntu/Debian:\n"
+            "   sudo apt-get update && sudo apt-get install poppler-utils\n"
+            "Fedora:\n"
+            "   sudo dnf install poppler-utils"
+        )
+    elif system == "windows":
+        return (
+            "Poppler is not installed. To install on Windows:\n"
+            "1. Download poppler for Windows from: http://blog.alivate.com.au/poppler-windows/\n"
+            "2. Extract to a directory (e.g., C:\\Program Files\\poppler)\n"
+            "3. Add the bin directory to your PATH environment variable\n"
+            "4. Restart your computer"
+        )
+    return "PDF to image conversion failed. Please install poppler for your operating system."
+
+def refresh_dependency_checks():
+    """Forget cached probe results, e.g. after installing a missing tool without restarting."""
+    tesseract_version.cache_clear()
+    check_tesseract.cache_clear()
+    check_pdf2image_dependencies.cache_clear()
@@ -0,0 +1,290 @@
+"""
+Per-document context shared by all extractors.
+
+A DocumentContext opens the PDF once and lazily memoizes what the
+extractors ask for - page text, word layouts, widgets, annotations,
+renders and OCR results - so one upload is parsed once and no page is OCR'd twice, no
+matter how many extractors look at it.
+
+Documents can be opened from a path or straight from memory; open_upload
+keeps typical uploads in memory and spools only large ones to a temporary
+file, which is always removed.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from cache import bytes_digest, get_cache, make_key, pdf_digest
+from deps import lazy_import
+from layout import PageLayout, words_from_text_layer
+from preprocess import configured_steps
+from tracing import span
+
+fitz = lazy_import("fitz")  # PyMuPDF
+Image = lazy_import("PIL.Image")
+
+# Full-page renders are large (about 26 MB at 300 DPI), so only the most recent few are kept
+MAX_MEMOIZED_RENDERS = 2
+# Images smaller than this fraction of the page (logos, stamps) are not worth OCR'ing
+MIN_IMAGE_REGION_FRACTION = 0.1
+# Uploads up to this size are opened from memory; larger ones are spooled to a temporary file
+MAX_IN_MEMORY_PDF_BYTES = 32 * 1024 * 1024
+
+Region = Tuple[float, float, float, float]
+PdfBytes = Union[bytes, bytearray, memoryview]
+
+class DocumentContext:
+    """Lazily opened fitz.Document plus memoized per-page extraction results."""
+
+    def __init__(self, source: Union[str, PdfBytes]):
+        """source is a file path or the PDF bytes themselves."""
+        self.path = source if isinstance(source, str) else None
+        self._data = None if isinstance(source, str) else bytes(source)
+        self._doc: Optional[fitz.Document] = None
+        self._digest: Optional[str] = None
+        self._pages: Dict[int, fitz.Page] = {}
+        self._page_text: Dict[int, str] = {}
+        self._text_layouts: Dict[int, PageLayout] = {}
+        self._widgets: Dict[int, list] = {}
+        self._annots: Dict[int, list] = {}
+        self._image_regions: Dict[int, List[Tuple[Region, float]]] = {}
+        self._renders: OrderedDict[Tuple, Image.Image] = OrderedDict()
+        self._ocr: Dict[Tuple, PageLayout] = {}
+        self._ocr_dpi: Dict[Tuple, int] = {}
+        self._memo: Dict[str, Any] = {}
+
+    @property
+    def doc(self) -> fitz.Document:
+        if self._doc is None:
+            with span("open") as open_span:
+                if self.path is not None:
+                    self._doc = fitz.open(self.path)
+                else:
+                    self._doc = fitz.open(stream=self._data, filetype="pdf")
+                open_span.set(bytes=self.size, pages=len(self._doc))
+        return self._doc
+
+    @property
+    def size(self) -> int:
+        """Size of the PDF file in bytes."""
+        return os.path.getsize(self.path) if self.path is not None else len(self._data)
+
+    @property
+    def digest(self) -> str:
+        """Content hash used as the persistent cache key."""
+        if self._digest is None:
+            self._digest = pdf_digest(self.path) if self.path is not None else bytes_digest(self._data)
+        return self._digest
+
+    @property
+    def page_count(self) -> int:
+        return len(self.doc)
+
+    def page(self, page_num: int) -> fitz.Page:
+        # Pages are kept alive because widgets and annotations only hold a weak reference to them
+        if page_num not in self._pages:
+            self._pages[page_num] = self.doc[page_num]
+        return self._pages[page_num]
+
+    def page_text(self, page_num: int) -> str:
+        if page_num not in self._page_text:
+            self._page_text[page_num] = self.page(page_num).get_text()
+        return self._page_text[page_num]
+
+    def text_layout(self, page_num: int) -> PageLayout:
+        """Word layout of the page's native text layer."""
+        if page_num not in self._text_layouts:
+            self._text_layouts[page_num] = PageLayout(words_from_text_layer(self.page(page_num).get_text("words")))
+        return self._text_layouts[page_num]
+
+    def widgets(self, page_num: int) -> list:
+        if page_num not in self._widgets:
+            self._widgets[page_num] = list(self.page(page_num).widgets())
+        return self._widgets[page_num]
+
+    def annots(self, page_num: int) -> list:
+        if page_num not in self._annots:
+            self._annots[page_num] = list(self.page(page_num).annots())
+        return self._annots[page_num]
+
+    def image_regions(self, page_num: int) -> List[Tuple[Region, float]]:
+        """
+        (bbox in points, native DPI) of each image drawn on the page that covers at least
+        MIN_IMAGE_REGION_FRACTION of it, clipped to the page, in drawing order.
+        """
+        if page_num not in self._image_regions:
+            page = self.page(page_num)
+            page_area = page.rect.width * page.rect.height
+            regions = []
+            for info in page.get_image_info():
+                bbox = fitz.Rect(info["bbox"]) & page.rect
+                if bbox.is_empty or bbox.width * bbox.height < MIN_IMAGE_REGION_FRACTION * page_area:
+                    continue
+                region = tuple(round(v, 1) for v in bbox)
+                if any(region == seen for seen, _ in regions):
+                    continue
+                native_dpi = 72 * max(info["width"] / bbox.width, info["height"] / bbox.height)
+                regions.append((region, native_dpi))
+            self._image_regions[page_num] = regions
+        return self._image_regions[page_num]
+
+    def render_clip(self, page_num: int, region: Region, dpi: int) -> Image.Image:
+        """RGB render of part of a page; not memoized since each region is OCR'd once."""
+        pix = self.page(page_num).get_pixmap(dpi=dpi, clip=fitz.Rect(region))
+        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+    def pixmap(self, page_num: int, dpi: int, gray: bool = False, clip: Optional[Region] = None) -> fitz.Pixmap:
+        """Raw render of a page (or part of it) for array preprocessing; not memoized."""
+        colorspace = fitz.csGRAY if gray else fitz.csRGB
+        return self.page(page_num).get_pixmap(dpi=dpi, colorspace=colorspace,
+                                              clip=fitz.Rect(clip) if clip is not None else None)
+
+    def render(self, page_num: int, dpi: int, gray: bool = False) -> Image.Image:
+        """RGB (or 8-bit grayscale) render of a page at the given resolution."""
+        key = (page_num, dpi, gray)
+        if key in self._renders:
+            self._renders.move_to_end(key)
+            return self._renders[key]
+        if gray:
+            pix = self.page(page_num).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            image = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+        else:
+            pix = self.page(page_num).get_pixmap(dpi=dpi)
+            image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        self._renders[key] = image
+        while len(self._renders) > MAX_MEMOIZED_RENDERS:
+            self._renders.popitem(last=False)
+        return image
+
+    def get_ocr_layout(self, page_num: int, dpi: int, config: str = "",
+                       regions: Optional[Tuple[Region, ...]] = None, gray: bool = False) -> Optional[PageLayout]:
+        """
+        OCR word layout for a page (or for just the given regions of it) from this
+        context or the persistent cache, or None if not OCR'd yet. Layouts are kept
+        per preprocessing setting (see preprocess.configured_steps).
+        """
+        key = (page_num, dpi, config, regions, gray, configured_steps())
+        if key not in self._ocr:
+            cached = get_cache().get(self._ocr_cache_key(page_num, dpi, config, regions, gray))
+            if cached is None:
+                return None
+            self._ocr[key] = PageLayout.from_json(cached)
+        return self._ocr[key]
+
+    def get_ocr(self, page_num: int, dpi: int, config: str = "") -> Optional[str]:
+        """OCR text for a page, derived from its word layout, or None if not OCR'd yet."""
+        layout = self.get_ocr_layout(page_num, dpi, config)
+        return layout.text if layout is not None else None
+
+    def put_ocr_layout(self, page_num: int, dpi: int, config: str, layout: PageLayout,
+                       regions: Optional[Tuple[Region, ...]] = None, gray: bool = False):
+        self._ocr[(page_num, dpi, config, regions, gray, configured_steps())] = layout
+        get_cache().set(self._ocr_cache_key(page_num, dpi, config, regions, gray), layout.to_json())
+
+    def get_adaptive_dpi(self, page_num: int, config: str, policy: str) -> Optional[int]:
+        """Resolution an adaptive OCR policy settled on for a page, if it ran before."""
+        key = (page_num, config, policy)
+        if key not in self._ocr_dpi:
+            cached = get_cache().get(make_key("ocr_adaptive_dpi", self.digest, page=page_num, config=config, policy=policy))
+            if cached is None:
+                return None
+            self._ocr_dpi[key] = cached
+        return self._ocr_dpi[key]
+
+    def put_adaptive_dpi(self, page_num: int, config: str, policy: str, dpi: int):
+        self._ocr_dpi[(page_num, config, policy)] = dpi
+        get_cache().set(make_key("ocr_adaptive_dpi", self.digest, page=page_num, config=config, policy=policy), dpi)
+
+    def _ocr_cache_key(self, page_num: int, dpi: int, config: str, regions: Optional[Tuple[Region, ...]] = None,
+                       gray: bool = False) -> str:
+        params = {"page": page_num, "dpi": dpi}
+        if config:
+            params["config"] = config
+        if regions:
+            params["regions"] = [list(region) for region in regions]
+        if gray:
+            params["gray"] = True
+        if configured_steps():
+            params["preprocess"] = list(configured_steps())
+        return make_key("ocr_words", self.digest, **params)
+
+    def memoize(self, name: str, compute: Callable[[], Any]) -> Any:
+        """Return the value stored under name, computing it on first use."""
+        if name not in self._memo:
+            self._memo[name] = compute()
+        return self._memo[name]
+
+    def close(self):
+        self._pages.clear()
+        self._widgets.clear()
+        self._annots.clear()
+        self._image_regions.clear()
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+        self._renders.clear()
+
+    def __enter__(self) -> "DocumentContext":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _read_upload(upload: BinaryIO) -> bytes:
+    # Streamlit's UploadedFile and io.BytesIO hand out their whole contents without a read position
+    return upload.getvalue() if hasattr(upload, "getvalue") else upload.read()
+
+@contextmanager
+def open_document(source: Union[str, PdfBytes, BinaryIO, DocumentContext]) -> Iterator[DocumentContext]:
+    """
+    Yield a DocumentContext for a path, PDF bytes or a binary buffer, or pass an existing one through.
+    Contexts created here are closed on exit; contexts passed in stay open for the caller.
+    """
+    if isinstance(source, DocumentContext):
+        yield source
+        return
+    if not isinstance(source, (str, bytes, bytearray, memoryview)):
+        source = _read_upload(source)
+    ctx = DocumentContext(source)
+    try:
+        yield ctx
+    finally:
+        ctx.close()
+
+def _upload_size(upload: Union[PdfBytes, BinaryIO]) -> int:
+    if isinstance(upload, (bytes, bytearray, memoryview)):
+        return len(upload)
+    upload.seek(0, os.SEEK_END)
+    size = upload.tell()
+    upload.seek(0)
+    return size
+
+@contextmanager
+def open_upload(upload: Union[PdfBytes, BinaryIO],
+                max_in_memory: int = MAX_IN_MEMORY_PDF_BYTES) -> Iterator[DocumentContext]:
+    """
+    DocumentContext for uploaded PDF bytes or a binary buffer. Uploads up to max_in_memory
+    bytes are opened straight from memory without touching the disk; larger ones are
+    spooled to a temporary file, which is removed on exit even if the analysis fails.
+    """
+    if _upload_size(upload) <= max_in_memory:
+        with open_document(upload) as ctx:
+            yield ctx
+        return
+    fd, spool_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            if isinstance(upload, (bytes, bytearray, memoryview)):
+                spool.write(upload)
+            else:
+                shutil.copyfileobj(upload, spool)
+        with open_document(spool_path) as ctx:
+            yield ctx
+    finally:
+        # The document is closed by now, so the file can be removed on every platform
+        os.remove(spool_path)
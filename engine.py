@@ -0,0 +1,887 @@
+"""
+Headless analysis engine for hospital PDFs.
+
+Everything in this module can be imported and run without a Streamlit
+session: the UI in ocr.py, the batch CLI in batch.py and any other caller
+share the same extraction and analysis functions.
+"""
+from __future__ import annotations
+
+import os
+import re
+import string
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from cache import get_cache, make_key
+from dedupe import FINGERPRINT_DPI, PageFingerprint, dedupe_mode, fingerprint, page_index
+from deps import check_pdf2image_dependencies, check_tesseract, lazy_import  # noqa: F401 (checks re-exported)
+from document import DocumentContext, Region, open_document
+from forms import FORM_TABLE_VERSION, FormField, read_acroform, scan_pages, signatures
+from labels import LabelMatcher
+from matching import ratio_upper_bound, score_lines, score_sections
+from layout import PageLayout, Word, place_words
+from ocr_pool import ocr_image, ocr_words
+from preprocess import configured_steps, pixmap_array, preprocess, unmap_words
+from tracing import record, span
+
+# Heavy modules are imported on first use so the UI can paint before they load
+fitz = lazy_import("fitz")  # PyMuPDF
+np = lazy_import("numpy")
+pdf2image = lazy_import("pdf2image")
+fuzz = lazy_import("fuzzywuzzy.fuzz")
+Image = lazy_import("PIL.Image")
+
+SECTION_HEADERS = [
+    "Discharge Summary",
+    "Diagnosis",
+    "Investigation",
+    "Culture Report",
+    "Final Diagnosis",
+    "History of Present Illness",
+    "HOPI"  # Alternative for History of Present Illness
+]
+
+REFERRAL_KEYWORDS = [
+    "referral form", "referral", "referred by", "referring doctor", "referring hospital", "referral reason"
+]
+
+# Label variants of the fields read from referral form text
+REFERRAL_FIELD_LABELS = {
+    "Patient Name": ["patient name", "name of patient", "name", "pt. name", "patient's name", "name of the patient"],
+    "Age": ["age", "patient age"],
+    "Gender": ["gender", "sex", "male", "female", "m/f"],
+    "Referred By": ["referred by", "referring doctor", "referring hospital", "refd by", "refd. by"],
+    "Referral Reason": ["referral reason", "reason for referral", "reason", "reason for ref.", "reason for ref"],
+    "Diagnosis": ["diagnosis", "provisional diagnosis", "diagno"],
+    "Date": ["date", "dt."],
+    "Contact": ["contact", "phone", "mobile", "tel", "contact no", "contact number"],
+    "Digital Signature": ["digitally signed by", "digital signature", "signed by"]
+}
+
+# Substrings of PDF form field names -> the referral fields they fill (only the reliable ones)
+FORM_FIELD_NAMES = {
+    'name': 'Patient Name',
+    'patient': 'Patient Name',
+    'pt': 'Patient Name',
+    'patient_id': 'Patient ID',
+    'id': 'Patient ID',
+    'registration': 'Patient ID',
+    'reg_no': 'Patient ID',
+    'hospital': 'Hospital Name',
+    'facility': 'Hospital Name',
+    'referred_to': 'Referred To',
+    'referredto': 'Referred To',
+    'ref_to': 'Referred To',
+    'diagnosis': 'Diagnosis',
+    'clinical_notes': 'Diagnosis',
+    'contact': 'Contact',
+    'phone': 'Contact',
+    'mobile': 'Contact',
+    'tel': 'Contact',
+    'email': 'Contact'  # Email can also be contact
+}
+
+# Field labels of scanned referral forms, in order of preference per field, matched
+# against the line with its letters lowercased; a pattern's group captures the value
+# (patterns without one only detect the field) - only the reliable ones
+SCANNED_FIELD_PATTERNS = {
+    "Patient Name": [r"patient.*?name\s*[:\s]\s*(.+?)(?:\||$)", r"name\s*[:\s]\s*(.+?)(?:\||$)"],
+    "Patient ID": [r"patient\s*(?:id|number)\s*[:\s]\s*(.+?)(?:\||$)", r"(?:id|reg)\s*(?:no\.?|number)?\s*[:\s]\s*([A-Za-z0-9-]+)(?:\||$)"],
+    "Hospital Name": [r"hospital\s*(?:name)?\s*[:\s]\s*(.+?)(?:\||$)", r"facility\s*[:\s]\s*(.+?)(?:\||$)", r"located\s+within\s+the\s+aor\s+of\s+(.+?)(?:\||$)"],
+    "Referred To": [r"referred\s+to\s*[:\s]\s*(.+?)(?:\||$)", r"ref\.\s*to\s*[:\s]\s*(.+?)(?:\||$)"],
+    "Diagnosis": [r"diagnosis\s*[:\s]\s*(.+?)(?:\||$)", r"clinical\s+notes\s*[:\s]\s*(.+?)(?:\||$)"],
+    "Contact": [r"contact\s*[:\s]\s*(.+?)(?:\||$)", r"phone\s*[:\s]\s*(\d+)", r"email\s*[:\s]\s*(\S+@\S+\.\S+)", r"\b\d{10}\b", r"(?:patient\s+)?email\s*[:\s]\s*(\S+@\S+\.\S+)"]
+}
+
+DOCUMENT_TYPES = ["Discharge Summary", "Referral Form"]
+
+# Default and lower bound of the "Fuzzy Match Threshold" slider in the UI
+DEFAULT_FUZZY_THRESHOLD = 75
+MIN_FUZZY_THRESHOLD = 60
+
+# Pages whose text layer is shorter than this are treated as scanned and OCR'd
+MIN_TEXT_LAYER_CHARS = 20
+OCR_DPI = 300
+
+# An image covering this much of a page without a text layer is a scan: OCR the whole page
+FULL_PAGE_IMAGE_COVERAGE = 0.9
+# Image regions are OCR'd at their native resolution, within these bounds
+MIN_REGION_DPI = 150
+
+# Adaptive OCR reads scans in grayscale at the first resolution and only moves up
+# a step for pages whose mean word confidence is below MIN_OCR_CONFIDENCE
+ADAPTIVE_DPI_STEPS = (150, 200, 300)
+MIN_OCR_CONFIDENCE = 70
+
+# Default number of pages in flight per OCR worker when streaming a document
+DEFAULT_WINDOW_PER_WORKER = 2
+
+def extract_pdf_form_fields(pdf_path):
+    """Extract form fields from a PDF as {name: value}. Accepts a path or a DocumentContext."""
+    fields = {}
+    for field in form_field_table(pdf_path):
+        fields[field["name"]] = field["value"]
+    return fields
+
+def form_field_table(pdf_path) -> List[FormField]:
+    """
+    Typed form fields (name, type, value, pages) of a PDF, read once per document
+    and cached (see forms.py). Accepts a path or a DocumentContext.
+    """
+    try:
+        with open_document(pdf_path) as ctx:
+            return ctx.memoize("form_fields", lambda: _read_form_fields(ctx))
+    except Exception as e:
+        print(f"Error extracting form fields: {e}")  # Debug info
+        return []
+
+def document_signatures(pdf_path) -> List[Dict[str, Any]]:
+    """
+    Digital signatures read from the PDF's signature fields (signer, signing time,
+    covered byte ranges), without rendering a page. Accepts a path or a DocumentContext.
+    """
+    return signatures(form_field_table(pdf_path))
+
+def _read_form_fields(ctx: DocumentContext) -> List[FormField]:
+    with span("form_fields", pages=ctx.page_count) as form_span:
+        cache = get_cache()
+        cache_key = make_key("form_table", ctx.digest, version=FORM_TABLE_VERSION)
+        cached = cache.get(cache_key)
+        form_span.set(cached=cached is not None)
+        if cached is not None:
+            return cached
+        fields = read_acroform(ctx.doc, ctx.size)
+        # Only flattened forms, without a field tree, are scanned page by page
+        form_span.set(source="acroform" if fields is not None else "pages")
+        if fields is None:
+            fields = scan_pages(ctx)
+        form_span.set(fields=len(fields))
+        cache.set(cache_key, fields)
+        return fields
+
+def convert_pdf_to_images(pdf_path: str, dpi: int = OCR_DPI) -> list:
+    """
+    Convert PDF pages to images with better error handling.
+    """
+    return pdf2image.convert_from_path(pdf_path, dpi=dpi)
+
+def extract_text_from_image(image: Image.Image, config: str = "") -> str:
+    """
+    Extract text from an image with improved error handling.
+    Runs on the persistent OCR worker pool when one is configured (see ocr_pool).
+    """
+    return ocr_image(image, config)
+
+def extract_layout_from_image(image: Image.Image, config: str = "") -> PageLayout:
+    """
+    Word boxes and confidences from a single OCR pass; the page text is derived from them.
+    """
+    return PageLayout(ocr_words(image, config))
+
+def _render_for_ocr(ctx: DocumentContext, page_num: int, dpi: int, gray: bool = False,
+                    region: Optional[Region] = None):
+    """
+    A page (or region) render to OCR: a PIL image, or when preprocessing steps are
+    configured, (pixmap, array view of its samples) so they work on its buffer without
+    a PIL copy. The view is taken here because fitz must stay on the document's thread.
+    """
+    with span("render", page=page_num + 1, dpi=dpi) as render_span:
+        if configured_steps():
+            pix = ctx.pixmap(page_num, dpi, gray, region)
+            render_span.set(bytes=len(pix.samples_mv))
+            return pix, pixmap_array(pix)
+        image = ctx.render_clip(page_num, region, dpi) if region is not None else ctx.render(page_num, dpi, gray)
+        render_span.set(bytes=image.width * image.height * len(image.getbands()))
+        return image
+
+def _render_words(render, config: str, dpi: int) -> Tuple[List[Word], Tuple[int, int]]:
+    """OCR words of a _render_for_ocr result in its pixel coordinates, and its size."""
+    if isinstance(render, Image.Image):
+        return ocr_words(render, config), render.size
+    # The pixmap travels with its view only to keep the buffer alive; NumPy releases the GIL on OCR threads
+    _, pixels = render
+    prepared = preprocess(pixels, configured_steps(), dpi)
+    return unmap_words(ocr_words(prepared.image(), config), prepared), prepared.original_size
+
+def _ocr_render(render, config: str, dpi: int) -> PageLayout:
+    return PageLayout(_render_words(render, config, dpi)[0])
+
+def _ocr_regions(renders: list, regions: Tuple[Region, ...], config: str, dpis: List[int]) -> PageLayout:
+    """OCR renders of page regions and return their words in page coordinates."""
+    words = []
+    for render, region, dpi in zip(renders, regions, dpis):
+        first_line = words[-1][6] + 1 if words else 0
+        region_words, size = _render_words(render, config, dpi)
+        words.extend(place_words(region_words, region, size, first_line))
+    return PageLayout(words)
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def _adaptive_policy() -> str:
+    # Part of the cache key for adaptive DPI decisions, so changing the steps or threshold re-decides
+    return f"{ADAPTIVE_DPI_STEPS}:{MIN_OCR_CONFIDENCE}"
+
+def needs_higher_dpi(layout: PageLayout) -> bool:
+    """Whether an OCR result is too sparse or too uncertain to trust at the resolution it was read."""
+    confidence = layout.mean_confidence()
+    return len(layout.text) < MIN_TEXT_LAYER_CHARS or confidence is None or confidence < MIN_OCR_CONFIDENCE
+
+class _Duplicate:
+    """OCR window entry of a page that duplicates an earlier page: (layout, dpi) now, or once that page finishes."""
+
+    __slots__ = ("of", "result")
+
+    def __init__(self, of: Dict[str, Any], result: Optional[Tuple[PageLayout, int]] = None):
+        self.of = of
+        self.result = result
+
+def _document_label(ctx: DocumentContext) -> str:
+    return os.path.basename(ctx.path) if ctx.path is not None else ctx.digest[:12]
+
+def _ocr_stream(ctx: DocumentContext, jobs: Iterable[Tuple[int, str, Any]], dpi: int, config: str,
+                window: Optional[int], max_workers: Optional[int], adaptive_dpi: bool = False,
+                ocr_report: Optional[List[Dict]] = None) -> Iterator[Tuple[int, str, str]]:
+    """
+    Turn (page_num, source, text) jobs into results in job order, OCR'ing the
+    jobs whose source is "ocr" on a thread pool. "mixed" jobs carry
+    (prefix, regions) instead of text: only those image regions are OCR'd,
+    and the result is merged with the page's text layer. At most `window`
+    pages are in flight: once the window is full, rendering waits for the
+    oldest page to be consumed, so memory is bounded by the window rather
+    than the page count.
+
+    With adaptive_dpi, "ocr" pages are first read in grayscale at the lowest of
+    ADAPTIVE_DPI_STEPS and re-read at the next step only while needs_higher_dpi.
+    The DPI, confidence and OCR time of each OCR'd page are appended to ocr_report.
+    Renders go through the preprocessing steps in HOSPITAL_PDF_PREPROCESS, if any.
+
+    An "ocr" page that duplicates a page OCR'd before, in this document or an
+    earlier one (see dedupe.py), takes that page's result instead of being
+    OCR'd; its ocr_report entry says which page under "duplicate_of".
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    window = max(1, window or DEFAULT_WINDOW_PER_WORKER * max_workers)
+    in_flight: Deque[Tuple[int, str, Union[str, PageLayout, Future, _Duplicate]]] = deque()
+    mixed_pages: Dict[int, Tuple[str, Tuple[Region, ...], PageLayout, List[int]]] = {}
+    page_dpi: Dict[int, int] = {}
+    mode = dedupe_mode()
+    # Duplicates may only reuse results read with the same settings
+    settings = (_adaptive_policy() if adaptive_dpi else dpi, config, configured_steps())
+    # Fingerprints of the pages being OCR'd, and the results of those that later pages duplicate
+    fingerprints: Dict[int, PageFingerprint] = {}
+    originals: Dict[int, Optional[Tuple[PageLayout, int]]] = {}
+
+    def duplicate_key(page: PageFingerprint) -> str:
+        return make_key("ocr_duplicate", page.digest, dpi=settings[0], config=config, preprocess=list(settings[2]))
+
+    def find_duplicate(page_num: int) -> Optional[_Duplicate]:
+        """The earlier page this one duplicates, or None if it has to be OCR'd."""
+        if mode == "off":
+            return None
+        near = mode == "near"
+        with span("fingerprint", page=page_num + 1) as fingerprint_span:
+            pix = ctx.pixmap(page_num, FINGERPRINT_DPI, gray=True)
+            page = fingerprint(pixmap_array(pix)[:, :, 0], ctx.page_text(page_num))
+            duplicate = None
+            # A page still being OCR'd ahead of this one in the window
+            original = next((other_num for other_num, other in fingerprints.items() if page.matches(other, near)), None)
+            if original is not None:
+                originals.setdefault(original, None)
+                duplicate = _Duplicate({"document": _document_label(ctx), "page": original + 1})
+            else:
+                found = page_index.find(settings, page, near)
+                if found is None:
+                    cached = get_cache().get(duplicate_key(page))
+                    if cached is not None:
+                        found = (PageLayout.from_json(cached["words"]), cached["dpi"]), cached["of"]
+                if found is not None:
+                    duplicate = _Duplicate(found[1], found[0])
+                else:
+                    fingerprints[page_num] = page
+            fingerprint_span.set(duplicate=duplicate is not None)
+            return duplicate
+
+    def finish(page_num, source, result):
+        if source == "mixed":
+            prefix, regions, text_layout, region_dpis = mixed_pages.pop(page_num)
+        else:
+            regions, page_dpis = None, page_dpi.pop(page_num, dpi)
+        seconds, cached, duplicate_of = 0.0, not isinstance(result, Future), None
+        if isinstance(result, _Duplicate):
+            duplicate_of = result.of
+            result, page_dpis = result.result or originals[duplicate_of["page"] - 1]
+            ctx.put_ocr_layout(page_num, page_dpis, config, result, gray=adaptive_dpi)
+            if adaptive_dpi:
+                ctx.put_adaptive_dpi(page_num, config, _adaptive_policy(), page_dpis)
+        elif not cached:
+            result, seconds = result.result()
+            ctx.put_ocr_layout(page_num, page_dpis if source == "ocr" else dpi, config, result, regions,
+                               gray=adaptive_dpi and source == "ocr")
+        if source == "ocr" and adaptive_dpi and duplicate_of is None:
+            # Escalate on this thread, which owns the document, while the result is not good enough
+            for next_dpi in (step for step in ADAPTIVE_DPI_STEPS if step > page_dpis):
+                if not needs_higher_dpi(result):
+                    break
+                page_dpis = next_dpi
+                layout = ctx.get_ocr_layout(page_num, next_dpi, config, gray=True)
+                if layout is None:
+                    image = _render_for_ocr(ctx, page_num, next_dpi, gray=True)
+                    layout, extra_seconds = executor.submit(_timed, _ocr_render, image, config, next_dpi).result()
+                    ctx.put_ocr_layout(page_num, next_dpi, config, layout, gray=True)
+                    seconds, cached = seconds + extra_seconds, False
+                result = layout
+            ctx.put_adaptive_dpi(page_num, config, _adaptive_policy(), page_dpis)
+        page = fingerprints.pop(page_num, None)
+        if page is not None:
+            # Later pages (here, in other documents and in other processes) that duplicate this one take its result
+            of = {"document": _document_label(ctx), "page": page_num + 1}
+            page_index.add(settings, page, (result, page_dpis), of)
+            get_cache().set(duplicate_key(page), {"words": result.to_json(), "dpi": page_dpis, "of": of})
+            if page_num in originals:
+                originals[page_num] = (result, page_dpis)
+        if source != "text":
+            record("ocr", seconds, page=page_num + 1, source=source,
+                   dpi=region_dpis if source == "mixed" else page_dpis, cached=cached,
+                   duplicate=duplicate_of is not None)
+        if ocr_report is not None and source != "text":
+            confidence = result.mean_confidence()
+            ocr_report.append({
+                "page": page_num + 1,
+                "source": source,
+                "dpi": region_dpis if source == "mixed" else page_dpis,
+                "confidence": round(confidence, 1) if confidence is not None else None,
+                "seconds": round(seconds, 3),
+                "cached": cached,
+            })
+            if duplicate_of is not None:
+                ocr_report[-1]["duplicate_of"] = duplicate_of
+        if source == "mixed":
+            return page_num, source, prefix + text_layout.with_regions(result).text
+        return page_num, source, result.text if isinstance(result, PageLayout) else result
+
+    # Each Tesseract call runs in its own process, so threads are enough to keep all cores busy.
+    # Rendering stays on this thread because a fitz document must not be shared across threads.
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for page_num, source, text in jobs:
+            if source == "ocr" and adaptive_dpi:
+                # Start where an earlier run settled, otherwise at the lowest step
+                first_dpi = ctx.get_adaptive_dpi(page_num, config, _adaptive_policy()) or ADAPTIVE_DPI_STEPS[0]
+                page_dpi[page_num] = first_dpi
+                text = ctx.get_ocr_layout(page_num, first_dpi, config, gray=True)
+                if text is None:
+                    text = find_duplicate(page_num)
+                if text is None:
+                    image = _render_for_ocr(ctx, page_num, first_dpi, gray=True)
+                    text = executor.submit(_timed, _ocr_render, image, config, first_dpi)
+            elif source == "ocr":
+                text = ctx.get_ocr_layout(page_num, dpi, config)
+                if text is None:
+                    text = find_duplicate(page_num)
+                if text is None:
+                    text = executor.submit(_timed, _ocr_render, _render_for_ocr(ctx, page_num, dpi), config, dpi)
+            elif source == "mixed":
+                prefix, regions = text
+                boxes = tuple(region for region, _ in regions)
+                # Render each image at its own resolution, never above the page DPI
+                region_dpis = [int(min(dpi, max(MIN_REGION_DPI, native_dpi))) for _, native_dpi in regions]
+                mixed_pages[page_num] = (prefix, boxes, ctx.text_layout(page_num), region_dpis)
+                text = ctx.get_ocr_layout(page_num, dpi, config, boxes)
+                if text is None:
+                    images = [_render_for_ocr(ctx, page_num, region_dpi, region=region)
+                              for region, region_dpi in zip(boxes, region_dpis)]
+                    text = executor.submit(_timed, _ocr_regions, images, boxes, config, region_dpis)
+            in_flight.append((page_num, source, text))
+            # Yield everything already finished at the head, then apply backpressure
+            while in_flight and (len(in_flight) >= window or not isinstance(in_flight[0][2], Future)):
+                yield finish(*in_flight.popleft())
+        while in_flight:
+            yield finish(*in_flight.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _form_field_prefixes(ctx: DocumentContext) -> Dict[int, str]:
+    """Text prepended to each page: the form fields shown on it, last field first."""
+    prefixes: Dict[int, str] = {}
+    for field in form_field_table(ctx):
+        if field["value"] and isinstance(field["value"], str):
+            # Fields whose widgets are on no page belong to the first
+            for page_num in field["pages"] or [0]:
+                prefixes[page_num] = f"{field['name']}: {field['value']}\n" + prefixes.get(page_num, "")
+    return prefixes
+
+def _regions_without_text(ctx: DocumentContext, page_num: int) -> List[Tuple[Region, float]]:
+    """Image regions of a page whose text is not already in the text layer (as in searchable scans)."""
+    words = ctx.text_layout(page_num).words if ctx.image_regions(page_num) else []
+    regions = []
+    for region, native_dpi in ctx.image_regions(page_num):
+        x0, y0, x1, y1 = region
+        covered = sum(len(w[0]) for w in words if x0 <= (w[1] + w[3]) / 2 <= x1 and y0 <= (w[2] + w[4]) / 2 <= y1)
+        if covered < MIN_TEXT_LAYER_CHARS:
+            regions.append((region, native_dpi))
+    return regions
+
+def _classify_page(ctx: DocumentContext, page_num: int, prefix: str, force_ocr: bool) -> Tuple[int, str, Any]:
+    """
+    Job for _ocr_stream: "text" for pages read from the text layer, "ocr" for full-page
+    OCR, or "mixed" for pages where only the embedded images lacking text are OCR'd.
+    """
+    with span("classify", page=page_num + 1) as classify_span:
+        job = _classify(ctx, page_num, prefix, force_ocr)
+        classify_span.set(source=job[1])
+        return job
+
+def _classify(ctx: DocumentContext, page_num: int, prefix: str, force_ocr: bool) -> Tuple[int, str, Any]:
+    text = prefix + ctx.page_text(page_num).strip()
+    if force_ocr:
+        return page_num, "ocr", None
+    regions = _regions_without_text(ctx, page_num)
+    if len(text) < MIN_TEXT_LAYER_CHARS:
+        page_rect = ctx.page(page_num).rect
+        coverage = sum((x1 - x0) * (y1 - y0) for (x0, y0, x1, y1), _ in regions) / (page_rect.width * page_rect.height)
+        # A full-page scan, or a page with no images at all (e.g. outlined text), is OCR'd whole as before
+        if not regions or coverage >= FULL_PAGE_IMAGE_COVERAGE:
+            return page_num, "ocr", None
+    if regions:
+        return page_num, "mixed", (prefix, regions)
+    return page_num, "text", text
+
+def iter_page_texts(pdf_path, window: Optional[int] = None, dpi: int = OCR_DPI, force_ocr: bool = False,
+                    include_form_fields: bool = True, ocr_workers: Optional[int] = None,
+                    text_first: bool = False, adaptive_dpi: bool = False,
+                    ocr_report: Optional[List[Dict]] = None) -> Iterator[Tuple[int, str, str]]:
+    """
+    Yield (page_num, source, text) for every page in order, where source is
+    "text" for the native text layer, "ocr" for a page OCR'd whole, or "mixed"
+    for a text page with embedded scanned images, which are OCR'd on their own
+    and merged into the text. Pages are OCR'd with at most `window` in flight.
+    With text_first, all text-layer pages are yielded before any page is
+    rendered, so a consumer that stops early skips the OCR pages entirely.
+    adaptive_dpi and ocr_report are described in _ocr_stream.
+    """
+    with open_document(pdf_path) as ctx:
+        prefixes = _form_field_prefixes(ctx) if include_form_fields else {}
+
+        jobs = (_classify_page(ctx, page_num, prefixes.get(page_num, ""), force_ocr)
+                for page_num in range(ctx.page_count))
+        if text_first:
+            # Reading the text layer is cheap, so classify every page up front and defer the OCR ones
+            classified = list(jobs)
+            jobs = [job for job in classified if job[1] == "text"] + [job for job in classified if job[1] != "text"]
+        yield from _ocr_stream(ctx, jobs, dpi, "", window, ocr_workers, adaptive_dpi, ocr_report)
+
+def ocr_pages(pdf_path, page_numbers: List[int], dpi: int = OCR_DPI,
+              max_workers: Optional[int] = None, config: str = "", window: Optional[int] = None) -> List[str]:
+    """
+    Render the given pages in-process and OCR them on a bounded worker pool.
+    Returns the OCR text for each page in the order of page_numbers.
+    Pages already OCR'd through the same DocumentContext or found in the result cache are not OCR'd again.
+    """
+    with open_document(pdf_path) as ctx:
+        unique_pages = list(dict.fromkeys(page_numbers))
+        jobs = ((page_num, "ocr", None) for page_num in unique_pages)
+        texts = {page_num: text for page_num, _, text in _ocr_stream(ctx, jobs, dpi, config, window, max_workers)}
+        return [texts[page_num] for page_num in page_numbers]
+
+def page_layouts(pdf_path, page_numbers: Optional[List[int]] = None, dpi: int = OCR_DPI,
+                 force_ocr: bool = False, adaptive_dpi: bool = False) -> List[PageLayout]:
+    """
+    Word layout for each page: the text layer where extract_text_from_pdf reads it,
+    otherwise the OCR layout, which is shared with extract_text_from_pdf so no page is OCR'd twice.
+    """
+    with open_document(pdf_path) as ctx:
+        if page_numbers is None:
+            page_numbers = list(range(ctx.page_count))
+        prefixes = _form_field_prefixes(ctx)
+        jobs = {page_num: _classify_page(ctx, page_num, prefixes.get(page_num, ""), force_ocr)
+                for page_num in page_numbers}
+        # Run (or fetch) the OCR the same way extract_text_from_pdf does
+        ocr_jobs = [job for job in jobs.values() if job[1] != "text"]
+        for _ in _ocr_stream(ctx, ocr_jobs, dpi, "", None, None, adaptive_dpi):
+            pass
+        layouts = []
+        for page_num in page_numbers:
+            _, source, detail = jobs[page_num]
+            if source == "ocr" and adaptive_dpi:
+                page_dpi = ctx.get_adaptive_dpi(page_num, "", _adaptive_policy())
+                layouts.append(ctx.get_ocr_layout(page_num, page_dpi, gray=True))
+            elif source == "ocr":
+                layouts.append(ctx.get_ocr_layout(page_num, dpi))
+            elif source == "mixed":
+                regions = tuple(region for region, _ in detail[1])
+                layouts.append(ctx.text_layout(page_num).with_regions(ctx.get_ocr_layout(page_num, dpi, "", regions)))
+            else:
+                layouts.append(ctx.text_layout(page_num))
+        return layouts
+
+def extract_text_from_pdf(pdf_path, ocr_workers: Optional[int] = None, adaptive_dpi: bool = False):
+    try:
+        return [text for _, _, text in iter_page_texts(pdf_path, ocr_workers=ocr_workers, adaptive_dpi=adaptive_dpi)]
+    except Exception as e:
+        return f"Error extracting text: {e}"
+
+def fuzzy_find_section(text, section, threshold=DEFAULT_FUZZY_THRESHOLD):
+    lines = text.split('\n')
+    hits = np.flatnonzero(score_lines(lines, [section], threshold)[:, 0] >= threshold)
+    if len(hits):
+        return lines[hits[0]].strip()  # Return the actual heading found
+    return None
+
+def fuzzy_find_all_headings(text, section, all_sections, threshold=DEFAULT_FUZZY_THRESHOLD):
+    # Only match if not also a fuzzy match for any longer section name
+    sections = list(all_sections)
+    if section not in sections:
+        sections.insert(0, section)
+    return score_sections([text], sections, threshold).headings(sections.index(section), threshold)[0]
+
+def analyze_sections(text_per_page, threshold=DEFAULT_FUZZY_THRESHOLD, heading_shape=False):
+    # heading_shape skips lines that do not look like headings; faster but may miss
+    # headings buried in body text (see matching.measure_prefilter_recall)
+    with span("match", pages=len(text_per_page)):
+        return score_sections(text_per_page, SECTION_HEADERS, threshold, heading_shape).summary(threshold)
+
+def is_referral_form(text_per_page):
+    for text in text_per_page:
+        for keyword in REFERRAL_KEYWORDS:
+            if keyword in text.lower():
+                return keyword  # Return the keyword found for better feedback
+    return None
+
+# Compiled once: every label of every referral field, found in one scan per line
+_REFERRAL_LABELS = LabelMatcher(REFERRAL_FIELD_LABELS)
+# Value after a label: after a colon or whitespace, up to the next label on the line
+_LABEL_VALUE = re.compile(r"[\s:]*([\w\-/,. ]+)")
+_SIGNATURE_DATE = re.compile(r"date:?\s*([0-9.-]+\s*(?:[0-9:]+)?\s*(?:IST|UTC|GMT)?)", re.IGNORECASE)
+_AGE_VALUE = re.compile(r"\b(\d{1,3})\b")
+_GENDER_VALUE = re.compile(r"\b(male|female|m|f)\b")
+
+def extract_referral_fields(text):
+    """
+    Read the referral fields from form text in one pass over its lines.
+    Returns the field values and the names of the fields left empty.
+    """
+    lines = text.split('\n')
+    labels = [_REFERRAL_LABELS.find(line.lower()) for line in lines]
+    result = {field: "" for field in REFERRAL_FIELD_LABELS}
+    signed_date = False
+
+    for i, line in enumerate(lines):
+        lcline = line.lower()
+        for n, (start, end, field, label) in enumerate(labels[i]):
+            if label == "digitally signed by":
+                # The signature block wins over labels elsewhere: the next line
+                # usually contains the name, one of the three after it the timestamp
+                if i + 1 < len(lines):
+                    result["Digital Signature"] = lines[i + 1].strip()
+                for j in range(i + 1, min(i + 4, len(lines))):
+                    if "date:" in lines[j].lower():
+                        timestamp_match = _SIGNATURE_DATE.search(lines[j])
+                        if timestamp_match:
+                            result["Date"] = timestamp_match.group(1).strip()
+                            signed_date = True
+                        break
+                continue
+            if result[field] or (field == "Date" and signed_date):
+                continue
+
+            # Value after the label, stopping where another field's label begins
+            # ("Gender: Male" - "male" is a Gender label itself)
+            stop = next((hit[0] for hit in labels[i][n + 1:] if hit[2] != field), len(lcline))
+            match = _LABEL_VALUE.match(lcline, end, stop)
+            value = match.group(1).strip() if match else ""
+            # For Age, try to extract a number
+            if field == "Age" and not value:
+                age_match = _AGE_VALUE.search(lcline)
+                if age_match:
+                    value = age_match.group(1)
+            # For Gender, look for M/F or Male/Female
+            if field == "Gender" and not value:
+                g_match = _GENDER_VALUE.search(lcline)
+                if g_match:
+                    value = g_match.group(1)
+            # If value is still empty, try next line unless it holds another label
+            if not value and i + 1 < len(lines) and not labels[i + 1]:
+                value = lines[i + 1].strip()
+            result[field] = value
+
+    empty_fields = [field for field, value in result.items() if not value or not value.strip()]
+    return result, empty_fields
+
+def _signature_fields(ctx: DocumentContext) -> Dict[str, str]:
+    """Digital Signature and Date of the first signed signature field, if the PDF has one."""
+    for signature in document_signatures(ctx):
+        fields = {}
+        if signature["signer"]:
+            fields["Digital Signature"] = signature["signer"]
+        if signature["signed_at"]:
+            fields["Date"] = signature["signed_at"]
+        return fields
+    return {}
+
+def ocr_referral_form(pdf_path, adaptive_dpi: bool = False):
+    # One context for the whole form so it is opened, parsed and OCR'd once
+    with open_document(pdf_path) as ctx:
+        # Extract form fields first; digital signatures are read with them, before any page is rendered
+        form_fields = extract_pdf_form_fields(ctx)
+        native_sig_fields = _signature_fields(ctx)
+        # Then extract scanned form fields
+        fields = extract_scanned_form_fields(ctx, adaptive_dpi)
+
+        # Get text content for the caller
+        text_per_page = extract_text_from_pdf(ctx, adaptive_dpi=adaptive_dpi)
+        if isinstance(text_per_page, str) and text_per_page.startswith("Error"):
+            return text_per_page, "", "", ""
+        # Word layouts of the same pages (no extra OCR), only needed to find a printed or scanned signature
+        layouts = [] if "Digital Signature" in native_sig_fields else page_layouts(ctx, adaptive_dpi=adaptive_dpi)
+
+    full_text = '\n'.join(text_per_page)
+
+    # Extract signature and date from the text
+    parse_start = time.perf_counter()
+    sig_fields = {}
+    for layout in layouts:
+        for i in range(len(layout.lines)):
+            line = layout.line_text(i)
+            if "digitally signed by" in line.lower():
+                # The signer's name is printed beside or beneath the label
+                name_line = layout.value_line(i)
+                if name_line is not None:
+                    sig_fields["Digital Signature"] = layout.line_text(name_line).strip()
+            elif "date:" in line.lower():
+                timestamp_match = _SIGNATURE_DATE.search(line)
+                if timestamp_match:
+                    sig_fields["Date"] = timestamp_match.group(1).strip()
+
+    record("parse_signature", time.perf_counter() - parse_start, pages=len(layouts), fields=len(sig_fields),
+           native=bool(native_sig_fields))
+    # What the signature dictionary states wins over what is printed on the page
+    sig_fields.update(native_sig_fields)
+
+    # Merge signature fields with form fields
+    fields.update(sig_fields)
+
+    # Determine empty fields - only the ones we can detect reliably
+    empty_fields = []
+    for field in [
+        "Patient Name", "Patient ID", "Contact",
+        "Hospital Name", "Referred To", "Diagnosis",
+        "Digital Signature", "Date"
+    ]:
+        if not fields.get(field):
+            empty_fields.append(field)
+
+    # Merge form fields into extracted fields if they exist
+    if isinstance(form_fields, dict):
+        for field_name, field_value in form_fields.items():
+            field_name = field_name.strip().lower()
+            # Find matching field name
+            for form_key, our_key in FORM_FIELD_NAMES.items():
+                if form_key in field_name and not fields.get(our_key):  # Only use if our field is empty
+                    fields[our_key] = field_value
+                    if our_key in empty_fields:
+                        empty_fields.remove(our_key)
+
+    # Also return the raw OCR output for the first page for debugging
+    first_page_ocr = text_per_page[0] if text_per_page else ""
+    return fields, empty_fields, full_text, first_page_ocr
+
+# Every field pattern compiled once, and all of them as one alternation that finds
+# the positions where any label starts; only those positions are tried per pattern
+_SCANNED_FIELD_RULES = [(field, rank, re.compile(pattern))
+                        for field, patterns in SCANNED_FIELD_PATTERNS.items() for rank, pattern in enumerate(patterns)]
+_SCANNED_FIELDS = re.compile("|".join(pattern for patterns in SCANNED_FIELD_PATTERNS.values() for pattern in patterns))
+# Lowercases ASCII letters only, so offsets in the lowered line stay valid in the original
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+_PHONE = re.compile(r"\b\d{10}\b")
+_EMAIL = re.compile(r"\S+@\S+\.\S+")
+_FORCE_TYPE = re.compile(r"\s*\|\s*Force Type.*")
+_CLINICAL_NOTES = re.compile(r"clinical\s+notes\s*[:\s]\s*", re.IGNORECASE)
+
+def _clean_field_value(field_name: str, value: str, line: str) -> str:
+    value = value.strip()
+    if field_name == "Contact":
+        # Try to find phone number
+        if phone_match := _PHONE.search(line):
+            value = phone_match.group(0)
+        # Try to find email
+        if email_match := _EMAIL.search(line):
+            email = email_match.group(0)
+            value = f"{value} | Email ID: {email}" if value else email
+    elif field_name == "Patient Name":
+        # Clean up patient name
+        value = _FORCE_TYPE.sub('', value).strip()
+    elif field_name == "Diagnosis":
+        # Clean up diagnosis text
+        value = _CLINICAL_NOTES.sub('', value).strip()
+    return value
+
+def extract_scanned_form_fields(pdf_path, adaptive_dpi: bool = False):
+    """Extract fields from a scanned form by looking at specific regions"""
+    try:
+        # The first page as extract_text_from_pdf reads it: the text layer of a digital form,
+        # or the OCR of a scan with the same settings, so whichever runs second reuses it
+        layout = page_layouts(pdf_path, [0], adaptive_dpi=adaptive_dpi)[0]
+        return parse_scanned_form_fields(layout)
+
+    except Exception as e:
+        print(f"Error extracting scanned form fields: {e}")
+        return {}
+
+def parse_scanned_form_fields(layout: PageLayout) -> Dict[str, str]:
+    """Form fields in the lines of a page layout (see SCANNED_FIELD_PATTERNS)."""
+    fields = {}
+    lines = [layout.line_text(i) for i in range(len(layout.lines))]
+    parse_start = time.perf_counter()
+    # Matching runs on lowercased lines; lines holding any field label are
+    # never taken as another label's value
+    lowered = [line.translate(_ASCII_LOWER) for line in lines]
+    first_match = [_SCANNED_FIELDS.search(line) for line in lowered]
+
+    # Process each line
+    for i, line in enumerate(lines):
+        # Skip empty lines
+        if not line.strip():
+            continue
+        match = first_match[i]
+        # A bare label ("Referred To:") takes its value from the line beside or beneath it,
+        # unless that line holds a label of its own
+        label_value_line = layout.value_line(i) if line.rstrip().endswith(":") else None
+        if label_value_line is not None and first_match[label_value_line] is None:
+            line = f"{line.rstrip()} {lines[label_value_line].strip()}"
+            match = _SCANNED_FIELDS.search(line.translate(_ASCII_LOWER))
+        if match is None:
+            continue
+
+        # Every field on the line with the value of each pattern's first match
+        captures: Dict[str, Dict[int, Optional[str]]] = {}
+        lower = match.string
+        while match is not None:
+            position = match.start()
+            for field_name, rank, pattern in _SCANNED_FIELD_RULES:
+                if rank in captures.get(field_name, ()) or not (found := pattern.match(lower, position)):
+                    continue
+                captures.setdefault(field_name, {})[rank] = line[found.start(1):found.end(1)] if pattern.groups else None
+            match = _SCANNED_FIELDS.search(lower, position + 1)
+
+        for field_name, by_rank in captures.items():
+            # The value of the most preferred pattern that captured one
+            value = ""
+            for rank in sorted(by_rank):
+                if by_rank[rank] is not None:
+                    value = _clean_field_value(field_name, by_rank[rank], line)
+                    if value:
+                        break
+
+            # If no value found, look beside or beneath the label
+            value_line = layout.value_line(i)
+            if not value and value_line is not None and first_match[value_line] is None:
+                value = lines[value_line].strip()
+
+            fields[field_name] = value
+
+    record("parse_fields", time.perf_counter() - parse_start, lines=len(lines), fields=len(fields))
+    return fields
+
+def process_pdf(pdf_path: str, doc_type: str = "Discharge Summary", threshold: int = DEFAULT_FUZZY_THRESHOLD,
+                window: Optional[int] = None) -> dict:
+    """
+    Process a PDF file, falling back to full-document OCR when it has no usable form fields.
+    Pages are rendered, OCR'd and analyzed as a stream, so memory use is bounded by
+    the in-flight page window instead of the document length.
+    """
+    analyze = analyze_discharge_summary if doc_type == "Discharge Summary" else analyze_referral_form
+    with open_document(pdf_path) as ctx:
+        # First try to extract form fields (for digital PDFs)
+        form_fields = extract_pdf_form_fields(ctx)
+
+        # If no form fields found or minimal content, try OCR
+        if not form_fields or sum(len(str(v)) for v in form_fields.values()) < 50:
+            # Both analyzers test each line independently, so per-page results combine with "or"
+            found = analyze("", threshold)
+            for _, _, text in iter_page_texts(ctx, window=window, force_ocr=True, include_form_fields=False):
+                for key, present in analyze(text, threshold).items():
+                    found[key] = found[key] or present
+            return found
+
+    return form_fields
+
+def analyze_discharge_summary(text: str, threshold: int = DEFAULT_FUZZY_THRESHOLD) -> Dict[str, bool]:
+    """
+    Analyze discharge summary text for required sections.
+    """
+    sections_found = {header: False for header in SECTION_HEADERS}
+    sections_lower = [section.lower() for section in SECTION_HEADERS]
+
+    # Check for each section using fuzzy matching, skipping pairs whose
+    # character overlap rules out reaching the threshold
+    lines = list(dict.fromkeys(line.lower() for line in text.split('\n')))
+    candidates = 100 * ratio_upper_bound(lines, sections_lower) >= threshold - 1
+    for row, col in zip(*np.nonzero(candidates)):
+        section = SECTION_HEADERS[col]
+        if sections_found[section]:
+            continue
+        # Use fuzzy matching to account for OCR errors
+        if fuzz.ratio(lines[row], sections_lower[col]) >= threshold:
+            sections_found[section] = True
+
+    return sections_found
+
+def analyze_referral_form(text: str, threshold: int = DEFAULT_FUZZY_THRESHOLD) -> Dict[str, bool]:
+    """
+    Analyze referral form text for required fields.
+    """
+    fields_found = {keyword: False for keyword in REFERRAL_KEYWORDS}
+
+    # Check for each required field using fuzzy matching
+    for line in text.split('\n'):
+        for keyword in REFERRAL_KEYWORDS:
+            # Use fuzzy matching to account for OCR errors
+            if fuzz.partial_ratio(line.lower(), keyword.lower()) >= threshold:
+                fields_found[keyword] = True
+
+    return fields_found
+
+def analyze_document(pdf_path: str, doc_type: Optional[str] = None, threshold: int = DEFAULT_FUZZY_THRESHOLD,
+                     ocr_workers: Optional[int] = None, full_scan: bool = False, adaptive_dpi: bool = False) -> dict:
+    """
+    Run the same analysis as the UI on one PDF and return a JSON-serializable result.
+    When doc_type is None the type is guessed from the referral keywords.
+    Text-layer pages are read first and reading stops once the result is decided;
+    full_scan reads every page so the section page lists are complete, and
+    adaptive_dpi reads scans at the lowest resolution that OCRs confidently.
+    """
+    from pipeline import scan_pages  # pipeline builds on this module
+
+    result = {"path": pdf_path if isinstance(pdf_path, str) else None, "doc_type": doc_type}
+    with open_document(pdf_path) as ctx:
+        if doc_type is None or doc_type == "Discharge Summary":
+            try:
+                scan = scan_pages(ctx, threshold, detect_referral=doc_type is None, full_scan=full_scan,
+                                  ocr_workers=ocr_workers, adaptive_dpi=adaptive_dpi)
+            except Exception as e:
+                result["error"] = f"Error extracting text: {e}"
+                return result
+            if doc_type is None:
+                doc_type = "Referral Form" if scan["referral_keyword"] else "Discharge Summary"
+                result["doc_type"] = doc_type
+            if doc_type == "Discharge Summary":
+                result["pages"] = len(scan["text_per_page"])
+                result["pages_read"] = scan["pages_read"]
+                result["sections"] = scan["sections"]
+                result["ocr"] = scan["ocr_report"]
+                result["duplicate_pages"] = scan["duplicate_pages"]
+                return result
+
+        fields, empty_fields, full_text, first_page_ocr = ocr_referral_form(ctx, adaptive_dpi)
+        result["signatures"] = document_signatures(ctx)
+    if isinstance(fields, str) and fields.startswith("Error"):
+        result["error"] = fields
+        return result
+    result["fields"] = fields
+    result["empty_fields"] = empty_fields
+    return result
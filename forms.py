@@ -0,0 +1,275 @@
+"""
+Form field table of a PDF.
+
+Interactive forms are read from the document's AcroForm field tree, walked
+once from the catalog without loading any page: partial names are joined
+into full names ("patient.name"), the field type, value and flags are
+inherited from parent fields as the PDF specification prescribes, and each
+field's widgets are mapped to the pages whose /Annots list them. A field
+whose widgets appear on several pages is one entry.
+
+Signed signature fields also carry what their /Sig dictionary states - the
+signer's name, the signing time and the byte ranges the signature covers -
+so a digital signature is reported without rendering or OCR'ing a page.
+Whether the byte ranges span the whole file tells if the document was
+changed after signing; the cryptographic signature itself is not checked.
+
+Only documents without an AcroForm tree (flattened forms, where the values
+are plain page content) fall back to scanning pages: widgets, text-field
+marked content and FreeText annotations with a label above them.
+
+Each entry is a JSON-serializable dict:
+    {"name": str, "type": "text" | "checkbox" | "radio" | "button" | "choice" | "signature" | "unknown",
+     "value": str, "pages": [page numbers, 0-based],
+     "signature": {"signer", "signed_at", "reason", "location", "sub_filter", "byte_range",
+                   "covers_document"}  (signed signature fields only)}
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from deps import lazy_import
+
+fitz = lazy_import("fitz")  # PyMuPDF
+
+FIELD_TYPES = {"/Tx": "text", "/Ch": "choice", "/Sig": "signature"}
+# Types of the widgets PyMuPDF reports (Widget.field_type_string)
+WIDGET_TYPES = {"Text": "text", "CheckBox": "checkbox", "RadioButton": "radio", "Button": "button",
+                "ComboBox": "choice", "ListBox": "choice", "Signature": "signature"}
+# Button field flags (PDF 32000-1, table 226)
+RADIO_FLAG = 1 << 15
+PUSHBUTTON_FLAG = 1 << 16
+# Bumped when the table's contents change, so cached tables are read again
+FORM_TABLE_VERSION = 3
+# Field trees nested deeper than this are malformed (or cyclic) and cut off
+MAX_FIELD_DEPTH = 32
+
+_REFERENCE = re.compile(r"(\d+)\s+\d+\s+R")
+_ARRAY_STRING = re.compile(r"\(((?:[^()\\]|\\.)*)\)")
+# Escapes in a PDF literal string: octal codes, control characters, escaped delimiters and line breaks
+_ESCAPE = re.compile(r"\\([0-7]{1,3}|\r\n|.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f"}
+# D:YYYYMMDDHHmmSS followed by Z or an offset such as +05'30'; everything after the year is optional
+_PDF_DATE = re.compile(r"D:(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?(?:([Zz])|([+-])(\d{2})'?(\d{2})?'?)?")
+
+FormField = Dict[str, object]
+
+def _references(text: str) -> List[int]:
+    return [int(xref) for xref in _REFERENCE.findall(text)]
+
+def _array_refs(doc: fitz.Document, xref: int, key: str) -> List[int]:
+    """Object numbers in an array stored under key, directly or as an indirect array."""
+    kind, value = doc.xref_get_key(xref, key)
+    if kind == "xref":
+        value = doc.xref_object(_references(value)[0], compressed=True)
+    elif kind != "array":
+        return []
+    return _references(value)
+
+def _decode_text(data: bytes) -> str:
+    """Text of a PDF string or stream: UTF-16 with a byte order mark, else UTF-8, else PDFDocEncoding."""
+    if data[:2] == b"\xfe\xff":
+        return data[2:].decode("utf-16-be", "replace")
+    if data[:3] == b"\xef\xbb\xbf":
+        data = data[3:]
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
+
+def _string_bytes(token: str) -> bytes:
+    """Bytes of a PDF literal "(...)" or hex "<...>" string as written in an object."""
+    if token.startswith("<"):
+        digits = re.sub(r"\s", "", token[1:-1])
+        return bytes.fromhex(digits + "0" * (len(digits) % 2))
+
+    def unescape(match: re.Match) -> str:
+        escaped = match.group(1)
+        if escaped[0] in "01234567":
+            return chr(int(escaped, 8) & 0xFF)
+        return _ESCAPES.get(escaped, "" if escaped in "\r\n" else escaped)
+
+    return _ESCAPE.sub(unescape, token[1:-1]).encode("latin-1", "replace")
+
+def _resolve_value(doc: fitz.Document, reference: str) -> Tuple[str, str]:
+    """(kind, value) of an indirect /V, in the form xref_get_key gives direct values."""
+    xref = _references(reference)[0]
+    if doc.xref_is_stream(xref):
+        # Long text field values may be stored as streams
+        return "string", _decode_text(doc.xref_stream(xref) or b"")
+    value = doc.xref_object(xref, compressed=True).strip()
+    if value[:1] == "(" or (value[:1] == "<" and value[:2] != "<<"):
+        return "string", _decode_text(_string_bytes(value))
+    if value[:1] == "/":
+        return "name", value
+    if value[:1] == "[":
+        return "array", value
+    if re.fullmatch(r"[+-]?\d+", value):
+        return "int", value
+    return "null", value
+
+def _field_value(kind: str, value: str) -> str:
+    if kind == "string":
+        return value.strip()
+    if kind == "name":
+        # Checkbox and radio states ("/Yes", "/Off")
+        return value.lstrip("/")
+    if kind == "array":
+        # Multiple selections of a choice field
+        return ", ".join(item.strip() for item in _ARRAY_STRING.findall(value))
+    if kind in ("int", "float", "bool"):
+        return value
+    # Missing, or indirect (resolved by the caller)
+    return ""
+
+def _field_type(field_type: Optional[str], flags: int) -> str:
+    if field_type == "/Btn":
+        if flags & PUSHBUTTON_FLAG:
+            return "button"
+        return "radio" if flags & RADIO_FLAG else "checkbox"
+    return FIELD_TYPES.get(field_type, "unknown")
+
+def pdf_date(value: str) -> str:
+    """A PDF date ("D:20240312102200+05'30'") as "2024-03-12 10:22:00 +05:30"; other text as given."""
+    match = _PDF_DATE.match(value.strip())
+    if match is None:
+        return value.strip()
+    year, month, day, hour, minute, second, utc, sign, tz_hour, tz_minute = match.groups()
+    text = f"{year}-{month or '01'}-{day or '01'} {hour or '00'}:{minute or '00'}:{second or '00'}"
+    if utc:
+        return text + " UTC"
+    if sign:
+        return text + f" {sign}{tz_hour}:{tz_minute or '00'}"
+    return text
+
+def _read_signature(doc: fitz.Document, xref: int, file_size: Optional[int]) -> Dict[str, object]:
+    """What a /Sig dictionary states about a signature."""
+    def text(key: str) -> str:
+        kind, value = doc.xref_get_key(xref, key)
+        return value.strip() if kind == "string" else ""
+
+    kind, sub_filter = doc.xref_get_key(xref, "SubFilter")
+    sub_filter = sub_filter.lstrip("/") if kind == "name" else ""
+    kind, value = doc.xref_get_key(xref, "ByteRange")
+    byte_range = [int(number) for number in re.findall(r"-?\d+", value)] if kind == "array" else []
+    covers_document = None
+    if len(byte_range) == 4 and file_size is not None:
+        # Signed from the first byte to the last, except the signature's own /Contents
+        covers_document = byte_range[0] == 0 and byte_range[2] + byte_range[3] == file_size
+    return {
+        "signer": text("Name"),
+        "signed_at": pdf_date(text("M")),
+        "reason": text("Reason"),
+        "location": text("Location"),
+        "sub_filter": sub_filter,
+        "byte_range": byte_range,
+        "covers_document": covers_document,
+    }
+
+def _widget_pages(doc: fitz.Document) -> Dict[int, int]:
+    """Page number of every annotation, from each page's /Annots array."""
+    pages = {}
+    for page_num in range(doc.page_count):
+        for xref in _array_refs(doc, doc.page_xref(page_num), "Annots"):
+            pages.setdefault(xref, page_num)
+    return pages
+
+def read_acroform(doc: fitz.Document, file_size: Optional[int] = None) -> Optional[List[FormField]]:
+    """
+    Fields of the AcroForm tree in document order, or None when the document has no
+    AcroForm fields. file_size (in bytes) is needed to tell whether signatures cover the whole file.
+    """
+    roots = _array_refs(doc, doc.pdf_catalog(), "AcroForm/Fields")
+    if not roots:
+        return None
+    widget_pages = _widget_pages(doc)
+    fields: Dict[str, FormField] = {}
+    seen = set()
+
+    def walk(xref: int, parent_name: str, inherited: Tuple[Optional[str], Tuple[str, str], int], depth: int):
+        if xref in seen or depth > MAX_FIELD_DEPTH:
+            return
+        seen.add(xref)
+        field_type, value, flags = inherited
+        kind, partial = doc.xref_get_key(xref, "T")
+        name = partial.strip() if kind == "string" else ""
+        full_name = f"{parent_name}.{name}" if parent_name and name else parent_name or name
+        kind, own_type = doc.xref_get_key(xref, "FT")
+        if kind == "name":
+            field_type = own_type
+        kind, own_value = doc.xref_get_key(xref, "V")
+        if kind != "null":
+            value = (kind, own_value)
+        kind, own_flags = doc.xref_get_key(xref, "Ff")
+        if kind == "int":
+            flags = int(own_flags)
+
+        # Kids with a partial name of their own are fields; kids without one are this field's widgets
+        kids = _array_refs(doc, xref, "Kids")
+        child_fields = [kid for kid in kids if doc.xref_get_key(kid, "T")[0] == "string"]
+        for kid in child_fields:
+            walk(kid, full_name, (field_type, value, flags), depth + 1)
+        if child_fields or not full_name:
+            return
+        widgets = [kid for kid in kids if kid not in child_fields] or [xref]
+        entry = fields.get(full_name)
+        if entry is None:
+            entry = fields[full_name] = {"name": full_name, "type": _field_type(field_type, flags),
+                                         "value": _field_value(*value), "pages": []}
+            if field_type == "/Sig" and value[0] == "xref":
+                entry["signature"] = _read_signature(doc, _references(value[1])[0], file_size)
+                entry["value"] = entry["signature"]["signer"]
+            elif value[0] == "xref":
+                entry["value"] = _field_value(*_resolve_value(doc, value[1]))
+        for widget in widgets:
+            page_num = widget_pages.get(widget)
+            if page_num is not None and page_num not in entry["pages"]:
+                entry["pages"].append(page_num)
+
+    for root in roots:
+        walk(root, "", (None, ("null", "null"), 0), 0)
+    return list(fields.values())
+
+def signatures(fields: List[FormField]) -> List[Dict[str, object]]:
+    """The signatures of the signed signature fields in a field table, with their field names."""
+    return [{"field": field["name"], **field["signature"]} for field in fields if field.get("signature")]
+
+def scan_pages(ctx) -> List[FormField]:
+    """Fields of a flattened form, found by scanning every page of a DocumentContext."""
+    fields: Dict[str, FormField] = {}
+
+    def add(name: str, value, page_num: int, field_type: str = "text"):
+        name = name.strip()
+        if not name:
+            return
+        value = value.strip() if isinstance(value, str) else "" if value is None else str(value)
+        entry = fields.setdefault(name, {"name": name, "type": field_type, "value": value, "pages": []})
+        entry["value"] = value
+        if page_num not in entry["pages"]:
+            entry["pages"].append(page_num)
+
+    for page_num in range(ctx.page_count):
+        page = ctx.page(page_num)
+        # Widgets still on the page of a form whose field tree is gone
+        for widget in ctx.widgets(page_num):
+            add(widget.field_name or "", widget.field_value, page_num,
+                WIDGET_TYPES.get(widget.field_type_string, "unknown"))
+
+        # A text field flattened into the page content: "Label: value" text
+        if any(b"/Tx BMC" in (ctx.doc.xref_stream(xref) or b"") for xref in page.get_contents()):
+            text = ctx.page_text(page_num)
+            if ":" in text:
+                label, value = text.split(":", 1)
+                if value.strip():
+                    add(label, value, page_num)
+
+        # FreeText annotations typed over a form, labelled by the text just above them
+        for annot in ctx.annots(page_num):
+            if annot.type[0] == fitz.PDF_ANNOT_FREE_TEXT:
+                rect = annot.rect
+                label = page.get_text("text", clip=fitz.Rect(rect.x0, rect.y0 - 20, rect.x1, rect.y0)).strip()
+                value = annot.info.get("content", "").strip()
+                if label and value:
+                    add(label, value, page_num)
+    return list(fields.values())
@@ -0,0 +1,270 @@
+"""
+Job queues for the analysis service.
+
+A queue holds submitted PDFs and their analysis options until a worker
+claims them, then keeps each job's result (or error) for retrieval. Two
+backends share one interface: MemoryJobQueue for a single process, and
+SqliteJobQueue, which survives restarts and can be shared by several
+service processes on one machine. Other backends (Redis, a database)
+only need to implement JobQueue.
+
+A worker renews the lease on its running job with heartbeat(). A SQLite
+job whose lease lapses belongs to a worker that died and is handed out
+again; a job that is merely running long keeps its lease and runs once.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_JOB_QUEUE            "memory" (default) or the path of a SQLite queue file
+    HOSPITAL_PDF_JOB_RETENTION_HOURS  how long finished jobs are kept for retrieval (default 24)
+    HOSPITAL_PDF_JOB_LEASE_SECONDS    how long a running job without a heartbeat stays claimed (default 300)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+STATUSES = (QUEUED, RUNNING, DONE, FAILED)
+
+DEFAULT_RETENTION_HOURS = 24
+# A running SQLite job whose last heartbeat is older than this belongs to a worker that died
+DEFAULT_JOB_LEASE_SECONDS = 300
+# Heartbeats per lease, so a few missed ones (a busy host) do not lose the lease
+HEARTBEATS_PER_LEASE = 5
+# How often SQLite queues look for jobs submitted by other processes
+SQLITE_POLL_SECONDS = 0.5
+
+def _new_job(options: Dict[str, Any], webhook: Optional[str]) -> Dict[str, Any]:
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "options": options,
+        "webhook": webhook,
+        "webhook_status": None,
+        "result": None,
+        "error": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+    }
+
+def lease_seconds() -> float:
+    return float(os.environ.get("HOSPITAL_PDF_JOB_LEASE_SECONDS", DEFAULT_JOB_LEASE_SECONDS))
+
+def heartbeat_seconds() -> float:
+    """How often a worker should call heartbeat() for its running job."""
+    return lease_seconds() / HEARTBEATS_PER_LEASE
+
+class JobQueue(ABC):
+    """Interface of the queue backends. Jobs are dicts as built by _new_job."""
+
+    @abstractmethod
+    def submit(self, pdf: bytes, options: Dict[str, Any], webhook: Optional[str] = None) -> str:
+        """Queue a PDF with its analysis options and return the new job's ID."""
+
+    @abstractmethod
+    def claim(self, timeout: float) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """Mark the oldest queued job running and return it with its PDF, or None after timeout seconds."""
+
+    @abstractmethod
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Store a job's result; a job with an error is marked failed. Its PDF is dropped."""
+
+    @abstractmethod
+    def set_webhook_status(self, job_id: str, status: str):
+        """Record the outcome of the job's webhook delivery."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job with its result, or None if it is unknown or purged."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each status."""
+
+    @abstractmethod
+    def purge(self, older_than: float):
+        """Forget finished jobs that finished before the given timestamp."""
+
+    def heartbeat(self, job_id: str):
+        """Renew the lease of a running job so it is not handed out again; a no-op where jobs never are."""
+
+    def close(self):
+        pass
+
+class MemoryJobQueue(JobQueue):
+    """In-process queue; jobs are lost when the process exits."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._pdfs: Dict[str, bytes] = {}
+        self._pending: Deque[str] = deque()
+        self._ready = threading.Condition()
+
+    def submit(self, pdf: bytes, options: Dict[str, Any], webhook: Optional[str] = None) -> str:
+        job = _new_job(options, webhook)
+        with self._ready:
+            self._jobs[job["id"]] = job
+            self._pdfs[job["id"]] = pdf
+            self._pending.append(job["id"])
+            self._ready.notify()
+        return job["id"]
+
+    def claim(self, timeout: float) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        with self._ready:
+            if not self._ready.wait_for(lambda: self._pending, timeout):
+                return None
+            job = self._jobs[self._pending.popleft()]
+            job.update(status=RUNNING, started=time.time())
+            return dict(job), self._pdfs.pop(job["id"])
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._ready:
+            self._jobs[job_id].update(status=FAILED if error else DONE, result=result, error=error,
+                                      finished=time.time())
+
+    def set_webhook_status(self, job_id: str, status: str):
+        with self._ready:
+            self._jobs[job_id]["webhook_status"] = status
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._ready:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        with self._ready:
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        return counts
+
+    def purge(self, older_than: float):
+        with self._ready:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job["finished"] is not None and job["finished"] < older_than]:
+                del self._jobs[job_id]
+
+class SqliteJobQueue(JobQueue):
+    """Queue in a SQLite file, shared by every process that opens the same path."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Wakes local workers immediately; jobs from other processes are found by polling
+        self._submitted = threading.Event()
+        # Autocommit mode, so claim() can take the write lock with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, options TEXT NOT NULL, pdf BLOB, webhook TEXT, "
+            "webhook_status TEXT, result TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL, "
+            "heartbeat REAL)"
+        )
+        # Queue files created before leases
+        if "heartbeat" not in {column[1] for column in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+
+    def submit(self, pdf: bytes, options: Dict[str, Any], webhook: Optional[str] = None) -> str:
+        job = _new_job(options, webhook)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, options, pdf, webhook, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job["id"], QUEUED, json.dumps(options), pdf, webhook, job["created"]),
+            )
+        self._submitted.set()
+        return job["id"]
+
+    def _claim_once(self) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, pdf FROM jobs WHERE status = ? OR (status = ? AND COALESCE(heartbeat, started) < ?) "
+                    "ORDER BY created LIMIT 1",
+                    (QUEUED, RUNNING, now - lease_seconds()),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?",
+                                       (RUNNING, now, now, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self.get(row[0]), bytes(row[1])
+
+    def claim(self, timeout: float) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            self._submitted.clear()
+            claimed = self._claim_once()
+            remaining = deadline - time.monotonic()
+            if claimed is not None or remaining <= 0:
+                return claimed
+            self._submitted.wait(min(remaining, SQLITE_POLL_SECONDS))
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, pdf = NULL WHERE id = ?",
+                (FAILED if error else DONE, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+
+    def heartbeat(self, job_id: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+
+    def set_webhook_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET webhook_status = ? WHERE id = ?", (status, job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, options, webhook, webhook_status, result, error, created, started, finished "
+                "FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "status", "options", "webhook", "webhook_status", "result", "error",
+                        "created", "started", "finished"), row))
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        with self._lock:
+            for status, count in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+                counts[status] = count
+        return counts
+
+    def purge(self, older_than: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (older_than,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def retention_seconds() -> float:
+    return float(os.environ.get("HOSPITAL_PDF_JOB_RETENTION_HOURS", DEFAULT_RETENTION_HOURS)) * 3600
+
+def open_job_queue(setting: Optional[str] = None) -> JobQueue:
+    """Queue backend named by setting, defaulting to HOSPITAL_PDF_JOB_QUEUE."""
+    if setting is None:
+        setting = os.environ.get("HOSPITAL_PDF_JOB_QUEUE", "memory")
+    if setting.strip().lower() in ("", "memory"):
+        return MemoryJobQueue()
+    return SqliteJobQueue(setting)
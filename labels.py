@@ -0,0 +1,138 @@
+"""
+Label vocabulary matching for form text.
+
+A LabelMatcher compiles the label variants of a set of fields once. The
+exact labels become a single regular expression shaped like a trie of the
+labels: shared prefixes are matched once and longer labels are tried before
+their prefixes, so one left-to-right scan of a line finds every label
+occurrence (leftmost, longest, whole words). Labels damaged by OCR are
+found by a bounded edit-distance fallback: the word n-grams of the line are
+looked up in a symmetric-delete index of the longer labels and accepted
+within one edit (a dropped, added, misread or swapped character). Both
+steps cost time proportional to the line, not to the size of the
+vocabulary.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+# (start, end, field, label) of a label occurrence in a line
+LabelHit = Tuple[int, int, str, str]
+
+# Labels shorter than this are only matched exactly; one edit away from a
+# short label ("age", "tel", "date") is too often an ordinary word. At this
+# length one edit cannot touch both the first and the last two characters.
+FUZZY_MIN_LABEL_CHARS = 6
+
+_WORD = re.compile(r"[^\s:]+")
+
+def _trie_pattern(node: Dict[str, dict], previous: str) -> str:
+    """Regex alternation for a trie node; "" marks the end of a label."""
+    branches = []
+    for char in sorted(key for key in node if key):
+        # OCR text separates the words of a label by any run of whitespace
+        step = r"\s+" if char == " " else re.escape(char)
+        branches.append(step + _trie_pattern(node[char], char))
+    if "" in node:
+        # A label ends here unless it stops in the middle of a word; tried after the longer labels
+        branches.append(r"(?!\w)" if previous.isalnum() else "")
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+def _deletions(text: str) -> Set[str]:
+    return {text[:i] + text[i + 1:] for i in range(len(text))}
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Whether a and b differ by at most one insertion, deletion, substitution or adjacent swap."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    if len(a) == len(b):
+        return (a[prefix + 1:] == b[prefix + 1:]
+                or (a[prefix:prefix + 2] == b[prefix:prefix + 2][::-1] and a[prefix + 2:] == b[prefix + 2:]))
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return shorter[prefix:] == longer[prefix + 1:]
+
+class LabelMatcher:
+    """Finds the labels of a field vocabulary in lowercase lines of text."""
+
+    def __init__(self, labels: Dict[str, Sequence[str]], fuzzy_min_chars: int = FUZZY_MIN_LABEL_CHARS):
+        # A label listed under several fields belongs to the first
+        self.fields: Dict[str, str] = {}
+        for field, variants in labels.items():
+            for label in variants:
+                self.fields.setdefault(" ".join(label.lower().split()), field)
+        trie: Dict[str, dict] = {}
+        for label in self.fields:
+            node = trie
+            for char in label:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self._pattern = re.compile(r"(?<!\w)" + _trie_pattern(trie, "")) if trie else None
+
+        self._index: Dict[str, List[str]] = {}
+        self._fuzzy_lengths: Set[int] = set()
+        # One edit leaves either the first or the last two characters of a label intact
+        self._heads: Set[str] = set()
+        self._tails: Set[str] = set()
+        self._max_words = 0
+        for label in self.fields:
+            if len(label) < fuzzy_min_chars:
+                continue
+            for key in _deletions(label) | {label}:
+                self._index.setdefault(key, []).append(label)
+            self._fuzzy_lengths.update((len(label) - 1, len(label), len(label) + 1))
+            self._heads.add(label[:2])
+            self._tails.add(label[-2:])
+            self._max_words = max(self._max_words, len(label.split()))
+
+    def exact(self, line: str) -> List[LabelHit]:
+        if self._pattern is None:
+            return []
+        hits = []
+        for match in self._pattern.finditer(line):
+            label = " ".join(match.group().split())
+            hits.append((match.start(), match.end(), self.fields[label], label))
+        return hits
+
+    def _closest(self, candidate: str) -> Optional[str]:
+        if candidate[:2] not in self._heads and candidate[-2:] not in self._tails:
+            return None
+        for key in (candidate, *_deletions(candidate)):
+            for label in self._index.get(key, ()):
+                if _within_one_edit(candidate, label):
+                    return label
+        return None
+
+    def fuzzy(self, line: str) -> List[LabelHit]:
+        """Labels within one edit of a run of whole words, longest runs first, without overlaps."""
+        words = [(match.start(), match.end()) for match in _WORD.finditer(line)]
+        hits = []
+        i = 0
+        while i < len(words):
+            for count in range(min(self._max_words, len(words) - i), 0, -1):
+                start, end = words[i][0], words[i + count - 1][1]
+                candidate = " ".join(line[s:e] for s, e in words[i:i + count])
+                if len(candidate) not in self._fuzzy_lengths:
+                    continue
+                label = self._closest(candidate)
+                if label is not None:
+                    hits.append((start, end, self.fields[label], label))
+                    i += count
+                    break
+            else:
+                i += 1
+        return hits
+
+    def find(self, line: str, fuzzy: bool = True) -> List[LabelHit]:
+        """Every label in a lowercase line, in order: exact matches plus fuzzy ones that do not overlap them."""
+        hits = self.exact(line)
+        if fuzzy and self._index:
+            hits.extend(hit for hit in self.fuzzy(line)
+                        if not any(hit[0] < end and start < hit[1] for start, end, _, _ in hits))
+            hits.sort()
+        return hits
@@ -0,0 +1,140 @@
+"""
+Word-level page layout shared by section matching and field extraction.
+
+A PageLayout is a compact word table - text, box, confidence and line
+number per word - built once per page, from the native text layer
+(`page.get_text("words")`) or from Tesseract's word-level output. Page text
+for section matching is derived from it, and label/value pairing and
+signature detection look up neighbouring lines by position instead of
+rescanning the text for "the next line".
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# (text, x0, y0, x1, y1, confidence 0-100, line number)
+Word = Tuple[str, float, float, float, float, float, int]
+
+# Confidence given to words read from the text layer
+TEXT_LAYER_CONFIDENCE = 100.0
+# A value line below a label must start within this many label heights of it
+MAX_VALUE_GAP_LINES = 2.5
+
+def _line_numbers(keys: Iterable[Tuple]) -> List[int]:
+    """Number line keys consecutively in first-seen order."""
+    numbers: Dict[Tuple, int] = {}
+    return [numbers.setdefault(key, len(numbers)) for key in keys]
+
+def words_from_text_layer(raw_words: Sequence[Tuple]) -> List[Word]:
+    """Word table from PyMuPDF's get_text("words") tuples (x0, y0, x1, y1, text, block, line, word)."""
+    line_numbers = _line_numbers((w[5], w[6]) for w in raw_words)
+    return [(w[4], round(w[0], 1), round(w[1], 1), round(w[2], 1), round(w[3], 1), TEXT_LAYER_CONFIDENCE, line)
+            for w, line in zip(raw_words, line_numbers)]
+
+def words_from_tesseract_data(data: Dict[str, list]) -> List[Word]:
+    """Word table from pytesseract.image_to_data(..., output_type=Output.DICT), skipping empty boxes."""
+    rows = [i for i, text in enumerate(data["text"]) if str(text).strip()]
+    line_numbers = _line_numbers((data["block_num"][i], data["par_num"][i], data["line_num"][i]) for i in rows)
+    words = []
+    for i, line in zip(rows, line_numbers):
+        left, top = int(data["left"][i]), int(data["top"][i])
+        words.append((str(data["text"][i]).strip(), left, top, left + int(data["width"][i]),
+                      top + int(data["height"][i]), float(data["conf"][i]), line))
+    return words
+
+def place_words(words: List[Word], region: Tuple[float, float, float, float], image_size: Tuple[int, int],
+                first_line: int = 0) -> List[Word]:
+    """Map words OCR'd from a render of `region` back to page coordinates, numbering lines from first_line."""
+    x0, y0, x1, y1 = region
+    sx, sy = (x1 - x0) / image_size[0], (y1 - y0) / image_size[1]
+    return [(w[0], round(x0 + w[1] * sx, 1), round(y0 + w[2] * sy, 1), round(x0 + w[3] * sx, 1),
+             round(y0 + w[4] * sy, 1), w[5], first_line + w[6]) for w in words]
+
+class PageLayout:
+    """Words of one page grouped into lines in reading order."""
+
+    def __init__(self, words: List[Word]):
+        self.words = [tuple(word) for word in words]
+        self.lines: List[List[int]] = []
+        for index, word in enumerate(self.words):
+            while word[6] >= len(self.lines):
+                self.lines.append([])
+            self.lines[word[6]].append(index)
+        self.lines = [line for line in self.lines if line]
+        self._boxes = [self._line_box(line) for line in self.lines]
+
+    def _line_box(self, line: List[int]) -> Tuple[float, float, float, float]:
+        words = [self.words[i] for i in line]
+        return (min(w[1] for w in words), min(w[2] for w in words),
+                max(w[3] for w in words), max(w[4] for w in words))
+
+    @property
+    def text(self) -> str:
+        return '\n'.join(self.line_text(i) for i in range(len(self.lines)))
+
+    def line_text(self, line: int) -> str:
+        return ' '.join(self.words[i][0] for i in self.lines[line])
+
+    def line_box(self, line: int) -> Tuple[float, float, float, float]:
+        return self._boxes[line]
+
+    def mean_confidence(self) -> Optional[float]:
+        confidences = [w[5] for w in self.words if w[5] >= 0]
+        return sum(confidences) / len(confidences) if confidences else None
+
+    def line_right_of(self, line: int) -> Optional[int]:
+        """Nearest line on the same row that starts right of this one (a value in the next column)."""
+        x0, y0, x1, y1 = self._boxes[line]
+        best = None
+        for other, (ox0, oy0, ox1, oy1) in enumerate(self._boxes):
+            overlap = min(y1, oy1) - max(y0, oy0)
+            if other == line or ox0 < x1 or overlap < 0.5 * min(y1 - y0, oy1 - oy0):
+                continue
+            if best is None or ox0 < self._boxes[best][0]:
+                best = other
+        return best
+
+    def line_below(self, line: int) -> Optional[int]:
+        """Nearest line below this one that overlaps it horizontally (a value under its label)."""
+        x0, y0, x1, y1 = self._boxes[line]
+        height = max(y1 - y0, 1)
+        best = None
+        for other, (ox0, oy0, ox1, oy1) in enumerate(self._boxes):
+            if other == line or oy0 < y1 - 0.25 * height or ox0 >= x1 or ox1 <= x0:
+                continue
+            if oy0 - y1 > MAX_VALUE_GAP_LINES * height:
+                continue
+            if best is None or oy0 < self._boxes[best][1]:
+                best = other
+        return best
+
+    def value_line(self, line: int) -> Optional[int]:
+        """Line holding the value for a label on `line`: beside it if there is one, else beneath it."""
+        right = self.line_right_of(line)
+        return right if right is not None else self.line_below(line)
+
+    def with_regions(self, regions: "PageLayout") -> "PageLayout":
+        """
+        This layout with the lines of `regions` (OCR of images on the same page, in the
+        same coordinates) inserted where they sit vertically, keeping both reading orders.
+        """
+        # Each region line goes before the first line of this layout that starts below it
+        inserts: Dict[int, List[int]] = {}
+        for line in range(len(regions.lines)):
+            top = regions.line_box(line)[1]
+            position = next((i for i in range(len(self.lines)) if self._boxes[i][1] >= top), len(self.lines))
+            inserts.setdefault(position, []).append(line)
+        merged = []
+        for position in range(len(self.lines) + 1):
+            for line in inserts.get(position, []):
+                merged.append([regions.words[i] for i in regions.lines[line]])
+            if position < len(self.lines):
+                merged.append([self.words[i] for i in self.lines[position]])
+        return PageLayout([word[:6] + (line,) for line, words in enumerate(merged) for word in words])
+
+    def to_json(self) -> List[list]:
+        return [list(word) for word in self.words]
+
+    @classmethod
+    def from_json(cls, words: List[list]) -> "PageLayout":
+        return cls([tuple(word) for word in words])
@@ -0,0 +1,322 @@
+"""
+Section heading matching.
+
+Scores every line of a document against every section header once and
+keeps the full score matrix, so the Present/Missing summary can be derived
+at any fuzzy threshold without recomputing a single fuzzy ratio.
+
+Before any fuzzy scoring, a cheap prefilter discards line/section pairs
+that provably cannot reach the lowest threshold of interest. It bounds
+partial_ratio from above by the best character-histogram overlap between
+the shorter string and any equally long window of the longer one: a fuzzy
+alignment can never match more characters than the window has in common
+with the header. Pruned pairs are therefore exactly the pairs the
+unfiltered path would reject, and the filtered results are identical
+(recall 1.0). An optional, lossy "heading shape" filter on top of that
+(length, trailing colon, capitalization, trigram overlap) trades recall
+for further savings; measure_prefilter_recall reports what it costs.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from deps import lazy_import
+
+np = lazy_import("numpy")
+fuzz = lazy_import("fuzzywuzzy.fuzz")
+
+# Score stored for pairs the prefilter pruned; below any usable threshold
+PRUNED_SCORE = -1
+
+# Heading shape limits for the optional lossy filter
+HEADING_MAX_LENGTH_RATIO = 1.5
+HEADING_MAX_WORDS = 8
+
+# Characters per chunk when computing prefilter bounds; keeps running counts within int16
+_BOUND_CHUNK_CHARS = 30_000
+
+def _char_codes(strings: Sequence[str], vocab: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Map the characters of all strings to bins of vocab (sorted code points), with
+    len(vocab) as the bin for characters that occur in no header.
+    Returns the bin of every character plus each string's start offset and length.
+    """
+    lengths = np.array([len(s) for s in strings], dtype=np.intp)
+    starts = np.zeros(len(strings), dtype=np.intp)
+    if len(strings):
+        starts[1:] = np.cumsum(lengths)[:-1]
+    codes = np.frombuffer("".join(strings).encode("utf-32-le"), dtype=np.uint32)
+    bins = np.searchsorted(vocab, codes)
+    known = (bins < len(vocab)) & (vocab[np.minimum(bins, len(vocab) - 1)] == codes)
+    return np.where(known, bins, len(vocab)), starts, lengths
+
+def partial_ratio_upper_bound(clean_lines: Sequence[str], sections_lower: Sequence[str]) -> np.ndarray:
+    """
+    Upper bound on fuzz.partial_ratio(line, section) / 100 for every pair, as a
+    (len(clean_lines), len(sections_lower)) float matrix.
+
+    partial_ratio compares the shorter string (length m) with windows of the longer
+    one that are at most m long, and each comparison scores 2*M/(m + w) where M is
+    the number of aligned characters. M never exceeds the histogram intersection I
+    of the shorter string and the best full-length window, so 2*I/(m + I) bounds it.
+    """
+    n, n_sections = len(clean_lines), len(sections_lower)
+    bound = np.zeros((n, n_sections))
+    if not n or not n_sections:
+        return bound
+    vocab = np.array(sorted({ord(c) for s in sections_lower for c in s}), dtype=np.uint32)
+    # Work in chunks so the running-count matrix stays small on very long documents
+    chunk_start, chunk_chars = 0, 0
+    for i, line in enumerate(clean_lines):
+        chunk_chars += len(line)
+        if chunk_chars >= _BOUND_CHUNK_CHARS or i == n - 1:
+            bound[chunk_start:i + 1] = _partial_ratio_bound_chunk(clean_lines[chunk_start:i + 1], sections_lower, vocab)
+            chunk_start, chunk_chars = i + 1, 0
+    return bound
+
+def _partial_ratio_bound_chunk(clean_lines: Sequence[str], sections_lower: Sequence[str], vocab: np.ndarray) -> np.ndarray:
+    n = len(clean_lines)
+    bound = np.zeros((n, len(sections_lower)))
+    bins, starts, lengths = _char_codes(clean_lines, vocab)
+
+    # Running per-bin character counts; counts[k] covers the first k characters.
+    # Chunks are normally small enough for int16, which halves the memory traffic below.
+    dtype = np.int16 if len(bins) < np.iinfo(np.int16).max else np.int32
+    onehot = np.zeros((len(bins) + 1, len(vocab) + 1), dtype=dtype)
+    onehot[np.arange(1, len(bins) + 1), bins] = 1
+    counts = np.cumsum(onehot, axis=0, dtype=dtype)
+
+    for j, section in enumerate(sections_lower):
+        m = len(section)
+        # Only the header's own characters can contribute to the overlap
+        section_bins, section_counts = np.unique(_char_codes([section], vocab)[0], return_counts=True)
+        section_counts = section_counts.astype(dtype)
+        section_cum = counts[:, section_bins]
+
+        # Line no longer than the header: the line is the shorter string
+        line_hist = section_cum[starts + lengths] - section_cum[starts]
+        overlap = np.minimum(line_hist, section_counts).sum(axis=1)
+        shorter_len = np.minimum(lengths, m)
+
+        # Line longer than the header: best overlap over all header-length windows of the line
+        long_lines = np.flatnonzero(lengths > m)
+        if len(long_lines) and m:
+            windows = section_cum[m:] - section_cum[:-m]
+            np.minimum(windows, section_counts, out=windows)
+            window_overlap = np.append(windows.sum(axis=1), 0)
+            edges = np.empty(2 * len(long_lines), dtype=np.intp)
+            edges[0::2] = starts[long_lines]
+            edges[1::2] = starts[long_lines] + lengths[long_lines] - m + 1
+            overlap[long_lines] = np.maximum.reduceat(window_overlap, edges)[0::2]
+
+        denominator = shorter_len + overlap
+        bound[:, j] = np.divide(2 * overlap, denominator, out=np.zeros(n), where=denominator > 0)
+    return bound
+
+def ratio_upper_bound(lines_lower: Sequence[str], sections_lower: Sequence[str]) -> np.ndarray:
+    """Upper bound on fuzz.ratio(line, section) / 100: 2*I / (len(line) + len(section))."""
+    n, n_sections = len(lines_lower), len(sections_lower)
+    bound = np.zeros((n, n_sections))
+    if not n or not n_sections:
+        return bound
+    vocab = np.array(sorted({ord(c) for s in sections_lower for c in s}), dtype=np.uint32)
+    bins, starts, lengths = _char_codes(lines_lower, vocab)
+    line_of_char = np.repeat(np.arange(n), lengths)
+    line_hist = np.zeros((n, len(vocab) + 1), dtype=np.int32)
+    np.add.at(line_hist, (line_of_char, bins), 1)
+    for j, section in enumerate(sections_lower):
+        section_hist = np.bincount(_char_codes([section], vocab)[0], minlength=len(vocab) + 1)
+        overlap = np.minimum(line_hist[:, :len(vocab)], section_hist[:len(vocab)]).sum(axis=1)
+        denominator = lengths + len(section)
+        bound[:, j] = np.divide(2 * overlap, denominator, out=np.zeros(n), where=denominator > 0)
+    return bound
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def heading_shape_mask(lines: Sequence[str], sections: Sequence[str]) -> np.ndarray:
+    """
+    Lossy heading candidate test for stripped lines: short relative to the longest header,
+    or ending in a colon, or in title/upper case with few words - and sharing at least one
+    character trigram with the header vocabulary.
+    """
+    max_len = max((len(s) for s in sections), default=0)
+    vocabulary = set().union(*(_trigrams(s.lower()) for s in sections)) if sections else set()
+    mask = np.zeros(len(lines), dtype=bool)
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+        shaped = (
+            len(line) <= max_len * HEADING_MAX_LENGTH_RATIO
+            or line.endswith(":")
+            or ((line.isupper() or line.istitle()) and len(line.split()) <= HEADING_MAX_WORDS)
+        )
+        lower = line.lower()
+        mask[i] = shaped and (len(lower) < 3 or not _trigrams(lower).isdisjoint(vocabulary))
+    return mask
+
+def longer_section_mask(sections: Sequence[str]) -> np.ndarray:
+    """mask[i, j] is True when section j is longer than section i."""
+    lengths = np.array([len(s) for s in sections])
+    return lengths[None, :] > lengths[:, None]
+
+def score_lines(lines: Sequence[str], sections: Sequence[str], min_score: int = 0,
+                heading_shape: bool = False, stats: Optional[Dict[str, int]] = None) -> np.ndarray:
+    """
+    Score lines against sections in one batch and return an int16 matrix of
+    shape (len(lines), len(sections)). Lines are compared lowercased and stripped,
+    and each distinct line is only scored once.
+
+    With min_score > 0, pairs that provably score below min_score are not scored
+    and hold PRUNED_SCORE instead; every score >= min_score is still exact.
+    heading_shape additionally prunes lines that do not look like headings (lossy).
+    stats, when given, accumulates the number of "pairs" and fuzzy comparisons "scored".
+    """
+    sections_lower = [s.lower() for s in sections]
+    index: Dict[str, int] = {}
+    inverse = np.empty(len(lines), dtype=np.intp)
+    for i, line in enumerate(lines):
+        inverse[i] = index.setdefault(line.strip().lower(), len(index))
+    unique_lines = list(index)
+
+    candidates = np.ones((len(unique_lines), len(sections)), dtype=bool)
+    if min_score > 0:
+        # One point of slack absorbs the rounding partial_ratio applies to its result
+        candidates &= 100 * partial_ratio_upper_bound(unique_lines, sections_lower) >= min_score - 1
+    if heading_shape:
+        originals = [""] * len(unique_lines)
+        for i, line in enumerate(lines):
+            originals[inverse[i]] = originals[inverse[i]] or line.strip()
+        candidates &= heading_shape_mask(originals, sections)[:, None]
+
+    unique_scores = np.array([
+        [fuzz.partial_ratio(line, section) if keep else PRUNED_SCORE for section, keep in zip(sections_lower, row)]
+        for line, row in zip(unique_lines, candidates.tolist())
+    ], dtype=np.int16).reshape(len(unique_lines), len(sections))
+    if stats is not None:
+        stats["pairs"] = stats.get("pairs", 0) + len(lines) * len(sections)
+        stats["scored"] = stats.get("scored", 0) + int(candidates.sum())
+    return unique_scores[inverse]
+
+def longer_max_scores(scores: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """For each line and section, the best score among the longer sections (-1 if there are none)."""
+    masked = np.where(mask[None, :, :], scores[:, None, :], -1)
+    return masked.max(axis=2, initial=-1)
+
+class SectionScores:
+    """
+    Line x section fuzzy scores for one document.
+
+    A line counts as a heading for a section at threshold t when
+    scores[s] >= t and no longer section also scores >= t (the "prefer the
+    longer section" rule). longer_max[s] holds the best score among the
+    longer sections, so a line matches exactly when longer_max[s] < t <= scores[s].
+    """
+
+    def __init__(self, sections: Sequence[str], lines: List[str], line_pages: np.ndarray, n_pages: int,
+                 scores: np.ndarray, longer_max: np.ndarray, min_score: int = 0,
+                 comparisons: Optional[Dict[str, int]] = None):
+        self.sections = list(sections)
+        self.lines = lines  # stripped lines of the whole document
+        self.line_pages = line_pages  # 0-based page index of each line
+        self.n_pages = n_pages
+        self.scores = scores  # (lines, sections)
+        self.longer_max = longer_max  # (lines, sections)
+        self.min_score = min_score  # summaries are exact for thresholds >= min_score
+        self.comparisons = comparisons or {}  # "pairs" and fuzzy comparisons actually "scored"
+
+    def match_mask(self, threshold: int) -> np.ndarray:
+        """Boolean (lines, sections) matrix of heading matches at the given threshold."""
+        return (self.scores >= threshold) & (self.longer_max < threshold)
+
+    def headings(self, section_idx: int, threshold: int) -> List[List[str]]:
+        """Matching heading lines for one section, per page, at the given threshold."""
+        matches = [[] for _ in range(self.n_pages)]
+        for i in np.flatnonzero(self.match_mask(threshold)[:, section_idx]):
+            matches[self.line_pages[i]].append(self.lines[i])
+        return matches
+
+    def near_miss(self, section_idx: int) -> Optional[Dict]:
+        """The best scoring line for a section regardless of threshold, or None if no line was scored."""
+        column = np.where([bool(line) for line in self.lines], self.scores[:, section_idx], PRUNED_SCORE)
+        if not len(column) or column.max() <= PRUNED_SCORE:
+            return None
+        i = int(column.argmax())
+        return {"heading": self.lines[i], "page": int(self.line_pages[i]) + 1, "score": int(column[i])}
+
+    def summary(self, threshold: int, near_misses: bool = False) -> List[Dict[str, str]]:
+        """
+        The Present/Missing table at the given threshold.
+        With near_misses=True a "Closest Match" column names the best candidate for missing sections.
+        """
+        mask = self.match_mask(threshold)
+        summary = []
+        for section_idx, section in enumerate(self.sections):
+            hits = np.flatnonzero(mask[:, section_idx])
+            page_found = [str(p + 1) for p in dict.fromkeys(self.line_pages[hits].tolist())]
+            found = bool(page_found)
+            # Remove duplicate headings
+            unique_headings = list(dict.fromkeys(self.lines[i] for i in hits))
+            row = {
+                "Section": section,
+                "Status": "Present" if found else "Missing",
+                "Pages": ', '.join(page_found) if found else "-",
+                "Headings Used": '; '.join(unique_headings) if unique_headings else "-"
+            }
+            if near_misses:
+                best = None if found else self.near_miss(section_idx)
+                row["Closest Match"] = f"{best['heading']} (page {best['page']}, {best['score']}%)" if best else "-"
+            summary.append(row)
+        return summary
+
+def score_sections(text_per_page: Sequence[str], sections: Sequence[str], min_score: int = 0,
+                   heading_shape: bool = False) -> SectionScores:
+    """
+    Compute the line x section score matrix for a document.
+    min_score is the lowest threshold the result will be summarized at; pairs
+    that cannot reach it are pruned before fuzzy scoring.
+    """
+    lines, line_pages = [], []
+    for page_idx, text in enumerate(text_per_page):
+        page_lines = text.split('\n')
+        lines.extend(page_lines)
+        line_pages.extend([page_idx] * len(page_lines))
+
+    comparisons: Dict[str, int] = {}
+    scores = score_lines(lines, sections, min_score, heading_shape, comparisons)
+    longer_max = longer_max_scores(scores, longer_section_mask(sections))
+    return SectionScores(sections, [line.strip() for line in lines], np.array(line_pages, dtype=np.intp),
+                         len(text_per_page), scores, longer_max, min_score, comparisons)
+
+def concat_scores(pages: Sequence[SectionScores]) -> SectionScores:
+    """The matrix of a document from the one-page matrices of its pages, in page order, without rescoring."""
+    first = pages[0]
+    line_pages = [np.full(len(page.lines), page_idx, dtype=np.intp) for page_idx, page in enumerate(pages)]
+    comparisons: Dict[str, int] = {}
+    for page in pages:
+        for key, count in page.comparisons.items():
+            comparisons[key] = comparisons.get(key, 0) + count
+    return SectionScores(first.sections, [line for page in pages for line in page.lines], np.concatenate(line_pages),
+                         len(pages), np.concatenate([page.scores for page in pages]),
+                         np.concatenate([page.longer_max for page in pages]),
+                         max(page.min_score for page in pages), comparisons)
+
+def measure_prefilter_recall(text_per_page: Sequence[str], sections: Sequence[str], threshold: int,
+                             heading_shape: bool = False) -> Dict[str, float]:
+    """
+    Compare the prefiltered path with the unfiltered one at threshold.
+    recall is the fraction of (line, section) heading matches the prefilter keeps;
+    it is 1.0 by construction unless the lossy heading_shape filter is enabled.
+    """
+    full = score_sections(text_per_page, sections)
+    filtered = score_sections(text_per_page, sections, threshold, heading_shape)
+    expected = full.match_mask(threshold)
+    kept = filtered.match_mask(threshold) & expected
+    n_expected = int(expected.sum())
+    return {
+        "recall": kept.sum() / n_expected if n_expected else 1.0,
+        "matches": n_expected,
+        "pairs": full.comparisons["pairs"],
+        "scored_unfiltered": full.comparisons["scored"],
+        "scored_filtered": filtered.comparisons["scored"],
+    }
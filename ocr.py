@@ -1,114 +1,31 @@
 import streamlit as st
 st.set_page_config(page_title="Hospital PDF Section Checker", page_icon="📄", layout="centered")
-import sys
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
-import pdf2image.exceptions
-from fuzzywuzzy import fuzz
-import tempfile
-import os
-import re
-import platform
-from typing import Optional, Dict, List
-
-SECTION_HEADERS = [
-    "Discharge Summary",
-    "Diagnosis",
-    "Investigation",
-    "Culture Report",
-    "Final Diagnosis",
-    "History of Present Illness",
-    "HOPI"  # Alternative for History of Present Illness
-]
-
-REFERRAL_KEYWORDS = [
-    "referral form", "referral", "referred by", "referring doctor", "referring hospital", "referral reason"
-]
+from contextlib import closing
+from cache import get_cache
+from deps import refresh_dependency_checks
+from document import DocumentContext, open_upload
+from engine import (
+    DEFAULT_FUZZY_THRESHOLD,
+    DOCUMENT_TYPES,
+    MIN_FUZZY_THRESHOLD,
+    check_pdf2image_dependencies,
+    check_tesseract,
+    document_signatures,
+    ocr_referral_form,
+)
+from pipeline import iter_scan_events
+from tracing import trace
 
 # Add a slider to control the fuzzy threshold
 st.sidebar.header("Settings")
-FUZZY_THRESHOLD = st.sidebar.slider("Fuzzy Match Threshold", min_value=60, max_value=100, value=75, step=1, help="Lower values allow more typos, higher values require closer matches.")
+FUZZY_THRESHOLD = st.sidebar.slider("Fuzzy Match Threshold", min_value=MIN_FUZZY_THRESHOLD, max_value=100, value=DEFAULT_FUZZY_THRESHOLD, step=1, help="Lower values allow more typos, higher values require closer matches.")
+ADAPTIVE_DPI = st.sidebar.checkbox("Adaptive OCR resolution", value=False, help="OCR scans at low resolution first and re-read only unclear pages at full resolution.")
+FULL_SCAN = st.sidebar.checkbox("Full scan", value=False, help="Read every page for complete page lists instead of stopping once every section is found.")
+SHOW_TIMINGS = st.sidebar.checkbox("Show timing breakdown", value=False, help="Show how long each processing stage took for this document.")
 
 # UI: Select document type
 st.sidebar.header("Document Type")
-doc_type = st.sidebar.radio("Select the type of document to analyze:", ["Discharge Summary", "Referral Form"])
-
-def check_tesseract() -> Optional[str]:
-    """
-    Check if Tesseract is installed and provide installation instructions if not.
-    Returns None if Tesseract is installed, or installation instructions if not.
-    """
-    try:
-        pytesseract.get_tesseract_version()
-        return None
-    except pytesseract.TesseractNotFoundError:
-        system = platform.system().lower()
-        if system == "darwin":
-            return (
-                "Tesseract is not installed. To install on macOS:\n"
-                "1. Install Homebrew if not already installed:\n"
-                "   /bin/bash -c \"$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)\"\n"
-                "2. Install Tesseract:\n"
-                "   brew install tesseract"
-            )
-        elif system == "linux":
-            return (
-                "Tesseract is not installed. To install on Linux:\n"
-                "Ubuntu/Debian:\n"
-                "   sudo apt-get update && sudo apt-get install tesseract-ocr\n"
-                "Fedora:\n"
-                "   sudo dnf install tesseract"
-            )
-        elif system == "windows":
-            return (
-                "Tesseract is not installed. To install on Windows:\n"
-                "1. Download the installer from: https://github.com/UB-Mannheim/tesseract/wiki\n"
-                "2. Run the installer and note the installation directory\n"
-                "3. Add the Tesseract installation directory to your PATH environment variable\n"
-                "4. Restart your computer"
-            )
-        return "Tesseract OCR is not installed. Please install it for your operating system."
-
-def check_pdf2image_dependencies() -> Optional[str]:
-    """
-    Check if pdf2image dependencies (poppler) are installed.
-    Returns None if dependencies are installed, or installation instructions if not.
-    """
-    try:
-        # Try a simple conversion to check if poppler is installed
-        with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
-            convert_from_path(tmp.name)
-        return None
-    except Exception as e:
-        error_str = str(e).lower()
-        system = platform.system().lower()
-        
-        if system == "darwin":
-            return (
-                "Poppler is not installed. To install on macOS:\n"
-                "1. Install using Homebrew:\n"
-                "   brew install poppler\n"
-                "2. Restart your terminal"
-            )
-        elif system == "linux":
-            return (
-                "Poppler is not installed. To install on Linux:\n"
-                "Ubuntu/Debian:\n"
-                "   sudo apt-get update && sudo apt-get install poppler-utils\n"
-                "Fedora:\n"
-                "   sudo dnf install poppler-utils"
-            )
-        elif system == "windows":
-            return (
-                "Poppler is not installed. To install on Windows:\n"
-                "1. Download poppler for Windows from: http://blog.alivate.com.au/poppler-windows/\n"
-                "2. Extract to a directory (e.g., C:\\Program Files\\poppler)\n"
-                "3. Add the bin directory to your PATH environment variable\n"
-                "4. Restart your computer"
-            )
-        return f"PDF to image conversion failed. Please install poppler for your operating system. Error: {e}"
+doc_type = st.sidebar.radio("Select the type of document to analyze:", DOCUMENT_TYPES)
 
 # Check Tesseract installation on startup
 tesseract_error = check_tesseract()
@@ -122,295 +39,90 @@ if tesseract_error or pdf2image_error:
     if pdf2image_error:
         st.markdown("### PDF to Image Conversion Setup Required")
         st.markdown(pdf2image_error)
+    # The probes are cached for the process; look again once the tools are installed
+    st.button("Check again", on_click=refresh_dependency_checks)
     st.stop()
 
-def extract_pdf_form_fields(pdf_path):
-    """Extract form fields from a PDF using PyMuPDF."""
-    try:
-        doc = fitz.open(pdf_path)
-        fields = {}
-        
-        for page in doc:
-            # Convert generators to lists first
-            widgets = list(page.widgets())
-            annots = list(page.annots())
-            
-            # Debug print
-            print(f"Found {len(widgets)} widgets and {len(annots)} annotations")
-            
-            # Method 1: Get form fields through widgets
-            for field in widgets:
-                field_name = field.field_name or ""
-                field_value = field.field_value or ""
-                field_type = field.field_type
-                
-                # Debug print
-                print(f"Processing widget: name={field_name}, type={field_type}")
-                
-                # Clean up field names and values
-                field_name = field_name.strip()
-                if isinstance(field_value, str):
-                    field_value = field_value.strip()
-                elif field_value is None:
-                    field_value = ""
-                
-                if field_name:
-                    fields[field_name] = field_value
-            
-            # Method 2: Get form fields through annotations
-            for annot in annots:
-                try:
-                    # Check for PDF form field types
-                    if annot.type[0] in [3, 4, 12, 13, 17]:  # Form field annotation types
-                        field_name = annot.field_name or ""
-                        field_value = None
-                        
-                        # Try different ways to get field value
-                        if hasattr(annot, 'field_value'):
-                            field_value = annot.field_value
-                        elif hasattr(annot, 'info') and 'content' in annot.info:
-                            field_value = annot.info['content']
-                        elif hasattr(annot, 'get_textbox'):
-                            field_value = annot.get_textbox()
-                        
-                        # Debug print
-                        print(f"Annotation field: name={field_name}, value={field_value}, type={annot.type}")
-                        
-                        # Clean up
-                        field_name = field_name.strip()
-                        if isinstance(field_value, str):
-                            field_value = field_value.strip()
-                        elif field_value is None:
-                            field_value = ""
-                        
-                        if field_name:
-                            fields[field_name] = field_value
-                except Exception as e:
-                    print(f"Error processing annotation: {e}")
-            
-            # Method 3: Extract text from form XObjects
-            for xref in page.get_contents():
-                stream = doc.xref_stream(xref)
-                if stream and b"/Tx BMC" in stream:  # Text form field
-                    try:
-                        text = page.get_text("text", clip=page.rect)
-                        if ":" in text:
-                            parts = text.split(":", 1)
-                            field_name = parts[0].strip()
-                            field_value = parts[1].strip()
-                            if field_name and field_value:
-                                fields[field_name] = field_value
-                    except:
-                        continue
-
-            # Method 4: Extract text near form field boxes
-            for annot in page.annots():
-                if annot.type[0] == 3:  # FreeText annotation
-                    rect = annot.rect
-                    # Look for text slightly above the annotation
-                    label_rect = fitz.Rect(rect.x0, rect.y0 - 20, rect.x1, rect.y0)
-                    label = page.get_text("text", clip=label_rect).strip()
-                    value = annot.info.get("content", "").strip()
-                    
-                    if label and value:
-                        fields[label] = value
-                        
-        return fields
-    except Exception as e:
-        print(f"Error extracting form fields: {e}")  # Debug info
-        return {}
-    finally:
-        if 'doc' in locals():
-            doc.close()
-
-def convert_pdf_to_images(pdf_path: str, dpi: int = 300) -> list:
+def show_processing_error(e: Exception):
     """
-    Convert PDF pages to images with better error handling.
+    Report an engine failure in the UI with dependency hints where they apply.
     """
-    try:
-        return convert_from_path(pdf_path, dpi=dpi)
-    except Exception as e:
-        error_msg = str(e).lower()
-        if "not installed" in error_msg or "poppler" in error_msg:
-            st.error("PDF to image conversion failed: Poppler is not properly installed")
-            pdf2image_error = check_pdf2image_dependencies()
-            if pdf2image_error:
-                st.markdown(pdf2image_error)
-        else:
-            st.error(f"Failed to convert PDF to images: {str(e)}")
-        raise
+    import pytesseract
+    import pdf2image.exceptions
 
-def extract_text_from_image(image: Image.Image) -> str:
-    """
-    Extract text from an image with improved error handling.
-    """
-    try:
-        return pytesseract.image_to_string(image)
-    except pytesseract.TesseractNotFoundError:
-        st.error("Tesseract OCR is not properly installed")
+    st.error("❌ PDF Processing Failed")
+    st.error(str(e))
+    if isinstance(e, pytesseract.TesseractNotFoundError):
         tesseract_error = check_tesseract()
         if tesseract_error:
             st.markdown(tesseract_error)
-        raise
-    except Exception as e:
-        st.error(f"OCR processing failed: {str(e)}")
-        raise
-
-def extract_text_from_pdf(pdf_path):
-    text_per_page = []
-    form_fields = extract_pdf_form_fields(pdf_path)
-    
-    try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text().strip()
-            
-            # Try to get form fields first
-            if isinstance(form_fields, dict):
-                for field_name, field_value in form_fields.items():
-                    if field_value and isinstance(field_value, str):
-                        text = f"{field_name}: {field_value}\n" + text
-            
-            if not text or len(text) < 20:
-                images = convert_pdf_to_images(pdf_path, first_page=page_num+1, last_page=page_num+1)
-                ocr_text = ""
-                for img in images:
-                    ocr_text += pytesseract.image_to_string(img)
-                text_per_page.append(ocr_text)
+    if isinstance(e, (pytesseract.TesseractNotFoundError, pdf2image.exceptions.PDFPageCountError)):
+        st.info("🔧 Please check the installation instructions in the README for setting up required dependencies.")
+
+def cancel_analysis(file_id: str):
+    st.session_state["cancelled_upload"] = file_id
+
+def show_timings(document_trace):
+    st.sidebar.header("Timing")
+    st.sidebar.caption(f"{document_trace.to_json()['seconds']:.2f}s in total")
+    st.sidebar.dataframe(document_trace.summary(), hide_index=True)
+
+def show_signatures(signatures: list):
+    """Digital signatures read from the PDF itself; shown before the slower OCR of the form."""
+    for signature in signatures:
+        st.success(f"✓ Digitally signed by: {signature['signer'] or 'unnamed signer'} ({signature['field']})")
+        if signature["signed_at"]:
+            st.success(f"✓ Signed on: {signature['signed_at']}")
+        if signature["covers_document"] is False:
+            st.warning("The document was changed after this signature was applied.")
+
+def scan_sections(document: DocumentContext, file_id: str) -> dict:
+    """
+    The section scan of an upload, streamed page by page with a progress bar and a
+    Cancel button. Clicking Cancel reruns the script, which interrupts the loop and
+    closes the scan. Pages are scored once down to MIN_FUZZY_THRESHOLD and the
+    finished scan is kept for the session, so moving the threshold slider only
+    re-filters its score matrix - unless an early-stopped scan no longer finds
+    every section at the new threshold and has to read on.
+    """
+    scan_key = (file_id, FULL_SCAN, ADAPTIVE_DPI)
+    kept = st.session_state.get("section_scan")
+    if kept is not None and kept[0] == scan_key:
+        scan = kept[1]
+        if scan["complete"] or all(row["Status"] == "Present" for row in scan["scores"].summary(FUZZY_THRESHOLD)):
+            return scan
+    progress = st.progress(0.0, text="Reading pages...")
+    cancel_slot = st.empty()
+    cancel_slot.button("Cancel", on_click=cancel_analysis, args=(file_id,))
+    table = st.empty()
+    with closing(iter_scan_events(document, FUZZY_THRESHOLD, full_scan=FULL_SCAN, adaptive_dpi=ADAPTIVE_DPI,
+                                  min_score=MIN_FUZZY_THRESHOLD)) as events:
+        for event in events:
+            if event["event"] == "page":
+                progress.progress(event["pages_read"] / event["page_count"],
+                                  text=f"Read page {event['page']} ({event['pages_read']} of {event['page_count']})")
+                table.dataframe(event["sections"], hide_index=True)
             else:
-                text_per_page.append(text)
-        return text_per_page
-    except Exception as e:
-        return f"Error extracting text: {e}"
-    finally:
-        if 'doc' in locals():
-            doc.close()
-
-def fuzzy_find_section(text, section):
-    lines = text.split('\n')
-    for line in lines:
-        clean_line = line.strip().lower()
-        clean_section = section.lower()
-        if fuzz.partial_ratio(clean_line, clean_section) >= FUZZY_THRESHOLD:
-            return line.strip()  # Return the actual heading found
-    return None
-
-def fuzzy_find_all_headings(text, section, all_sections):
-    lines = text.split('\n')
-    matches = []
-    section_lower = section.lower()
-    longer_sections = [s.lower() for s in all_sections if len(s) > len(section)]
-    for line in lines:
-        clean_line = line.strip().lower()
-        # Only match if not also a fuzzy match for any longer section name
-        if fuzz.partial_ratio(clean_line, section_lower) >= FUZZY_THRESHOLD:
-            if not any(fuzz.partial_ratio(clean_line, ls) >= FUZZY_THRESHOLD for ls in longer_sections):
-                matches.append(line.strip())
-    return matches
-
-def analyze_sections(text_per_page):
-    summary = []
-    for section in SECTION_HEADERS:
-        found = False
-        page_found = []
-        headings = []
-        for idx, text in enumerate(text_per_page):
-            matches = fuzzy_find_all_headings(text, section, SECTION_HEADERS)
-            if matches:
-                found = True
-                page_found.append(str(idx + 1))
-                headings.extend(matches)
-        # Remove duplicate headings
-        unique_headings = list(dict.fromkeys(headings))
-        summary.append({
-            "Section": section,
-            "Status": "Present" if found else "Missing",
-            "Pages": ', '.join(page_found) if found else "-",
-            "Headings Used": '; '.join(unique_headings) if unique_headings else "-"
-        })
-    return summary
-
-def is_referral_form(text_per_page):
-    for text in text_per_page:
-        for keyword in REFERRAL_KEYWORDS:
-            if keyword in text.lower():
-                return keyword  # Return the keyword found for better feedback
-    return None
-
-def extract_referral_fields(text):
-    # Define possible fields and their keyword variations
-    fields = {
-        "Patient Name": ["patient name", "name of patient", "name", "pt. name", "patient's name", "name of the patient"],
-        "Age": ["age", "patient age"],
-        "Gender": ["gender", "sex", "male", "female", "m/f"],
-        "Referred By": ["referred by", "referring doctor", "referring hospital", "refd by", "refd. by", "refd by"],
-        "Referral Reason": ["referral reason", "reason for referral", "reason", "reason for ref.", "reason for ref"],
-        "Diagnosis": ["diagnosis", "provisional diagnosis", "diagno"],
-        "Date": ["date", "dt."],
-        "Contact": ["contact", "phone", "mobile", "tel", "contact no", "contact number"],
-        "Digital Signature": ["digitally signed by", "digital signature", "signed by"]
-    }
-    
-    lines = text.split('\n')
-    result = {field: "" for field in fields}
-    empty_fields = []
-    
-    # First pass - detect digital signature and timestamp
-    for i, line in enumerate(lines):
-        lcline = line.lower()
-        if "digitally signed by" in lcline:
-            # Get the next line which usually contains the name
-            if i + 1 < len(lines):
-                result["Digital Signature"] = lines[i + 1].strip()
-            # Get the date and time if available
-            for j in range(i + 1, min(i + 4, len(lines))):
-                if "date:" in lines[j].lower():
-                    date_line = lines[j]
-                    # Extract full timestamp including timezone if available
-                    timestamp_match = re.search(r"date:?\s*([0-9.-]+\s*(?:[0-9:]+)?\s*(?:IST|UTC|GMT)?)", date_line, re.IGNORECASE)
-                    if timestamp_match:
-                        result["Date"] = timestamp_match.group(1).strip()
-                    break
-    
-    # Second pass - extract other fields
-    for i, line in enumerate(lines):
-        lcline = line.lower()
-        for field, keywords in fields.items():
-            if field in ["Digital Signature", "Date"] and result[field]:
-                continue  # Skip if already found in first pass
-                
-            for kw in keywords:
-                if fuzz.partial_ratio(kw, lcline.strip()) >= 80 and not result[field]:
-                    # Try regex for value after label, after colon, or after whitespace
-                    match = re.search(rf"{re.escape(kw)}[\s:]*([\w\-/,. ]+)", lcline)
-                    value = ""
-                    if match:
-                        value = match.group(1).strip()
-                    # If value is empty, try next line
-                    if not value and i+1 < len(lines):
-                        next_line = lines[i+1].strip()
-                        # Avoid picking up another label as value
-                        if not any(fuzz.partial_ratio(next_line.lower(), k) >= 80 for k in keywords):
-                            value = next_line
-                    # For Age, try to extract a number
-                    if field == "Age" and not value:
-                        age_match = re.search(r"\b(\d{1,3})\b", lcline)
-                        if age_match:
-                            value = age_match.group(1)
-                    # For Gender, look for M/F or Male/Female
-                    if field == "Gender" and not value:
-                        g_match = re.search(r"\b(male|female|m|f)\b", lcline)
-                        if g_match:
-                            value = g_match.group(1)
-                    result[field] = value
-    
-    # Identify empty fields
-    for field, value in result.items():
-        if not value or not value.strip():
-            empty_fields.append(field)
-            
-    return result, empty_fields
+                scan = event
+    progress.empty()
+    cancel_slot.empty()
+    table.empty()
+    st.session_state["section_scan"] = (scan_key, scan)
+    return scan
+
+def show_section_analysis(document: DocumentContext, file_id: str):
+    st.markdown("### Section Summary")
+    scan = scan_sections(document, file_id)
+    st.dataframe(scan["scores"].summary(FUZZY_THRESHOLD, near_misses=True), hide_index=True)
+    st.success("Analysis complete!")
+    if not scan["complete"]:
+        st.caption(f"Every section was found after reading {scan['pages_read']} of "
+                   f"{len(scan['text_per_page'])} pages; enable Full scan for complete page lists.")
+    if scan["ocr_report"]:
+        with st.expander(f"OCR details ({len(scan['ocr_report'])} pages)"):
+            if scan["duplicate_pages"]:
+                st.caption(f"{scan['duplicate_pages']} duplicate pages reused the OCR of an earlier matching page.")
+            st.dataframe(scan["ocr_report"], hide_index=True)
 
 st.title("📄 Hospital PDF Section Checker")
 st.markdown("""
@@ -420,265 +132,49 @@ This tool will auto-identify whether key medical sections are present or missing
 
 uploaded_file = st.file_uploader(f"Upload PDF ({doc_type})", type=["pdf"])
 
-def ocr_referral_form(pdf_path):
-    # Extract form fields first
-    form_fields = extract_pdf_form_fields(pdf_path)
-    # Then extract scanned form fields
-    fields = extract_scanned_form_fields(pdf_path)
-    
-    # Get text content for signature detection
-    text_per_page = extract_text_from_pdf(pdf_path)
-    if isinstance(text_per_page, str) and text_per_page.startswith("Error"):
-        return text_per_page, "", "", ""
-    
-    full_text = '\n'.join(text_per_page)
-    
-    # Extract signature and date
-    sig_fields = {}
-    lines = full_text.split('\n')
-    for i, line in enumerate(lines):
-        if "digitally signed by" in line.lower():
-            if i + 1 < len(lines):
-                sig_fields["Digital Signature"] = lines[i + 1].strip()
-        elif "date:" in line.lower():
-            timestamp_match = re.search(r"date:?\s*([0-9.-]+\s*(?:[0-9:]+)?\s*(?:IST|UTC|GMT)?)", line, re.IGNORECASE)
-            if timestamp_match:
-                sig_fields["Date"] = timestamp_match.group(1).strip()
-    
-    # Merge signature fields with form fields
-    fields.update(sig_fields)
-    
-    # Determine empty fields - only the ones we can detect reliably
-    empty_fields = []
-    for field in [
-        "Patient Name", "Patient ID", "Contact",
-        "Hospital Name", "Referred To", "Diagnosis",
-        "Digital Signature", "Date"
-    ]:
-        if not fields.get(field):
-            empty_fields.append(field)
-    
-    # Merge form fields into extracted fields if they exist
-    if isinstance(form_fields, dict):
-        for field_name, field_value in form_fields.items():
-            field_name = field_name.strip().lower()
-            # Map form field names to our field names - only the reliable ones
-            field_mapping = {
-                'name': 'Patient Name',
-                'patient': 'Patient Name',
-                'pt': 'Patient Name',
-                'patient_id': 'Patient ID',
-                'id': 'Patient ID',
-                'registration': 'Patient ID',
-                'reg_no': 'Patient ID',
-                'hospital': 'Hospital Name',
-                'facility': 'Hospital Name',
-                'referred_to': 'Referred To',
-                'referredto': 'Referred To',
-                'ref_to': 'Referred To',
-                'diagnosis': 'Diagnosis',
-                'clinical_notes': 'Diagnosis',
-                'contact': 'Contact',
-                'phone': 'Contact',
-                'mobile': 'Contact',
-                'tel': 'Contact',
-                'email': 'Contact'  # Email can also be contact
-            }
-            
-            # Find matching field name
-            for form_key, our_key in field_mapping.items():
-                if form_key in field_name and not fields[our_key]:  # Only use if our field is empty
-                    fields[our_key] = field_value
-                    if our_key in empty_fields:
-                        empty_fields.remove(our_key)
-    
-    # Also return the raw OCR output for the first page for debugging
-    first_page_ocr = text_per_page[0] if text_per_page else ""
-    return fields, empty_fields, full_text, first_page_ocr
-
-def extract_scanned_form_fields(pdf_path):
-    """Extract fields from a scanned form by looking at specific regions"""
+if uploaded_file is not None and st.session_state.get("cancelled_upload") == uploaded_file.file_id:
+    st.warning("Analysis cancelled.")
+    st.button("Analyze again", on_click=st.session_state.pop, args=("cancelled_upload", None))
+elif uploaded_file is not None:
+    document_trace = None
     try:
-        doc = fitz.open(pdf_path)
-        page = doc[0]  # Assume first page
-        fields = {}
-        
-        # Common field labels we expect to find - only the reliable ones
-        field_patterns = {
-            "Patient Name": [r"(?i)patient.*?name\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)name\s*[:\s]\s*(.+?)(?:\||$)"],
-            "Patient ID": [r"(?i)patient\s*(?:id|number)\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)(?:id|reg)\s*(?:no\.?|number)?\s*[:\s]\s*([A-Za-z0-9-]+)(?:\||$)"],
-            "Hospital Name": [r"(?i)hospital\s*(?:name)?\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)facility\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)located\s+within\s+the\s+AOR\s+of\s+(.+?)(?:\||$)"],
-            "Referred To": [r"(?i)referred\s+to\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)ref\.\s*to\s*[:\s]\s*(.+?)(?:\||$)"],
-            "Diagnosis": [r"(?i)diagnosis\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)clinical\s+notes\s*[:\s]\s*(.+?)(?:\||$)"],
-            "Contact": [r"(?i)contact\s*[:\s]\s*(.+?)(?:\||$)", r"(?i)phone\s*[:\s]\s*(\d+)", r"(?i)email\s*[:\s]\s*(\S+@\S+\.\S+)", r"\b\d{10}\b", r"(?i)(?:patient\s+)?email\s*[:\s]\s*(\S+@\S+\.\S+)"]
-        }
-        
-        # Convert page to image for better text extraction
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better OCR
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Extract text with better OCR settings
-        ocr_text = pytesseract.image_to_string(img, config='--psm 3')
-        lines = ocr_text.split('\n')
-        
-        # Process each line
-        for i, line in enumerate(lines):
-            # Skip empty lines
-            if not line.strip():
-                continue
-            
-            # Check each field pattern
-            for field_name, patterns in field_patterns.items():
-                if any(re.search(pattern, line) for pattern in patterns):
-                    # Found a field label, look for value in same line or next line
-                    value = ""
-                    
-                    # Try to find value using regex capture groups
-                    for pattern in patterns:
-                        matches = re.finditer(pattern, line, re.IGNORECASE)
-                        for match in matches:
-                            if match.groups():
-                                value = match.group(1).strip()
-                                # Special handling for each field type
-                                if field_name == "Contact":
-                                    # Try to find phone number
-                                    if phone_match := re.search(r'\b\d{10}\b', line):
-                                        value = phone_match.group(0)
-                                    # Try to find email
-                                    if email_match := re.search(r'\S+@\S+\.\S+', line):
-                                        email = email_match.group(0)
-                                        value = f"{value} | Email ID: {email}" if value else email
-                                elif field_name == "Patient Name":
-                                    # Clean up patient name
-                                    value = re.sub(r'\s*\|\s*Force Type.*', '', value).strip()
-                                elif field_name == "Age":
-                                    # Extract just the numeric age
-                                    if age_match := re.search(r'\b(\d+)\b', value):
-                                        value = age_match.group(1)
-                                elif field_name == "Gender":
-                                    # Normalize gender values
-                                    value = value.lower()
-                                    value = "Male" if re.search(r'\b(male|m)\b', value) else "Female" if re.search(r'\b(female|f)\b', value) else value
-                                elif field_name == "Diagnosis":
-                                    # Clean up diagnosis text
-                                    value = re.sub(r'(?i)clinical\s+notes\s*[:\s]\s*', '', value).strip()
-                                break
-                        if value:
-                            break
-                    
-                    # If no value found, look at next line
-                    if not value and i + 1 < len(lines):
-                        next_line = lines[i + 1].strip()
-                        # Only use next line if it doesn't look like a label
-                        if not any(re.search(p, next_line) for patterns in field_patterns.values() for p in patterns):
-                            value = next_line
-                    
-                    # Special handling for Gender field
-                    if field_name == "Gender" and value:
-                        if re.search(r"(?i)\b(male|m)\b", value):
-                            value = "Male"
-                        elif re.search(r"(?i)\b(female|f)\b", value):
-                            value = "Female"
-                    
-                    fields[field_name] = value
-        
-        return fields
-        
-    except Exception as e:
-        print(f"Error extracting scanned form fields: {e}")
-        return {}
-    finally:
-        if 'doc' in locals():
-            doc.close()
-
-def process_pdf(pdf_path: str, doc_type: str = "Discharge Summary") -> dict:
-    """
-    Process a PDF file with comprehensive error handling.
-    """
-    try:
-        # First try to extract form fields (for digital PDFs)
-        form_fields = extract_pdf_form_fields(pdf_path)
-        
-        # If no form fields found or minimal content, try OCR
-        if not form_fields or sum(len(str(v)) for v in form_fields.values()) < 50:
-            images = convert_pdf_to_images(pdf_path)
-            extracted_text = "\n".join(extract_text_from_image(img) for img in images)
-            
+        # Opened from memory; only very large uploads are spooled to a temp file, removed even on Cancel
+        with trace(uploaded_file.name) as document_trace, open_upload(uploaded_file) as document:
             if doc_type == "Discharge Summary":
-                return analyze_discharge_summary(extracted_text)
-            else:
-                return analyze_referral_form(extracted_text)
-        
-        return form_fields
+                show_section_analysis(document, uploaded_file.file_id)
+            elif doc_type == "Referral Form":
+                signatures = document_signatures(document)
+                show_signatures(signatures)
+                with st.spinner("Analyzing PDF..."):
+                    fields, empty_fields, full_text, first_page_ocr = ocr_referral_form(document, ADAPTIVE_DPI)
+                if isinstance(fields, str) and fields.startswith("Error"):
+                    st.error(fields)
+                else:
+                    # Signatures found only in the text (printed or scanned)
+                    if not signatures and fields.get("Digital Signature"):
+                        st.success(f"✓ Digitally signed by: {fields['Digital Signature']}")
+                        if fields.get("Date"):
+                            st.success(f"✓ Signed on: {fields['Date']}")
+
+                    st.markdown("### Form Fields Detection Results")
+                    # Show detected fields with their sources
+                    for k, v in fields.items():
+                        if k not in ["Digital Signature", "Date"]:
+                            if k in empty_fields:
+                                st.error(f"❌ {k}: Not detected")
+                            else:
+                                st.success(f"{k}: {v}")
     except Exception as e:
-        st.error("❌ PDF Processing Failed")
-        st.error(str(e))
-        if isinstance(e, (pytesseract.TesseractNotFoundError, pdf2image.exceptions.PDFPageCountError)):
-            st.info("🔧 Please check the installation instructions in the README for setting up required dependencies.")
-        raise
-
-if uploaded_file is not None:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(uploaded_file.read())
-        tmp_path = tmp_file.name
-    with st.spinner("Analyzing PDF..."):
-        if doc_type == "Discharge Summary":
-            text_per_page = extract_text_from_pdf(tmp_path)
-            if isinstance(text_per_page, str) and text_per_page.startswith("Error"):
-                st.error(text_per_page)
-            else:
-                summary = analyze_sections(text_per_page)
-                st.success("Analysis complete!")
-                st.markdown("### Section Summary")
-                st.dataframe(summary, hide_index=True)
-        elif doc_type == "Referral Form":
-            fields, empty_fields, full_text, first_page_ocr = ocr_referral_form(tmp_path)
-            if isinstance(fields, str) and fields.startswith("Error"):
-                st.error(fields)
-            else:
-                if fields.get("Digital Signature"):
-                    st.success(f"✓ Digitally signed by: {fields['Digital Signature']}")
-                    if fields.get("Date"):
-                        st.success(f"✓ Signed on: {fields['Date']}")
-                
-                st.markdown("### Form Fields Detection Results")
-                # Show detected fields with their sources
-                for k, v in fields.items():
-                    if k not in ["Digital Signature", "Date"]:
-                        if k in empty_fields:
-                            st.error(f"❌ {k}: Not detected")
-                        else:
-                            st.success(f"{k}: {v}")
-    os.remove(tmp_path)
+        show_processing_error(e)
+    if SHOW_TIMINGS and document_trace is not None:
+        show_timings(document_trace)
 else:
     st.info("Please upload a PDF to begin analysis.")
 
-def analyze_discharge_summary(text: str) -> Dict[str, bool]:
-    """
-    Analyze discharge summary text for required sections.
-    """
-    sections_found = {header: False for header in SECTION_HEADERS}
-    
-    # Check for each section using fuzzy matching
-    for line in text.split('\n'):
-        for section in SECTION_HEADERS:
-            # Use fuzzy matching to account for OCR errors
-            if fuzz.ratio(line.lower(), section.lower()) >= FUZZY_THRESHOLD:
-                sections_found[section] = True
-                
-    return sections_found
-
-def analyze_referral_form(text: str) -> Dict[str, bool]:
-    """
-    Analyze referral form text for required fields.
-    """
-    fields_found = {keyword: False for keyword in REFERRAL_KEYWORDS}
-    
-    # Check for each required field using fuzzy matching
-    for line in text.split('\n'):
-        for keyword in REFERRAL_KEYWORDS:
-            # Use fuzzy matching to account for OCR errors
-            if fuzz.partial_ratio(line.lower(), keyword.lower()) >= FUZZY_THRESHOLD:
-                fields_found[keyword] = True
-                
-    return fields_found
\ No newline at end of file
+cache_stats = get_cache().stats()
+if cache_stats["enabled"]:
+    st.sidebar.header("Cache")
+    st.sidebar.caption(
+        f"{cache_stats['hits']} hits / {cache_stats['misses']} misses in this process · "
+        f"{cache_stats['entries']} entries, {cache_stats['bytes'] / (1024 * 1024):.1f} MB"
+    )
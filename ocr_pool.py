@@ -0,0 +1,313 @@
+"""
+Persistent OCR workers.
+
+pytesseract starts a new `tesseract` process for every image, which reloads
+the language model and round-trips the bitmap through a temp file. An
+OcrPool keeps a few worker processes alive with the engine initialized
+(tesserocr when it is installed) and hands them page bitmaps through shared
+memory, so each page only costs the recognition itself. Workers that crash
+are restarted and the page is retried once; workers that stop answering are
+killed and restarted.
+
+Inside daemonic processes (batch workers), which may not start children,
+each thread keeps its own initialized engine instead.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_OCR_POOL  number of OCR worker processes, or 0 to OCR in the calling process
+                           (default: CPU count when tesserocr is installed, otherwise 0)
+"""
+from __future__ import annotations
+
+import atexit
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import queue
+import shlex
+import threading
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+from deps import lazy_import
+from layout import Word, words_from_tesseract_data
+
+Image = lazy_import("PIL.Image")
+
+# Seconds a worker may spend on one image before it is considered hung
+OCR_TASK_TIMEOUT = 300
+HEALTH_CHECK_TIMEOUT = 10
+# Tesseract's default page segmentation mode (fully automatic)
+DEFAULT_PSM = 3
+
+class OcrWorkerError(RuntimeError):
+    """An OCR worker crashed or stopped answering."""
+
+def tesserocr_available() -> bool:
+    return importlib.util.find_spec("tesserocr") is not None
+
+def _tesserocr_psm(config: str) -> Optional[int]:
+    """Page segmentation mode for a pytesseract config string, or None if tesserocr cannot honour it."""
+    args = shlex.split(config)
+    if not args:
+        return DEFAULT_PSM
+    if len(args) == 2 and args[0] == "--psm" and args[1].isdigit():
+        return int(args[1])
+    return None
+
+class OcrEngine:
+    """An initialized Tesseract engine; falls back to pytesseract when tesserocr is missing."""
+
+    def __init__(self, lang: str = "eng"):
+        self.api = None
+        if tesserocr_available():
+            import tesserocr
+            self.api = tesserocr.PyTessBaseAPI(lang=lang)
+        self.name = "tesserocr" if self.api is not None else "pytesseract"
+
+    def ocr(self, image: Image.Image, config: str = "") -> str:
+        psm = _tesserocr_psm(config)
+        if self.api is None or psm is None:
+            import pytesseract
+            return pytesseract.image_to_string(image, config=config)
+        self.api.SetPageSegMode(psm)
+        self.api.SetImage(image)
+        return self.api.GetUTF8Text()
+
+    def ocr_words(self, image: Image.Image, config: str = "") -> List[Word]:
+        """Word table (see layout.Word) from a single recognition pass."""
+        psm = _tesserocr_psm(config)
+        if self.api is None or psm is None:
+            import pytesseract
+            return words_from_tesseract_data(
+                pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT))
+        from tesserocr import RIL, iterate_level
+        self.api.SetPageSegMode(psm)
+        self.api.SetImage(image)
+        self.api.Recognize()
+        words = []
+        line = -1
+        for word in iterate_level(self.api.GetIterator(), RIL.WORD):
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+            text = (word.GetUTF8Text(RIL.WORD) or "").strip()
+            box = word.BoundingBox(RIL.WORD)
+            if text and box:
+                words.append((text, *box, float(word.Confidence(RIL.WORD)), max(line, 0)))
+        return words
+
+def _worker_main(conn, lang: str):
+    engine = OcrEngine(lang)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        if message == "ping":
+            conn.send(("pong", engine.name))
+            continue
+        shm_name, mode, size, nbytes, config, kind = message
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                image = Image.frombytes(mode, size, bytes(shm.buf[:nbytes]))
+            finally:
+                shm.close()
+            result = engine.ocr_words(image, config) if kind == "words" else engine.ocr(image, config)
+            conn.send(("ok", result))
+        except Exception as e:
+            # Send the original exception when it survives pickling so callers can still catch its type
+            try:
+                pickle.loads(pickle.dumps(e))
+            except Exception:
+                e = OcrWorkerError(f"{type(e).__name__}: {e}")
+            conn.send(("error", e))
+
+class _Worker:
+    def __init__(self, mp_context, lang: str):
+        self.conn, child_conn = mp_context.Pipe()
+        self.process = mp_context.Process(target=_worker_main, args=(child_conn, lang), daemon=True,
+                                          name="ocr-worker")
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class OcrPool:
+    """Fixed-size pool of OCR worker processes, safe to share between threads."""
+
+    def __init__(self, size: int, lang: str = "eng", task_timeout: float = OCR_TASK_TIMEOUT):
+        self.size = size
+        self.lang = lang
+        self.task_timeout = task_timeout
+        self.tasks = 0
+        self.restarts = 0
+        # Workers are started with spawn because the UI and pools around us run threads, which fork does not copy
+        self._mp_context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        for _ in range(size):
+            worker = _Worker(self._mp_context, lang)
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.process.kill()
+        worker.stop(timeout=0)
+        replacement = _Worker(self._mp_context, self.lang)
+        with self._lock:
+            self._workers[self._workers.index(worker)] = replacement
+            self.restarts += 1
+        return replacement
+
+    def _checkout(self) -> _Worker:
+        worker = self._idle.get()
+        if not worker.process.is_alive():
+            worker = self._replace(worker)
+        return worker
+
+    def ocr(self, image: Image.Image, config: str = "") -> str:
+        """OCR an image on the next free worker. Blocks while all workers are busy."""
+        return self._run(image, config, "text")
+
+    def ocr_words(self, image: Image.Image, config: str = "") -> List[Word]:
+        """Like ocr, returning the word table instead of plain text."""
+        return self._run(image, config, "words")
+
+    def _run(self, image: Image.Image, config: str, kind: str):
+        data = image.tobytes()
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            message = (shm.name, image.mode, image.size, len(data), config, kind)
+            for attempt in (1, 2):
+                worker = self._checkout()
+                try:
+                    worker.conn.send(message)
+                    if not worker.conn.poll(self.task_timeout):
+                        worker = self._replace(worker)
+                        raise OcrWorkerError(f"OCR worker did not answer within {self.task_timeout}s")
+                    status, payload = worker.conn.recv()
+                except (EOFError, OSError):
+                    # The worker died mid-task: restart it and retry the page once
+                    worker = self._replace(worker)
+                    if attempt == 2:
+                        raise OcrWorkerError("OCR worker crashed twice on the same image")
+                    continue
+                finally:
+                    self._idle.put(worker)
+                worker.tasks += 1
+                with self._lock:
+                    self.tasks += 1
+                if status == "error":
+                    raise payload
+                return payload
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def health_check(self) -> Dict:
+        """Ping every idle worker, restart the ones that are dead or unresponsive, and return stats()."""
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in checked:
+            try:
+                worker.conn.send("ping")
+                if not worker.conn.poll(HEALTH_CHECK_TIMEOUT):
+                    raise OcrWorkerError("no answer")
+                worker.conn.recv()
+            except (EOFError, OSError, OcrWorkerError):
+                worker = self._replace(worker)
+            self._idle.put(worker)
+        return self.stats()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            workers = list(self._workers)
+        return {
+            "size": self.size,
+            "alive": sum(worker.process.is_alive() for worker in workers),
+            "busy": self.size - self._idle.qsize(),
+            "tasks": self.tasks,
+            "restarts": self.restarts,
+            "engine": "tesserocr" if tesserocr_available() else "pytesseract",
+        }
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+_pool: Optional[OcrPool] = None
+_pool_pid: Optional[int] = None
+_pool_size: Optional[int] = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def ocr_pool_size() -> int:
+    if _pool_size is not None:
+        return _pool_size
+    setting = os.environ.get("HOSPITAL_PDF_OCR_POOL", "").strip()
+    if setting:
+        return max(0, int(setting))
+    return (os.cpu_count() or 1) if tesserocr_available() else 0
+
+def configure_ocr_pool(size: Optional[int]):
+    """Override the pool size for this process (None goes back to the environment); call before the first OCR."""
+    global _pool_size
+    _pool_size = size
+
+def get_ocr_pool() -> Optional[OcrPool]:
+    """The process-wide pool, started on first use; None when the pool is disabled or cannot start children."""
+    global _pool, _pool_pid
+    if multiprocessing.current_process().daemon or ocr_pool_size() == 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = OcrPool(ocr_pool_size())
+            _pool_pid = os.getpid()
+            atexit.register(_pool.close)
+        return _pool
+
+def running_ocr_pool() -> Optional[OcrPool]:
+    """The process-wide pool if it has already been started in this process; never starts it."""
+    with _pool_lock:
+        return _pool if _pool is not None and _pool_pid == os.getpid() else None
+
+def _thread_engine() -> OcrEngine:
+    engine = getattr(_local, "engine", None)
+    if engine is None:
+        engine = _local.engine = OcrEngine()
+    return engine
+
+def ocr_image(image: Image.Image, config: str = "") -> str:
+    """OCR an image on the worker pool, or with this thread's engine when there is no pool."""
+    pool = get_ocr_pool()
+    if pool is not None:
+        return pool.ocr(image, config)
+    return _thread_engine().ocr(image, config)
+
+def ocr_words(image: Image.Image, config: str = "") -> List[Word]:
+    """Word table for an image from one OCR pass, on the pool when there is one."""
+    pool = get_ocr_pool()
+    if pool is not None:
+        return pool.ocr_words(image, config)
+    return _thread_engine().ocr_words(image, config)
@@ -0,0 +1,181 @@
+"""
+Streaming page pipeline.
+
+Render, OCR and section matching run page by page: results are yielded as
+soon as each page is done, and at most `window` pages are in flight at
+once, so a 300-page bundle needs no more memory than a short letter.
+"""
+from collections import OrderedDict
+from contextlib import closing
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from document import open_document
+from engine import DEFAULT_FUZZY_THRESHOLD, OCR_DPI, REFERRAL_KEYWORDS, SECTION_HEADERS, iter_page_texts
+from matching import SectionScores, concat_scores, score_sections
+from tracing import span
+
+# Section matches of recent page texts, reused by pages with the same text
+MAX_MEMOIZED_PAGE_MATCHES = 64
+
+def iter_page_results(pdf_path, threshold: int = DEFAULT_FUZZY_THRESHOLD, window: Optional[int] = None,
+                      dpi: int = OCR_DPI, ocr_workers: Optional[int] = None,
+                      text_first: bool = False, adaptive_dpi: bool = False,
+                      min_score: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Yield one result per page, in page order (text-layer pages first with text_first):
+    {"page": 1-based number, "source": "text", "ocr" or "mixed", "text": page text,
+     "headings": {section: [matching heading lines]},
+     "scores": the page's SectionScores, exact for thresholds down to min_score (default: threshold),
+     "ocr": DPI, confidence and seconds for OCR'd pages, else None}
+    Pages with the same text as a recent page (such as duplicate pages) reuse its section matches.
+    """
+    min_score = threshold if min_score is None else min(min_score, threshold)
+    ocr_report = []
+    matched: OrderedDict[str, Tuple[SectionScores, Dict[str, List[str]]]] = OrderedDict()
+    pages = iter_page_texts(pdf_path, window=window, dpi=dpi, ocr_workers=ocr_workers, text_first=text_first,
+                            adaptive_dpi=adaptive_dpi, ocr_report=ocr_report)
+    for page_num, source, text in pages:
+        if text in matched:
+            matched.move_to_end(text)
+        else:
+            with span("match", page=page_num + 1, pages=1):
+                scores = score_sections([text], SECTION_HEADERS, min_score)
+                headings = {}
+                for section_idx, section in enumerate(SECTION_HEADERS):
+                    matches = scores.headings(section_idx, threshold)[0]
+                    if matches:
+                        headings[section] = matches
+            matched[text] = (scores, headings)
+            if len(matched) > MAX_MEMOIZED_PAGE_MATCHES:
+                matched.popitem(last=False)
+        scores, headings = matched[text]
+        ocr = ocr_report[-1] if ocr_report and ocr_report[-1]["page"] == page_num + 1 else None
+        yield {"page": page_num + 1, "source": source, "text": text, "headings": headings, "scores": scores,
+               "ocr": ocr}
+
+class SectionTally:
+    """Accumulates per-page results into the analyze_sections summary without keeping page text."""
+
+    def __init__(self, sections: List[str] = SECTION_HEADERS):
+        self.sections = list(sections)
+        self.pages: Dict[str, List[int]] = {section: [] for section in self.sections}
+        # heading -> first page it was seen on, so pages can arrive out of order
+        self.headings: Dict[str, Dict[str, int]] = {section: {} for section in self.sections}
+        self.pages_seen = 0
+
+    def add(self, page_result: Dict):
+        self.pages_seen += 1
+        for section, matches in page_result["headings"].items():
+            self.pages[section].append(page_result["page"])
+            for heading in matches:
+                first_page = self.headings[section].get(heading, page_result["page"])
+                self.headings[section][heading] = min(first_page, page_result["page"])
+
+    def all_found(self) -> bool:
+        return all(self.pages.values())
+
+    def summary(self) -> List[Dict[str, str]]:
+        summary = []
+        for section in self.sections:
+            found = bool(self.pages[section])
+            headings = sorted(self.headings[section], key=self.headings[section].get)
+            summary.append({
+                "Section": section,
+                "Status": "Present" if found else "Missing",
+                "Pages": ', '.join(str(page) for page in sorted(self.pages[section])) if found else "-",
+                "Headings Used": '; '.join(headings) if headings else "-"
+            })
+        return summary
+
+def analyze_sections_streaming(pdf_path, threshold: int = DEFAULT_FUZZY_THRESHOLD, window: Optional[int] = None,
+                               ocr_workers: Optional[int] = None) -> List[Dict[str, str]]:
+    """Same table as analyze_sections, computed page by page with bounded memory."""
+    tally = SectionTally()
+    for page_result in iter_page_results(pdf_path, threshold, window, ocr_workers=ocr_workers):
+        tally.add(page_result)
+    return tally.summary()
+
+def iter_scan_events(pdf_path, threshold: int = DEFAULT_FUZZY_THRESHOLD, detect_referral: bool = False,
+                     full_scan: bool = False, window: Optional[int] = None,
+                     ocr_workers: Optional[int] = None, adaptive_dpi: bool = False,
+                     min_score: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Incremental form of scan_pages for progress displays. After each page yields
+    {"event": "page", "page", "source", "headings", "ocr", "pages_read", "page_count",
+     "sections": the analyze_sections table so far}
+    and finally {"event": "done", **the scan_pages result}. Pages are scored once down to
+    min_score (default: threshold), so the final "scores" can be summarized at any threshold above it.
+    Closing the generator cancels the scan, including OCR jobs not yet started.
+    """
+    tally = SectionTally()
+    referral_keyword = None
+    ocr_report = []
+    with open_document(pdf_path) as ctx:
+        text_per_page = [""] * ctx.page_count
+        page_scores: List[Optional[SectionScores]] = [None] * ctx.page_count
+        results = iter_page_results(ctx, threshold, window, ocr_workers=ocr_workers, text_first=not full_scan,
+                                    adaptive_dpi=adaptive_dpi, min_score=min_score)
+        # closing() stops the stream on early exit, cancelling OCR jobs that have not started
+        with closing(results):
+            for page_result in results:
+                text_per_page[page_result["page"] - 1] = page_result["text"]
+                page_scores[page_result["page"] - 1] = page_result["scores"]
+                tally.add(page_result)
+                if page_result["ocr"] is not None:
+                    ocr_report.append(page_result["ocr"])
+                if detect_referral and referral_keyword is None:
+                    text_lower = page_result["text"].lower()
+                    referral_keyword = next((keyword for keyword in REFERRAL_KEYWORDS if keyword in text_lower), None)
+                yield {
+                    "event": "page",
+                    "page": page_result["page"],
+                    "source": page_result["source"],
+                    "headings": page_result["headings"],
+                    "ocr": page_result["ocr"],
+                    "pages_read": tally.pages_seen,
+                    "page_count": len(text_per_page),
+                    "sections": tally.summary(),
+                }
+                if full_scan:
+                    continue
+                if referral_keyword is not None or (not detect_referral and tally.all_found()):
+                    break
+    # Pages not read count as empty, as in text_per_page
+    min_score = threshold if min_score is None else min(min_score, threshold)
+    unread = score_sections([""], SECTION_HEADERS, min_score)
+    yield {
+        "event": "done",
+        "text_per_page": text_per_page,
+        "sections": tally.summary(),
+        "scores": (concat_scores([scores or unread for scores in page_scores]) if page_scores
+                   else score_sections([], SECTION_HEADERS, min_score)),
+        "referral_keyword": referral_keyword,
+        "pages_read": tally.pages_seen,
+        "ocr_pages_read": len(ocr_report),
+        "ocr_report": ocr_report,
+        "duplicate_pages": sum(1 for entry in ocr_report if "duplicate_of" in entry),
+        "complete": tally.pages_seen == len(text_per_page),
+    }
+
+def scan_pages(pdf_path, threshold: int = DEFAULT_FUZZY_THRESHOLD, detect_referral: bool = False,
+               full_scan: bool = False, window: Optional[int] = None, ocr_workers: Optional[int] = None,
+               adaptive_dpi: bool = False) -> Dict:
+    """
+    Read a document cheapest pages first and stop once the verdict is decided:
+    when every section is present, or with detect_referral as soon as a referral
+    keyword is seen (a discharge summary can then only be confirmed by reading
+    every page). full_scan reads every page so the page lists are complete.
+
+    Returns {"text_per_page": page texts with "" for pages not read,
+             "sections": the analyze_sections table over the pages read,
+             "scores": the SectionScores of the pages read,
+             "referral_keyword": first keyword seen or None,
+             "pages_read": int, "ocr_pages_read": int, "complete": bool,
+             "ocr_report": DPI, confidence and seconds per OCR'd page,
+             "duplicate_pages": OCR'd pages whose result was reused from a duplicate page}
+    """
+    for event in iter_scan_events(pdf_path, threshold, detect_referral, full_scan, window, ocr_workers, adaptive_dpi):
+        pass
+    result = dict(event)
+    del result["event"]
+    return result
@@ -0,0 +1,194 @@
+"""
+NumPy preprocessing of page renders before OCR.
+
+Steps work on array views of the PyMuPDF pixmap buffer instead of PIL
+copies: grayscale conversion, adaptive (local mean) thresholding, margin
+cropping and deskewing. Each step can be switched on separately, and the
+time spent in each is recorded so they can be benchmarked one by one
+(see benchmarks/preprocessing.py). OCR word boxes are mapped back to the
+coordinates of the original render with unmap_words.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_PREPROCESS  comma-separated steps to run before OCR, in any order,
+                             from: grayscale, threshold, crop, deskew (default: none)
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from deps import lazy_import
+from layout import Word
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+# Steps always run in this order, whatever order they are configured in
+PREPROCESS_STEPS = ("grayscale", "threshold", "crop", "deskew")
+
+# Pixels darker than this count as ink for cropping and skew estimation
+INK_LEVEL = 128
+# Adaptive threshold: a pixel is ink when it is this much darker than its neighbourhood mean
+THRESHOLD_SENSITIVITY = 0.15
+# Neighbourhood side for the adaptive threshold, as a fraction of the DPI (about 1/8 inch)
+THRESHOLD_WINDOW_INCHES = 0.125
+CROP_PAD_PIXELS = 10
+# Skew search range and resolution in degrees; fax scans are rarely off by more than a few degrees
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.25
+# Skew is estimated on a copy downsampled to about this width
+SKEW_ESTIMATE_WIDTH = 800
+
+def configured_steps() -> Tuple[str, ...]:
+    setting = os.environ.get("HOSPITAL_PDF_PREPROCESS", "")
+    requested = {step.strip().lower() for step in setting.split(",") if step.strip()}
+    unknown = requested - set(PREPROCESS_STEPS)
+    if unknown:
+        raise ValueError(f"Unknown preprocessing steps: {', '.join(sorted(unknown))}")
+    return tuple(step for step in PREPROCESS_STEPS if step in requested)
+
+def pixmap_array(pix) -> np.ndarray:
+    """(height, width, channels) uint8 view of a pixmap's samples; the pixmap must outlive it."""
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+def to_grayscale(pixels: np.ndarray) -> np.ndarray:
+    """ITU-R 601 luma in integer arithmetic; single-channel input is returned as a view."""
+    if pixels.ndim == 2:
+        return pixels
+    if pixels.shape[2] == 1:
+        return pixels[:, :, 0]
+    # Widen first: NumPy 1.x keeps uint8 * uint16 scalar products in uint8, which overflows
+    channels = pixels[:, :, :3].astype(np.uint16)
+    weighted = channels[:, :, 0] * 77 + channels[:, :, 1] * 150 + channels[:, :, 2] * 29
+    return (weighted >> 8).astype(np.uint8)
+
+def adaptive_threshold(gray: np.ndarray, window: int, sensitivity: float = THRESHOLD_SENSITIVITY) -> np.ndarray:
+    """Binarize against the mean of each pixel's window x window neighbourhood (Bradley's method)."""
+    height, width = gray.shape
+    half = max(1, window // 2)
+    # Box sums from running sums, one axis at a time; window sums are small enough for int32
+    y0 = np.clip(np.arange(height) - half, 0, height)
+    y1 = np.clip(np.arange(height) + half + 1, 0, height)
+    x0 = np.clip(np.arange(width) - half, 0, width)
+    x1 = np.clip(np.arange(width) + half + 1, 0, width)
+    running = np.zeros((height + 1, width), dtype=np.int32)
+    np.cumsum(gray, axis=0, dtype=np.int32, out=running[1:])
+    columns = running[y1] - running[y0]
+    running = np.zeros((height, width + 1), dtype=np.int32)
+    np.cumsum(columns, axis=1, out=running[:, 1:])
+    sums = running[:, x1] - running[:, x0]
+    areas = ((y1 - y0)[:, None] * (x1 - x0)[None, :]).astype(np.int32)
+    ink = gray * areas * 100 < sums * int(round(100 * (1 - sensitivity)))
+    return np.where(ink, np.uint8(0), np.uint8(255))
+
+def crop_margins(gray: np.ndarray, pad: int = CROP_PAD_PIXELS) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """View of the ink bounding box plus padding, and its (x, y) offset in the input."""
+    ink = gray < INK_LEVEL
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if rows.size == 0:
+        return gray, (0, 0)
+    top, bottom = max(0, rows[0] - pad), min(gray.shape[0], rows[-1] + pad + 1)
+    left, right = max(0, cols[0] - pad), min(gray.shape[1], cols[-1] + pad + 1)
+    return gray[top:bottom, left:right], (int(left), int(top))
+
+def estimate_skew(gray: np.ndarray, max_degrees: float = MAX_SKEW_DEGREES,
+                  step_degrees: float = SKEW_STEP_DEGREES) -> float:
+    """
+    Angle in degrees that best aligns text lines horizontally: the one whose
+    sheared row profile of ink pixels is the most peaked (projection profile method).
+    """
+    factor = max(1, gray.shape[1] // SKEW_ESTIMATE_WIDTH)
+    ys, xs = np.nonzero(gray[::factor, ::factor] < INK_LEVEL)
+    if ys.size == 0:
+        return 0.0
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_degrees, max_degrees + step_degrees / 2, step_degrees):
+        rows = ys - np.round(xs * np.tan(np.radians(angle))).astype(np.int64)
+        profile = np.bincount(rows - rows.min())
+        score = float(np.dot(profile, profile))
+        # Prefer the smallest correction on ties so clean pages stay untouched
+        if score > best_score * (1 + 1e-9) or (score >= best_score and abs(angle) < abs(best_angle)):
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def deskew(gray: np.ndarray, degrees: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Straighten text lines skewed by `degrees` (as returned by estimate_skew) with a
+    vertical shear: each column moves down by its own offset, which matches a
+    rotation closely at the small angles seen on scans. The image grows by the
+    largest offset so nothing is cut off. Returns the new image and the column offsets.
+    """
+    height, width = gray.shape
+    rises = np.round(np.arange(width) * np.tan(np.radians(degrees))).astype(np.int64)
+    offsets = rises.max() - rises
+    out = np.full((height + int(offsets.max()), width), 255, dtype=gray.dtype)
+    # Columns sharing an offset form contiguous runs, so each run is one slice copy
+    boundaries = np.flatnonzero(np.diff(offsets)) + 1
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, width]):
+        offset = int(offsets[start])
+        out[offset:offset + height, start:end] = gray[:, start:end]
+    return out, offsets
+
+class Prepared:
+    """A preprocessed render plus what is needed to map OCR boxes back onto the original."""
+
+    def __init__(self, pixels: np.ndarray, offset: Tuple[int, int], column_offsets: Optional[np.ndarray],
+                 original_size: Tuple[int, int]):
+        self.pixels = pixels
+        # (x, y) of the cropped area in the original render
+        self.offset = offset
+        # How far deskew moved each column down, or None if it did not run
+        self.column_offsets = column_offsets
+        self.original_size = original_size
+
+    def image(self) -> Image.Image:
+        return Image.fromarray(np.ascontiguousarray(self.pixels))
+
+def preprocess(pixels: np.ndarray, steps: Iterable[str], dpi: int,
+               stats: Optional[Dict[str, float]] = None) -> Prepared:
+    """
+    Run the given steps on a render. Steps after grayscale imply it. If stats is
+    given, the seconds spent in each step are added to it.
+    """
+    steps = set(steps)
+    original = pixels
+    original_size = (pixels.shape[1], pixels.shape[0])
+    offset, column_offsets = (0, 0), None
+
+    def timed(step, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        if stats is not None:
+            stats[step] = stats.get(step, 0.0) + time.perf_counter() - start
+        return result
+
+    if steps:
+        pixels = timed("grayscale", to_grayscale, pixels)
+    if "threshold" in steps:
+        window = max(3, int(dpi * THRESHOLD_WINDOW_INCHES))
+        pixels = timed("threshold", adaptive_threshold, pixels, window)
+    if "crop" in steps:
+        pixels, offset = timed("crop", crop_margins, pixels)
+    if "deskew" in steps:
+        angle = timed("deskew", estimate_skew, pixels)
+        if angle:
+            pixels, column_offsets = timed("deskew", deskew, pixels, angle)
+    if np.shares_memory(pixels, original):
+        # Views of the pixmap buffer must not outlive the pixmap
+        pixels = pixels.copy()
+    return Prepared(pixels, offset, column_offsets, original_size)
+
+def unmap_words(words: List[Word], prepared: Prepared) -> List[Word]:
+    """Map word boxes from a preprocessed image back to the original render's pixel coordinates."""
+    dx, dy = prepared.offset
+    mapped = []
+    for text, x0, y0, x1, y1, confidence, line in words:
+        if prepared.column_offsets is not None:
+            # Undo the shear at the word's centre; the box stays axis-aligned, so long words are approximate
+            column = min(max(int((x0 + x1) / 2), 0), len(prepared.column_offsets) - 1)
+            shift = int(prepared.column_offsets[column])
+            y0, y1 = y0 - shift, y1 - shift
+        mapped.append((text, x0 + dx, y0 + dy, x1 + dx, y1 + dy, confidence, line))
+    return mapped
@@ -0,0 +1,357 @@
+"""
+JSON HTTP service for document analysis.
+
+Usage:
+    python service.py [--host 127.0.0.1] [--port 8080] [--workers 4] [--ocr-workers N] [--queue memory|PATH]
+
+A PDF posted to /jobs is queued and its job ID returned at once; a fixed
+number of worker threads take jobs off the queue and run the same analysis
+as the batch CLI (engine.analyze_document), with OCR on the shared OCR
+worker pool. Results are fetched from /jobs/<id> or posted to a webhook.
+
+Endpoints:
+    POST /jobs      body: the PDF bytes; query: type=auto|discharge|referral, threshold=75,
+                    full_scan=1, adaptive_dpi=1, trace=1, name=<file name>, webhook=<http(s) URL>
+                    -> 202 {"job_id", "status", "url"}
+    GET /jobs/<id>  -> the job: status, options, timestamps and, once finished, "result" or "error"
+    GET /metrics    -> queue depth, jobs per status, busy workers, throughput and OCR pool stats
+    GET /metrics/prometheus -> the same gauges plus per-stage latency histograms (see tracing.py)
+                    in the Prometheus text format
+    GET /health     -> {"status": "ok" or "degraded", "tesseract": first line of `tesseract --version`
+                    or null, "ocr_pool": OCR pool stats or null}; pings the idle OCR workers and
+                    restarts dead or hung ones; 503 when workers are still down
+
+Configuration (environment variables):
+    HOSPITAL_PDF_SERVICE_MAX_MB     largest accepted upload in megabytes (default 64)
+    HOSPITAL_PDF_SERVICE_MAX_QUEUE  queued jobs beyond which uploads are refused with 503 (default 100)
+    HOSPITAL_PDF_JOB_QUEUE, HOSPITAL_PDF_JOB_RETENTION_HOURS and HOSPITAL_PDF_JOB_LEASE_SECONDS are described
+    in jobs.py.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from batch import DOC_TYPE_CHOICES
+from deps import tesseract_version
+from engine import DEFAULT_FUZZY_THRESHOLD, MIN_FUZZY_THRESHOLD, analyze_document
+from jobs import JobQueue, heartbeat_seconds, open_job_queue, retention_seconds
+from ocr_pool import running_ocr_pool
+from tracing import metrics as stage_metrics, trace
+
+DEFAULT_MAX_UPLOAD_MB = 64
+DEFAULT_MAX_QUEUED_JOBS = 100
+DEFAULT_WORKERS = 4
+
+# Webhook deliveries are retried with these pauses (seconds) between attempts
+WEBHOOK_RETRY_DELAYS = (1, 5, 30)
+WEBHOOK_TIMEOUT = 10
+# Finished jobs past their retention are purged at most this often
+PURGE_INTERVAL = 300
+
+class BadRequest(ValueError):
+    """A request the client has to fix; answered with its status code and message."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+def parse_options(query: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Analysis options for a job from the POST /jobs query string."""
+    def value(name, default=None):
+        return query.get(name, [default])[-1]
+
+    def flag(name):
+        return str(value(name, "")).lower() in ("1", "true", "yes", "on")
+
+    doc_type = value("type", "auto")
+    if doc_type not in DOC_TYPE_CHOICES:
+        raise BadRequest(f"type must be one of {', '.join(sorted(DOC_TYPE_CHOICES))}")
+    try:
+        threshold = int(value("threshold", DEFAULT_FUZZY_THRESHOLD))
+    except ValueError:
+        raise BadRequest("threshold must be an integer")
+    if not MIN_FUZZY_THRESHOLD <= threshold <= 100:
+        raise BadRequest(f"threshold must be between {MIN_FUZZY_THRESHOLD} and 100")
+    return {
+        "type": doc_type,
+        "threshold": threshold,
+        "full_scan": flag("full_scan"),
+        "adaptive_dpi": flag("adaptive_dpi"),
+        "trace": flag("trace"),
+        "name": value("name"),
+    }
+
+def deliver_webhook(url: str, payload: Dict[str, Any]) -> str:
+    """POST payload as JSON to url, retrying failures; returns "delivered" or the last error."""
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    error = None
+    for delay in (0,) + WEBHOOK_RETRY_DELAYS:
+        time.sleep(delay)
+        request = urllib.request.Request(url, data=data, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT):
+                return "delivered"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return f"failed: {error}"
+
+class AnalysisService:
+    """Worker threads draining a job queue, plus the counters behind /metrics."""
+
+    def __init__(self, queue: JobQueue, workers: int = DEFAULT_WORKERS,
+                 max_upload_bytes: int = DEFAULT_MAX_UPLOAD_MB * 1024 * 1024,
+                 max_queued_jobs: int = DEFAULT_MAX_QUEUED_JOBS, ocr_workers: Optional[int] = None):
+        self.queue = queue
+        self.workers = workers
+        # Pages of one document OCR'd at once; workers x ocr_workers stays near the core count
+        self.ocr_workers = ocr_workers or max(1, (os.cpu_count() or 1) // workers)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_queued_jobs = max_queued_jobs
+        self.started = time.time()
+        self.busy = 0
+        self.processed = 0
+        self.seconds_total = 0.0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_purge = 0.0
+        self._threads = [threading.Thread(target=self._work, name=f"analysis-worker-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop taking jobs and wait for the running ones to finish."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, pdf: bytes, options: Dict[str, Any], webhook: Optional[str]) -> str:
+        if self.queue.counts()["queued"] >= self.max_queued_jobs:
+            raise BadRequest("Too many queued jobs, retry later", status=503)
+        now = time.time()
+        if now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            self.queue.purge(now - retention_seconds())
+        return self.queue.submit(pdf, options, webhook)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            claimed = self.queue.claim(timeout=1.0)
+            if claimed is None:
+                continue
+            job, pdf = claimed
+            with self._lock:
+                self.busy += 1
+            start = time.perf_counter()
+            # Keep the job's lease while it runs, however long that takes
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], done), daemon=True)
+            heartbeat.start()
+            try:
+                self._run(job, pdf)
+            finally:
+                done.set()
+                heartbeat.join()
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+                    self.seconds_total += time.perf_counter() - start
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        while not done.wait(heartbeat_seconds()):
+            try:
+                self.queue.heartbeat(job_id)
+            except Exception as e:
+                # A locked queue file must not kill the job; the next beat retries
+                print(f"Heartbeat for job {job_id} failed: {e}", file=sys.stderr)
+
+    def _run(self, job: Dict[str, Any], pdf: bytes):
+        options = job["options"]
+        result, error = None, None
+        with trace(options.get("name") or job["id"]) as job_trace:
+            try:
+                result = analyze_document(pdf, DOC_TYPE_CHOICES[options["type"]], options["threshold"],
+                                          self.ocr_workers, full_scan=options["full_scan"],
+                                          adaptive_dpi=options["adaptive_dpi"])
+                result["path"] = options.get("name")
+                error = result.get("error")
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        if result is not None and options.get("trace"):
+            result["trace"] = job_trace.to_json()
+        self.queue.finish(job["id"], result, error)
+        if job["webhook"]:
+            # Retries can take a while, so deliveries do not hold up a worker
+            threading.Thread(target=self._notify, args=(job["id"], job["webhook"]), daemon=True).start()
+
+    def _notify(self, job_id: str, url: str):
+        self.queue.set_webhook_status(job_id, deliver_webhook(url, self.queue.get(job_id)))
+
+    def metrics(self) -> Dict[str, Any]:
+        counts = self.queue.counts()
+        with self._lock:
+            busy, processed, seconds_total = self.busy, self.processed, self.seconds_total
+        # Only a pool that is already running: a scrape must not start one
+        pool = running_ocr_pool()
+        return {
+            "queue_depth": counts["queued"],
+            "jobs": counts,
+            "workers": self.workers,
+            "busy_workers": busy,
+            "processed": processed,
+            "mean_job_seconds": round(seconds_total / processed, 3) if processed else None,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "ocr_pool": pool.stats() if pool is not None else None,
+        }
+
+    def health(self) -> Dict[str, Any]:
+        """Health of the OCR worker pool, if one is running; dead or unresponsive workers are restarted."""
+        pool = running_ocr_pool()
+        if pool is None:
+            return {"status": "ok", "tesseract": tesseract_version(), "ocr_pool": None}
+        stats = pool.health_check()
+        return {"status": "ok" if stats["alive"] == stats["size"] else "degraded",
+                "tesseract": tesseract_version(), "ocr_pool": stats}
+
+    def prometheus_text(self) -> str:
+        """Queue gauges and per-stage metrics in the Prometheus text format."""
+        current = self.metrics()
+        lines = [
+            "# HELP hospital_pdf_jobs Jobs in the queue by status.",
+            "# TYPE hospital_pdf_jobs gauge",
+        ]
+        lines.extend(f'hospital_pdf_jobs{{status="{status}"}} {count}' for status, count in current["jobs"].items())
+        lines.extend([
+            "# HELP hospital_pdf_busy_workers Analysis workers currently running a job.",
+            "# TYPE hospital_pdf_busy_workers gauge",
+            f"hospital_pdf_busy_workers {current['busy_workers']}",
+            "# HELP hospital_pdf_workers Analysis worker threads.",
+            "# TYPE hospital_pdf_workers gauge",
+            f"hospital_pdf_workers {current['workers']}",
+            "# HELP hospital_pdf_jobs_processed_total Jobs finished by this process.",
+            "# TYPE hospital_pdf_jobs_processed_total counter",
+            f"hospital_pdf_jobs_processed_total {current['processed']}",
+        ])
+        return "\n".join(lines) + "\n" + stage_metrics.prometheus_text()
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    server_version = "HospitalPDFChecker/1.0"
+
+    @property
+    def service(self) -> AnalysisService:
+        return self.server.service
+
+    def send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            health = self.service.health()
+            self.send_json(200 if health["status"] == "ok" else 503, health)
+        elif path == "/metrics":
+            self.send_json(200, self.service.metrics())
+        elif path == "/metrics/prometheus":
+            body = self.service.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path.startswith("/jobs/"):
+            job = self.service.queue.get(path[len("/jobs/"):])
+            if job is None:
+                self.send_json(404, {"error": "No such job"})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            options = parse_options(parse_qs(url.query))
+            webhook = parse_qs(url.query).get("webhook", [None])[-1]
+            if webhook is not None and urlparse(webhook).scheme not in ("http", "https"):
+                raise BadRequest("webhook must be an http(s) URL")
+            length = self.headers.get("Content-Length")
+            if length is None:
+                raise BadRequest("Content-Length is required", status=411)
+            try:
+                length = int(length)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                raise BadRequest("Content-Length must be a non-negative number of bytes") from None
+            if length > self.service.max_upload_bytes:
+                raise BadRequest(f"Upload larger than {self.service.max_upload_bytes} bytes", status=413)
+            pdf = self.rfile.read(length)
+            if b"%PDF" not in pdf[:1024]:
+                raise BadRequest("Body is not a PDF")
+            job_id = self.service.submit(pdf, options, webhook)
+        except BadRequest as e:
+            # The body is unread after early rejections, so the connection cannot be reused
+            self.close_connection = True
+            self.send_json(e.status, {"error": str(e)}, {"Retry-After": "30"} if e.status == 503 else None)
+            return
+        self.send_json(202, {"job_id": job_id, "status": "queued", "url": f"/jobs/{job_id}"},
+                       {"Location": f"/jobs/{job_id}"})
+
+def make_server(host: str, port: int, service: AnalysisService) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve document analysis as an asynchronous JSON job API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Documents analyzed at once")
+    parser.add_argument("--ocr-workers", type=int, default=None,
+                        help="Parallel OCR pages per document (default: CPU count / workers)")
+    parser.add_argument("--queue", default=None,
+                        help="'memory' or the path of a SQLite queue file (default: HOSPITAL_PDF_JOB_QUEUE or memory)")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(
+        open_job_queue(args.queue), args.workers,
+        int(os.environ.get("HOSPITAL_PDF_SERVICE_MAX_MB", DEFAULT_MAX_UPLOAD_MB)) * 1024 * 1024,
+        int(os.environ.get("HOSPITAL_PDF_SERVICE_MAX_QUEUE", DEFAULT_MAX_QUEUED_JOBS)),
+        args.ocr_workers,
+    )
+    service.start()
+    server = make_server(args.host, args.port, service)
+    print(f"Serving on http://{args.host}:{server.server_port} with {args.workers} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        service.queue.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
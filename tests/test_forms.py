@@ -0,0 +1,34 @@
+import fitz
+
+from forms import read_acroform
+
+def _text_field_form(name: str) -> fitz.Document:
+    doc = fitz.open()
+    page = doc.new_page()
+    widget = fitz.Widget()
+    widget.field_type = fitz.PDF_WIDGET_TYPE_TEXT
+    widget.field_name = name
+    widget.rect = fitz.Rect(50, 50, 300, 80)
+    widget.field_value = "placeholder"
+    page.add_widget(widget)
+    return doc
+
+def test_indirect_value_is_resolved():
+    doc = _text_field_form("diagnosis")
+    widget_xref = doc[0].first_widget.xref
+    value_xref = doc.get_new_xref()
+    doc.update_object(value_xref, "(Dengue fever)")
+    doc.xref_set_key(widget_xref, "V", f"{value_xref} 0 R")
+
+    fields = read_acroform(doc)
+    assert fields == [{"name": "diagnosis", "type": "text", "value": "Dengue fever", "pages": [0]}]
+
+def test_indirect_stream_value_is_resolved():
+    doc = _text_field_form("notes")
+    widget_xref = doc[0].first_widget.xref
+    value_xref = doc.get_new_xref()
+    doc.update_object(value_xref, "<<>>")
+    doc.update_stream(value_xref, b"Admitted with fever")
+    doc.xref_set_key(widget_xref, "V", f"{value_xref} 0 R")
+
+    assert read_acroform(doc)[0]["value"] == "Admitted with fever"
@@ -0,0 +1,23 @@
+from engine import extract_referral_fields, parse_scanned_form_fields
+from layout import PageLayout
+
+def test_gender_value_is_not_cut_at_its_own_label():
+    fields, _ = extract_referral_fields("Gender: Male\nAsha Verma")
+    assert fields["Gender"] == "male"
+
+    fields, _ = extract_referral_fields("Sex: Female\nCity Hospital")
+    assert fields["Gender"] == "female"
+
+def test_value_stops_at_the_next_field_label():
+    fields, _ = extract_referral_fields("Patient Name: Asha Verma Age: 34")
+    assert fields["Patient Name"] == "asha verma"
+    assert fields["Age"] == "34"
+
+def test_bare_label_does_not_take_the_next_label_as_its_value():
+    lines = ["Patient Name:", "Hospital: City Hospital", "Diagnosis: Dengue"]
+    words = [(text, 50.0 + 60.0 * j, 100.0 + 20.0 * i, 100.0 + 60.0 * j, 112.0 + 20.0 * i, 95.0, i)
+             for i, line in enumerate(lines) for j, text in enumerate(line.split())]
+    fields = parse_scanned_form_fields(PageLayout(words))
+    assert not fields.get("Patient Name")
+    assert fields["Hospital Name"] == "City Hospital"
+    assert fields["Diagnosis"] == "Dengue"
@@ -0,0 +1,179 @@
+"""
+Lightweight spans around the processing stages.
+
+A span times one stage (open, form fields, render, OCR, matching, field
+parsing) and carries a few attributes such as page, pages, bytes, DPI and
+whether the result came from the cache. Every span feeds process-wide
+per-stage metrics, exported in the Prometheus text format; inside a
+`trace(...)` block the spans of that document are also kept in order and
+can be exported as a JSON trace.
+
+Spans are cheap (two clock reads and a dict) and record nothing when
+tracing is switched off.
+
+Configuration (environment variables):
+    HOSPITAL_PDF_TRACING  "off" to disable spans and metrics (default: on)
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Numeric span attributes that are also summed into per-stage counters
+COUNTED_ATTRIBUTES = ("pages", "bytes")
+
+def tracing_enabled() -> bool:
+    return os.environ.get("HOSPITAL_PDF_TRACING", "").strip().lower() not in ("off", "0", "false", "no")
+
+class Span:
+    """An open span; attributes can be added until it ends."""
+
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    """Spans recorded for one document, in the order they ended; safe to share between threads."""
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.spans: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, seconds: float, attrs: Dict[str, Any]):
+        with self._lock:
+            self.spans.append({"name": name, "start": round(start - self.started, 6),
+                               "seconds": round(seconds, 6), **attrs})
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Count and total seconds per stage, slowest stage first."""
+        stages: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for span in self.spans:
+                stage = stages.setdefault(span["name"], {"stage": span["name"], "count": 0, "seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += span["seconds"]
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 4)
+        return sorted(stages.values(), key=lambda stage: stage["seconds"], reverse=True)
+
+    def to_json(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "document": self.name,
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "stages": self.summary(),
+            "spans": spans,
+        }
+
+class StageMetrics:
+    """Process-wide per-stage latency histograms and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, name: str, seconds: float, attrs: Dict[str, Any]):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0,
+                                              "counters": dict.fromkeys(COUNTED_ATTRIBUTES, 0),
+                                              "cache": {"hit": 0, "miss": 0}}
+            stage["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stage["sum"] += seconds
+            stage["count"] += 1
+            for key in COUNTED_ATTRIBUTES:
+                if isinstance(attrs.get(key), (int, float)):
+                    stage["counters"][key] += attrs[key]
+            if "cached" in attrs:
+                stage["cache"]["hit" if attrs["cached"] else "miss"] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: {**stage, "buckets": list(stage["buckets"]), "counters": dict(stage["counters"]),
+                           "cache": dict(stage["cache"])} for name, stage in self._stages.items()}
+
+    def prometheus_text(self) -> str:
+        """All stage metrics in the Prometheus text exposition format."""
+        stages = self.snapshot()
+        lines = [
+            "# HELP hospital_pdf_stage_seconds Time spent in each processing stage.",
+            "# TYPE hospital_pdf_stage_seconds histogram",
+        ]
+        for name, stage in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), stage["buckets"]):
+                cumulative += count
+                lines.append(f'hospital_pdf_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'hospital_pdf_stage_seconds_sum{{stage="{name}"}} {stage["sum"]:.6f}')
+            lines.append(f'hospital_pdf_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        for key in COUNTED_ATTRIBUTES:
+            lines.append(f"# HELP hospital_pdf_stage_{key}_total {key.capitalize()} handled by each processing stage.")
+            lines.append(f"# TYPE hospital_pdf_stage_{key}_total counter")
+            for name, stage in sorted(stages.items()):
+                if stage["counters"][key]:
+                    lines.append(f'hospital_pdf_stage_{key}_total{{stage="{name}"}} {stage["counters"][key]}')
+        lines.append("# HELP hospital_pdf_stage_cache_total Stage results served from the cache (hit) or computed (miss).")
+        lines.append("# TYPE hospital_pdf_stage_cache_total counter")
+        for name, stage in sorted(stages.items()):
+            for result, count in stage["cache"].items():
+                if count:
+                    lines.append(f'hospital_pdf_stage_cache_total{{stage="{name}",result="{result}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+metrics = StageMetrics()
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("hospital_pdf_trace", default=None)
+
+def _finish(name: str, start: float, seconds: float, attrs: Dict[str, Any]):
+    metrics.observe(name, seconds, attrs)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(name, start, seconds, attrs)
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Time the enclosed block as one stage; yields a Span whose set() adds attributes."""
+    if not tracing_enabled():
+        yield _NULL_SPAN
+        return
+    current = Span(name, attrs)
+    try:
+        yield current
+    finally:
+        _finish(name, current.start, time.perf_counter() - current.start, current.attrs)
+
+def record(name: str, seconds: float, **attrs):
+    """Record a stage timed elsewhere (e.g. on a worker thread) as a span ending now."""
+    if tracing_enabled():
+        now = time.perf_counter()
+        _finish(name, now - seconds, seconds, attrs)
+
+@contextmanager
+def trace(name: Optional[str] = None) -> Iterator[Trace]:
+    """Collect the spans of the enclosed block (one document's processing) into a Trace."""
+    document_trace = Trace(name)
+    token = _current_trace.set(document_trace)
+    try:
+        yield document_trace
+    finally:
+        _current_trace.reset(token)